@@ -0,0 +1,66 @@
+"""Bulk throughput: sequential `Customer.create_debit` vs `bulk.submit_debits`, and sequential
+`Customer.list_bank_accounts` vs `Customer.list_bank_accounts_many`, and concurrent lookups of a few hot
+customers with and without the ``coalesce`` option.
+
+The fake server answers every request after `latency` seconds, standing in for the network round trip.
+Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_bulk.py [debits] [latency]
+"""
+import sys
+import time
+
+import besepa
+from besepa import bulk
+from fake_server import FakeBesepaServer
+
+
+def report(label, calls, elapsed):
+    print("%-32s %6d calls  %8.3fs  %8.1f calls/s" % (label, calls, elapsed, calls / elapsed))
+
+
+def main(debits=400, latency=0.02):
+    with FakeBesepaServer(latency=latency) as server:
+        rows = [(str(i), {"amount": 100, "reference": "R%d" % i}) for i in range(debits)]
+
+        with besepa.Api(api_key="dummy", pool_maxsize=64) as api:
+            api.endpoint = server.url
+
+            start = time.time()
+            for customer_id, attributes in rows:
+                besepa.Customer({"id": customer_id}, api=api).create_debit(attributes)
+            report("sequential", debits, time.time() - start)
+
+            for concurrency in (4, 16, 64):
+                start = time.time()
+                failed = sum(not result.success() for result in bulk.submit_debits(rows, concurrency, api=api))
+                assert not failed
+                report("submit_debits(%d)" % concurrency, debits, time.time() - start)
+
+            ids = [customer_id for customer_id, _ in rows]
+            start = time.time()
+            for customer_id in ids:
+                besepa.Customer({"id": customer_id}, api=api).list_bank_accounts()
+            report("sequential list_bank_accounts", debits, time.time() - start)
+
+            for concurrency in (4, 16, 64):
+                start = time.time()
+                _, errors = besepa.Customer.list_bank_accounts_many(ids, concurrency, api=api)
+                assert not errors
+                report("list_bank_accounts_many(%d)" % concurrency, debits, time.time() - start)
+
+        # Every lookup hits one of 4 customers, as when many workers handle events of the same customers
+        hot = [str(i % 4) for i in range(debits)]
+        for coalesce in (False, True):
+            with besepa.Api(api_key="dummy", pool_maxsize=64, coalesce=coalesce) as api:
+                api.endpoint = server.url
+                server.reset()
+                start = time.time()
+                for _, _, error in bulk.imap(lambda customer_id: besepa.Customer.find(customer_id, api=api), hot, 64):
+                    assert error is None
+                report("find hot customers%s" % (", coalesced" if coalesce else ""), debits, time.time() - start)
+                print("%32s %6d requests sent" % ("", server.counters["requests"]))
+
+
+if __name__ == "__main__":
+    main(*[float(arg) if "." in arg else int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,41 @@
+"""`Api.handle_response` on large list pages, per JSON codec.
+
+The baseline decodes the body to `str` and parses it with the standard library, as `http_call` used to.
+Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_codec.py [customers per page] [repeat]
+"""
+import json
+import sys
+import timeit
+
+import besepa
+from besepa import codec
+from bench_memory import payload
+
+
+class Response(object):
+    status_code = 200
+
+
+def main(per_page=5000, repeat=20):
+    content = json.dumps({"response": payload(per_page)}).encode("utf-8")
+    response = Response()
+    print("page of %d customers, %.1f KiB" % (per_page, len(content) / 1024.0))
+
+    def baseline():
+        return json.loads(content.decode("utf-8")).get("response")
+
+    runs = [("decode + json.loads", baseline)]
+    for name, (_, available) in sorted(codec.__codecs__.items()):
+        if available:
+            api = besepa.Api(api_key="dummy", codec=name)
+            runs.append(("handle_response[%s]" % name, lambda api=api: api.handle_response(response, content)))
+
+    for label, func in runs:
+        elapsed = min(timeit.repeat(func, number=1, repeat=repeat))
+        print("%-26s %8.2f ms/page  %8.1f MiB/s" % (label, elapsed * 1000, len(content) / elapsed / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,116 @@
+"""Latency and throughput of the main SDK operations against the local fake Besepa server.
+
+Measures `Customer.find`, `Customer.all`, `Customer.create`, `Customer.create_debit`,
+`Customer.list_bank_accounts` and `bulk.submit_debits`. With the default zero server latency the
+numbers are dominated by SDK overhead (request building, HTTP handling, JSON and `Resource` conversion),
+which is what regresses between releases. Save a run with ``--save`` and check a later one against it
+with ``--compare``, which exits with status 1 when an operation lost more than ``--tolerance`` of its
+throughput. Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_endpoints.py --requests 500 --page-size 50 --save baseline.json
+    $ PYTHONPATH=. python benchmarks/bench_endpoints.py --requests 500 --page-size 50 --compare baseline.json
+"""
+import argparse
+import json
+import sys
+
+import besepa
+from besepa import bulk, util
+from fake_server import FakeBesepaServer
+
+
+def percentile(latencies, q):
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+def measure(name, call, count):
+    """Call `call(i)` `count` times, returning the throughput and the latency percentiles in a dict
+    """
+    latencies = []
+    start = util.monotonic()
+    for i in range(count):
+        begin = util.monotonic()
+        call(i)
+        latencies.append(util.monotonic() - begin)
+    elapsed = util.monotonic() - start
+    latencies.sort()
+    return {"name": name, "count": count, "ops": count / elapsed, "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99)}
+
+
+def measure_bulk(name, api, count, concurrency):
+    rows = [("CUS%08d" % i, {"amount": 100, "reference": "R%d" % i}) for i in range(count)]
+    start = util.monotonic()
+    failed = sum(not result.success() for result in bulk.submit_debits(rows, concurrency, api=api))
+    elapsed = util.monotonic() - start
+    assert not failed
+    return {"name": name, "count": count, "ops": count / elapsed, "p50": None, "p99": None}
+
+
+def report(result, baseline=None):
+    line = "%-24s %6d calls  %9.1f ops/s" % (result["name"], result["count"], result["ops"])
+    if result["p50"] is not None:
+        line += "  p50 %7.3fms  p99 %7.3fms" % (result["p50"] * 1000, result["p99"] * 1000)
+    if baseline is not None:
+        line += "  %+6.1f%%" % (100.0 * (result["ops"] / baseline["ops"] - 1))
+    print(line)
+
+
+def run(args):
+    with FakeBesepaServer(latency=args.latency, page_size=args.page_size, padding=args.padding) as server:
+        with besepa.Api(api_key="dummy", pool_maxsize=max(10, args.concurrency)) as api:
+            api.endpoint = server.url
+            customer = besepa.Customer({"id": "CUS00000001"}, api=api)
+
+            # Warm up the connection pool
+            besepa.Customer.find("CUS00000001", api=api)
+
+            count = args.requests
+            return [
+                measure("Customer.find", lambda i: besepa.Customer.find("CUS%08d" % i, api=api), count),
+                measure("Customer.all", lambda i: besepa.Customer.all(api=api), count),
+                measure("Customer.create", lambda i: besepa.Customer(
+                    {"name": "Customer %d" % i, "taxid": "%08dA" % i, "reference": "R%d" % i}, api=api).create(),
+                    count),
+                measure("Customer.create_debit", lambda i: customer.create_debit(
+                    {"amount": 100, "reference": "D%d" % i}), count),
+                measure("list_bank_accounts", lambda i: customer.list_bank_accounts(), count),
+                measure_bulk("submit_debits(%d)" % args.concurrency, api, count, args.concurrency),
+            ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=500, help="calls per operation")
+    parser.add_argument("--latency", type=float, default=0.0, help="server latency in seconds")
+    parser.add_argument("--page-size", type=int, default=50, help="objects per listing")
+    parser.add_argument("--padding", type=int, default=0, help="extra bytes per object")
+    parser.add_argument("--concurrency", type=int, default=16, help="bulk worker threads")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results saved in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput loss with --compare")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = dict((result["name"], result) for result in json.load(fp))
+
+    results = run(args)
+    for result in results:
+        report(result, baseline.get(result["name"]))
+
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    regressions = [result["name"] for result in results if result["name"] in baseline and
+                   result["ops"] < (1 - args.tolerance) * baseline[result["name"]]["ops"]]
+    if regressions:
+        print("Regressed: %s" % ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""Peak memory and throughput of `export.customers` as the number of customers grows.
+
+Peak memory, measured with tracemalloc, should stay flat: only the current page is held. Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_export.py [max customers] [page size]
+"""
+import io
+import sys
+import tracemalloc
+
+import besepa
+from besepa import export, util
+from fake_server import FakeBesepaServer
+
+
+def main(customers=50000, page_size=100):
+    totals = [customers // 25, customers // 5, customers]
+    for format in ("ndjson", "csv"):
+        for total in totals:
+            with FakeBesepaServer(total=total) as server, besepa.Api(api_key="dummy") as api:
+                api.endpoint = server.url
+                fp = io.StringIO()
+                # Discard the output as it is written, so only the export itself is measured
+                fp.write = len
+                tracemalloc.start()
+                start = util.monotonic()
+                rows = export.customers(fp, format, page_size=page_size, api=api)
+                elapsed = util.monotonic() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print("%-6s %8d customers  %7.2fs  %8.0f customers/s  peak %6.2f MiB" % (
+                    format, rows, elapsed, rows / elapsed, peak / 2.0 ** 20))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
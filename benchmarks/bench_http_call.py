@@ -0,0 +1,91 @@
+"""Transient memory allocated per `Api.http_call` on a large sandbox response, with DEBUG logging disabled.
+
+The network is replaced by a canned response so only the SDK's own work is measured. The legacy path
+reproduces the previous `http_call`, which formatted debug messages and decoded the body to `str` on
+every sandbox call, using the same codec for parsing. Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_http_call.py [customers per page]
+"""
+import datetime
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+from requests.structures import CaseInsensitiveDict
+
+import besepa
+from bench_memory import payload
+
+log = logging.getLogger("besepa.api")
+
+
+class CannedResponse(object):
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = CaseInsensitiveDict({"Content-Type": "application/json", "Content-Length": str(len(content))})
+
+
+class CannedSession(object):
+    def __init__(self, response):
+        self.response = response
+
+    def request(self, method, url, **kwargs):
+        return self.response
+
+
+def legacy_http_call(api, url, method, **kwargs):
+    log.info('Request[%s]: %s' % (method, url))
+    if api.mode.lower() != 'live':
+        log.debug("Level: " + api.mode)
+        log.debug('Request: \nHeaders: %s\nBody: %s' % (str(kwargs.get("headers", {})), str(kwargs.get("json", {}))))
+    start_time = datetime.datetime.now()
+    response = api.session.request(method, url, proxies=api.proxies, **kwargs)
+    duration = datetime.datetime.now() - start_time
+    log.info('Response[%d]: %s, Duration: %s.%ss.' % (
+        response.status_code, response.reason, duration.seconds, duration.microseconds))
+    if api.mode.lower() != 'live':
+        log.debug('Headers: %s\nBody: %s' % (str(response.headers), response.content.decode('utf-8')))
+    content = response.content.decode('utf-8')
+    return api.codec.loads(content).get('response')
+
+
+def measure(label, call, calls=20):
+    call()
+    tracemalloc.start()
+    transient = []
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        result = call()
+        retained, peak = tracemalloc.get_traced_memory()
+        # Memory allocated on top of the parsed result, e.g. copies of the body
+        transient.append(peak - retained)
+        del result
+    tracemalloc.stop()
+
+    start = time.time()
+    for _ in range(calls):
+        call()
+    elapsed = (time.time() - start) / calls
+    print("%-22s transient %8.1f KiB/call  %8.2f ms/call" % (label, max(transient) / 1024.0, elapsed * 1000))
+
+
+def main(per_page=2000):
+    content = json.dumps({"response": payload(per_page)}).encode("utf-8")
+    print("sandbox mode, response of %.1f KiB" % (len(content) / 1024.0))
+    url = "https://sandbox.besepa.com/api/1/customers"
+
+    for codec in ("json", None):
+        api = besepa.Api(api_key="dummy", codec=codec)
+        api.session = CannedSession(CannedResponse(content))
+        headers = api.headers()
+        measure("legacy[%s]" % api.codec.name, lambda: legacy_http_call(api, url, "GET", json=None, headers=headers))
+        measure("http_call[%s]" % api.codec.name, lambda: api.http_call(url, "GET", json=None, headers=headers))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
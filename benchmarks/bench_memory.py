@@ -0,0 +1,82 @@
+"""Memory used by a large result set of customers, measured with tracemalloc.
+
+Compares `Customer`, eager, lazy and projected to a few `fields`, with the dict-based Resource layout it
+replaced (instance `__dict__` plus two eager header dicts per object). Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_memory.py [customers]
+"""
+import sys
+import time
+import tracemalloc
+
+import besepa
+from besepa import customers, util
+from fake_server import customer
+
+
+class LegacyResource(object):
+    """Original Resource layout, kept for comparison
+    """
+    convert_resources = {}
+
+    def __init__(self, attributes=None, api=None):
+        attributes = attributes or {}
+        self.__dict__['api'] = api
+        super(LegacyResource, self).__setattr__('__data__', {})
+        super(LegacyResource, self).__setattr__('error', None)
+        super(LegacyResource, self).__setattr__('headers', {})
+        super(LegacyResource, self).__setattr__('header', {})
+        for k, v in attributes.items():
+            setattr(self, k, v)
+
+    def __getattr__(self, name):
+        return self.__data__.get(name)
+
+    def __setattr__(self, name, value):
+        try:
+            super(LegacyResource, self).__getattribute__(name)
+            super(LegacyResource, self).__setattr__(name, value)
+        except AttributeError:
+            self.__data__[name] = self.convert(name, value)
+
+    def convert(self, name, value):
+        if isinstance(value, dict):
+            return LegacyResource(value, api=self.api)
+        elif isinstance(value, list):
+            return [self.convert(name, obj) for obj in value]
+        return value
+
+
+def payload(count):
+    return [customer(i) for i in range(count)]
+
+
+def measure(label, cls, data, api):
+    start = time.time()
+    tracemalloc.start()
+    objects = [cls(elem, api=api) for elem in data]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-16s %8d objects  %8.1f MiB  %6.0f bytes/customer  %6.2fs" % (
+        label, len(objects), size / 2.0 ** 20, float(size) / len(objects), time.time() - start))
+    return size
+
+
+def main(count=100000):
+    api = besepa.Api(api_key="dummy")
+    data = payload(count)
+    legacy = measure("legacy Resource", LegacyResource, data, api)
+    compact = measure("Customer", customers.Customer, data, api)
+    print("saved %.0f%%" % (100.0 * (legacy - compact) / legacy))
+    lazy = measure("Customer (lazy)", customers.Customer, data, besepa.Api(api_key="dummy", lazy=True))
+    print("saved %.0f%%" % (100.0 * (legacy - lazy) / legacy))
+
+    # What `Customer.all(fields=...)` builds from the same page
+    fields = ["id", "reference", "status"]
+    projected = measure("Customer (fields)", lambda elem, api: customers.Customer(util.project(elem, fields), api=api),
+                        data, api)
+    print("saved %.0f%%" % (100.0 * (legacy - projected) / legacy))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,83 @@
+"""Per-call overhead of building headers and urls, before and after caching them.
+
+"before" reproduces the previous hot path: `Api.headers` built a new dict per call that `request` merged
+with `util.merge_dict`, urls were joined with `util.join_url`, and `Resource.http_headers` always merged
+two dicts. The end-to-end rows run `Customer.find` and `Customer.update` with `http_call` stubbed out, so
+only SDK work is timed. Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_overhead.py [calls]
+"""
+import sys
+import timeit
+
+import besepa
+from besepa import util
+
+
+class LegacyApi(besepa.Api):
+    """Api with the previous header and url building
+    """
+
+    def headers(self):
+        return {
+            "Authorization": ("Bearer %s" % self.api_key),
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "User-Agent": self.user_agent
+        }
+
+    def url(self, action):
+        return util.join_url(self.endpoint, action)
+
+    def request(self, url, method, body=None, headers=None):
+        http_headers = util.merge_dict(self.headers(), headers or {})
+        return self.http_call(url, method, json=body, headers=http_headers)
+
+
+class LegacyCustomer(besepa.Customer):
+    __slots__ = ()
+
+    @classmethod
+    def resource_path(cls, resource_id, name=None):
+        if name is None:
+            return util.join_url(cls.path, str(resource_id))
+        return util.join_url(cls.path, str(resource_id), name)
+
+    def http_headers(self, idempotency_key=None):
+        return util.merge_dict(self._header or {}, self._headers or {})
+
+
+def stub(api):
+    api.http_call = lambda url, method, **kwargs: {"id": "1", "name": "Ender"}
+    return api
+
+
+def main(calls=100000):
+    legacy, api = stub(LegacyApi(api_key="dummy", retry=False)), stub(besepa.Api(api_key="dummy", retry=False))
+    legacy_customer = LegacyCustomer({"id": "1", "name": "Ender"}, api=legacy)
+    customer = besepa.Customer({"id": "1", "name": "Ender"}, api=api)
+
+    runs = [
+        ("headers + merge", lambda: util.merge_dict(legacy.headers(), {}),
+         lambda: api.headers()),
+        ("url", lambda: legacy.url("api/1/customers/1"),
+         lambda: api.url("api/1/customers/1")),
+        ("resource path", lambda: LegacyCustomer.resource_path("1", "debits"),
+         lambda: besepa.Customer.resource_path("1", "debits")),
+        ("Resource.http_headers", legacy_customer.http_headers,
+         customer.http_headers),
+        ("Customer.find", lambda: LegacyCustomer.find("1", api=legacy),
+         lambda: besepa.Customer.find("1", api=api)),
+        ("Customer.update", lambda: legacy_customer.update({"name": "Ender"}),
+         lambda: customer.update({"name": "Ender"})),
+    ]
+    print("%-24s %12s %12s %8s" % ("", "before", "after", "saved"))
+    for label, before, after in runs:
+        before_time = min(timeit.repeat(before, number=calls, repeat=3)) / calls
+        after_time = min(timeit.repeat(after, number=calls, repeat=3)) / calls
+        print("%-24s %9.0f ns %9.0f ns %7.0f%%" % (label, before_time * 1e9, after_time * 1e9,
+                                                   100 * (1 - after_time / before_time)))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,50 @@
+"""Scaling of `parallel.iter_all` with the number of worker processes, against `Customer.iter_all`.
+
+Lists `customers` customers in pages of `page_size`, building resources on one core with `iter_all`, then
+parsing into dicts and into records of two fields with 1, 2, 4... workers up to the number of CPUs. The
+fake server runs in this process and shares its core with the fetching thread. Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_parallel.py [customers] [page size]
+"""
+import multiprocessing
+import sys
+
+import besepa
+from besepa import parallel, util
+from fake_server import FakeBesepaServer
+
+
+def report(label, rows, elapsed, baseline=None):
+    speedup = "  x%.2f" % (baseline / elapsed) if baseline else ""
+    print("%-28s %8d customers  %7.2fs  %9.0f customers/s%s" % (label, rows, elapsed, rows / elapsed, speedup))
+
+
+def measure(iterable):
+    start = util.monotonic()
+    rows = sum(1 for _ in iterable)
+    return rows, util.monotonic() - start
+
+
+def main(customers=100000, page_size=1000):
+    cpus = multiprocessing.cpu_count()
+    counts = sorted(set([1 << i for i in range(cpus.bit_length()) if 1 << i <= cpus] + [cpus]))
+    with FakeBesepaServer(total=customers, padding=200) as server, besepa.Api(api_key="dummy") as api:
+        api.endpoint = server.url
+        print("%d CPUs" % cpus)
+
+        rows, baseline = measure(besepa.Customer.iter_all(page_size=page_size, prefetch=True, api=api))
+        report("Customer.iter_all", rows, baseline)
+
+        for workers in counts:
+            rows, elapsed = measure(parallel.iter_all(besepa.Customer, page_size=page_size, workers=workers,
+                                                      api=api))
+            report("dicts, %d workers" % workers, rows, elapsed, baseline)
+
+        for workers in counts:
+            rows, elapsed = measure(parallel.iter_all(besepa.Customer, page_size=page_size, workers=workers,
+                                                      fields=["id", "bank_account.iban"], records=True, api=api))
+            report("records, %d workers" % workers, rows, elapsed, baseline)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
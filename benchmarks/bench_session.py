@@ -0,0 +1,40 @@
+"""Connection setup cost: one-shot ``requests.request`` vs the pooled ``Api`` session.
+
+Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_session.py [calls]
+"""
+import sys
+import time
+
+import requests
+
+import besepa
+from fake_server import FakeBesepaServer
+
+
+def run(label, server, call, calls):
+    server.reset()
+    start = time.time()
+    for _ in range(calls):
+        call()
+    elapsed = time.time() - start
+    print("%-22s %6d calls  %8.3fs  %8.1f calls/s  %6d connections" % (
+        label, calls, elapsed, calls / elapsed, server.counters["connections"]))
+
+
+def main(calls=2000):
+    with FakeBesepaServer() as server:
+        url = server.url + "/api/1/customers/1"
+
+        api = besepa.Api(api_key="dummy")
+        api.endpoint = server.url
+        headers = api.headers()
+
+        run("requests.request", server, lambda: requests.request("GET", url, headers=headers), calls)
+        with api:
+            run("Api (pooled session)", server, lambda: api.get("api/1/customers/1"), calls)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
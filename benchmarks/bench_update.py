@@ -0,0 +1,42 @@
+"""Cost of `Customer.update()` without arguments: the full `to_dict` body it used to send against the
+`changes` it sends now, for a customer holding `accounts` bank accounts.
+
+Body building and encoding are timed with `http_call` stubbed out, and the PATCH body size is reported.
+Run with::
+
+    $ PYTHONPATH=. python benchmarks/bench_update.py [calls] [accounts]
+"""
+import sys
+import timeit
+
+import besepa
+import fake_server
+
+
+def main(calls=20000, accounts=5):
+    api = besepa.Api(api_key="dummy", retry=False)
+    bodies = []
+    api.http_call = lambda url, method, **kwargs: bodies.append(api.codec.dumps(kwargs["json"])) or {}
+
+    data = fake_server.customer(1)
+    data["bank_accounts"] = [fake_server.bank_account(i) for i in range(accounts)]
+    customer = besepa.Customer.from_response(data, api=api)
+
+    def full():
+        customer.name = "Andrew Wiggin"
+        customer.update(customer.to_dict())
+
+    def changed():
+        customer.name = "Andrew Wiggin"
+        customer.update()
+
+    print("%-24s %12s %10s" % ("", "per update", "body"))
+    for label, update in (("to_dict body", full), ("changes body", changed), ("unchanged", customer.update)):
+        del bodies[:]
+        elapsed = min(timeit.repeat(update, number=calls, repeat=3)) / calls
+        size = len(bodies[-1]) if bodies else 0
+        print("%-24s %9.0f ns %8d B" % (label, elapsed * 1e9, size))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
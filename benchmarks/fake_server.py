@@ -0,0 +1,175 @@
+"""Local stand-in for the Besepa HTTP API used by the benchmarks.
+
+Serves customers, their bank accounts and debits below ``api/1/customers``, answering every request after
+`latency` seconds. Listings hold `page_size` objects, or the `per_page` of the query, out of `total` (endless
+by default), and each object carries `padding` extra bytes so response size can be varied. Unknown paths
+get a 404.
+
+Usage::
+
+    >>> with FakeBesepaServer(latency=0.01, page_size=50) as server:
+    ...     api = besepa.Api(api_key='dummy')
+    ...     api.endpoint = server.url
+"""
+import json
+import re
+
+try:  # pragma: no cover
+    from urllib.parse import parse_qsl
+except ImportError:  # pragma: no cover
+    from urlparse import parse_qsl
+import threading
+import time
+
+try:  # pragma: no cover
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+def customer(i, padding=0):
+    customer = {
+        "id": "CUS%08d" % i,
+        "name": "Customer %d" % i,
+        "taxid": "%08dA" % i,
+        "reference": "R%d" % i,
+        "status": "ACTIVE",
+        "bank_account": bank_account(i),
+    }
+    if padding:
+        customer["notes"] = "x" * padding
+    return customer
+
+
+def bank_account(i, padding=0):
+    account = {
+        "id": "BA%08d" % i,
+        "iban": "ES66000000000000000%05d" % (i % 100000),
+        "status": "ACTIVE",
+        "mandate": {"id": "MA%08d" % i, "signed_at": "2019-10-01T10:00:00Z", "status": "SIGNED"},
+    }
+    if padding:
+        account["notes"] = "x" * padding
+    return account
+
+
+def debit(i, padding=0):
+    debit = {
+        "id": "DEB%08d" % i,
+        "amount": 100,
+        "currency": "EUR",
+        "status": "READY",
+        "collect_at": "2019-10-15",
+        "reference": "D%d" % i,
+    }
+    if padding:
+        debit["notes"] = "x" * padding
+    return debit
+
+
+# Path patterns of the API stand-in, the builder of their objects, and whether they are collections
+ROUTES = [
+    (re.compile(r"^api/1/customers$"), customer, True),
+    (re.compile(r"^api/1/customers/(?P<id>[^/]+)$"), customer, False),
+    (re.compile(r"^api/1/customers/[^/]+/bank_accounts$"), bank_account, True),
+    (re.compile(r"^api/1/customers/[^/]+/debits$"), debit, True),
+]
+
+
+class FakeBesepaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between requests
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; avoid Nagle stalls on kept-alive sockets
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self):
+        self.server.count("requests")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length).decode("utf-8")) if length else {}
+
+        path, _, query = self.path.partition("?")
+        status, response = self.route(path.strip("/"), dict(parse_qsl(query)), body)
+        content = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def route(self, path, query, body):
+        padding = self.server.padding
+        for pattern, build, collection in ROUTES:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            if collection and self.command == "GET":
+                per_page = int(query.get("per_page", self.server.page_size))
+                start = (int(query.get("page", 1)) - 1) * per_page
+                end = start + per_page if self.server.total is None else min(start + per_page, self.server.total)
+                return 200, {"response": [build(i, padding) for i in range(start, end)]}
+            obj = build(self.server.count("objects"), padding)
+            obj.update(match.groupdict())
+            # Echo the posted attributes, unwrapping the {"customer": {...}} envelope of `Create.create`
+            if isinstance(body, dict):
+                obj.update(body.get(build.__name__, body))
+            return 201 if self.command == "POST" else 200, {"response": obj}
+        return 404, {"error": "not found"}
+
+    do_GET = do_POST = do_PATCH = do_DELETE = respond
+
+
+class FakeBesepaServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    request_queue_size = 128
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, page_size=50, padding=0, total=None):
+        HTTPServer.__init__(self, (host, port), FakeBesepaHandler)
+        self.latency = latency
+        self.page_size = page_size
+        self.padding = padding
+        self.total = total
+        self.counters = {"connections": 0, "requests": 0, "objects": 0}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%s" % self.server_address
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+            return self.counters[name]
+
+    def reset(self):
+        with self.lock:
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,5 +1,8 @@
 __version__ = "0.3.2"
 
-from besepa.api import Api, configure, set_config  # noqa
-from besepa.customers import Customer  # noqa
+from besepa.api import Api, configure, set_config, use  # noqa
+from besepa.customers import BankAccount, Customer, Mandate  # noqa
+from besepa.debits import Debit, Subscription  # noqa
 from besepa.exceptions import MissingConfig, ResourceNotFound, UnauthorizedAccess  # noqa
+from besepa.groups import Group  # noqa
+from besepa.webhooks import Webhook  # noqa
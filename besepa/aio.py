@@ -0,0 +1,385 @@
+"""asyncio support for the Besepa SDK (Python 3.5+ only, requires ``aiohttp``)
+
+Usage::
+
+    >>> import besepa
+    >>> from besepa.aio import AsyncApi
+    >>> api = AsyncApi(mode="sandbox", api_key='API_KEY')
+    >>> customer = await besepa.Customer.afind("1", api=api)
+    >>> await customer.acreate_debit({...})
+"""
+import asyncio
+import logging
+import weakref
+
+from besepa import exceptions, util
+from besepa.api import Api
+from besepa.api import default as default_api
+from besepa.idempotency import IDEMPOTENCY_HEADER
+
+try:  # pragma: no cover
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+# Transport failures retried by the default `AsyncApi` retry policy
+TRANSPORT_ERRORS = (asyncio.TimeoutError,) + ((aiohttp.ClientConnectionError,) if aiohttp else ())
+
+log = logging.getLogger(__name__)
+
+
+class AsyncResponse(object):
+    """Buffered aiohttp response exposing the attributes `Api.handle_response` and the exceptions rely on
+    """
+
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+
+def close_sessions(sessions):
+    """Close the aiohttp `sessions`, by event loop, of the loops closed since they were created. Their
+    connections died with their loop, so closing them needs no IO and runs in any loop, or in a new one.
+    """
+    closing = [sessions.pop(loop).close() for loop in list(sessions) if loop.is_closed()]
+    if closing and util.running_loop():
+        for coroutine in closing:
+            asyncio.ensure_future(coroutine)
+    elif closing:
+        loop = asyncio.new_event_loop()
+        try:
+            for coroutine in closing:
+                loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+
+class AsyncApi(Api):
+    """API object whose `get`, `post`, `patch` and `delete` are coroutines
+
+    Accepts the same options as :class:`besepa.Api`. An aiohttp session is created on first use in each event
+    loop, so the object can be built outside of the event loops it is used in, e.g. across `asyncio.run` calls.
+
+    Usage::
+
+        >>> async with AsyncApi(mode="sandbox", api_key='API_KEY') as api:
+        ...     customers = await api.get("api/1/customers")
+    """
+
+    def build_session(self):
+        # aiohttp sessions by event loop, as they cannot be used from another one
+        self.sessions = {}
+        weakref.finalize(self, close_sessions, self.sessions)
+        return None
+
+    def build_retry_policy(self):
+        policy = super(AsyncApi, self).build_retry_policy()
+        if self.options.get("retry", True) is True:
+            policy.errors += TRANSPORT_ERRORS
+        return policy
+
+    def get_session(self):
+        """Returns the aiohttp session of the running event loop, or the one assigned to `session`, creating it
+        on first use. Sessions of the event loops closed since are closed in the running one.
+        """
+        if self.session is not None:
+            return self.session
+        loop = asyncio.get_event_loop()
+        session = self.sessions.get(loop)
+        if session is None:
+            if aiohttp is None:
+                raise exceptions.MissingConfig("AsyncApi requires aiohttp. Install it with `pip install aiohttp`")
+            close_sessions(self.sessions)
+            connector = aiohttp.TCPConnector(limit=self.options.get("pool_maxsize", 100),
+                                             force_close=not self.options.get("keep_alive", True))
+            session = self.sessions[loop] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    async def close(self):
+        """Release the pooled connections held by this API object in the running event loop, and in the ones
+        closed since
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        loop = asyncio.get_event_loop()
+        for other in [other for other in self.sessions if other is loop or other.is_closed()]:
+            await self.sessions.pop(other).close()
+
+    def __enter__(self):
+        raise TypeError("AsyncApi is closed asynchronously, use `async with` instead of `with`")
+
+    def __exit__(self, *exc_info):  # pragma: no cover
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self, url, method, body=None, headers=None, raw=False):
+        """Coroutine version of :meth:`besepa.Api.request`
+        """
+        http_headers = self.headers()
+        if headers:
+            http_headers.update(headers)
+
+        idempotent = IDEMPOTENCY_HEADER in http_headers
+        attempt = 1
+        while True:
+            try:
+                if raw:
+                    return await self.http_call(url, method, raw=True, json=body, headers=http_headers)
+                return await self.http_call(url, method, json=body, headers=http_headers)
+            # Format Error message for bad request
+            except exceptions.BadRequest as error:
+                if raw:
+                    raise
+                return {"error": self.codec.loads(error.content)}
+            except (exceptions.ConnectionError,) + TRANSPORT_ERRORS as error:
+                delay = self.retry_policy.next_delay(method, url, attempt, error, idempotent)
+                if delay is None:
+                    raise
+                self.retry_event(method, url, attempt, delay, error)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def http_call(self, url, method, raw=False, **kwargs):
+        """Makes a http call. Logs response information. See :meth:`besepa.Api.http_call` for `raw`.
+        """
+        log.info('Request[%s]: %s', method, url)
+
+        proxy = (self.proxies or {}).get(url.split(':', 1)[0])
+        self.encode_body(kwargs)
+        validated, stored = self.conditional(method, url, kwargs) if not raw else (False, None)
+        event = self.start_event(method, url, kwargs)
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            start = util.monotonic()
+            async with self.get_session().request(method, url, proxy=proxy, **kwargs) as received:
+                response = AsyncResponse(received.status, received.reason, received.headers, await received.read())
+            self.finish_event(event, response, start)
+            log.info('Response[%d]: %s, Duration: %.6fs.', response.status_code, response.reason, event.latency)
+            self.pace(response)
+
+            if validated and response.status_code == 304:
+                log.info('Not modified, reusing stored response')
+                self.validators.count(True)
+                return stored
+            if raw and 200 <= response.status_code <= 299:
+                result = response.content
+            else:
+                result = self.handle_response(response, response.content)
+        except Exception as error:
+            self.fail_event(event, error)
+            raise
+        if not raw:
+            self.revalidated(method, url, validated, response, result)
+        return result
+
+    async def get(self, action, headers=None):
+        """Make GET request
+
+        Usage::
+
+            >>> await api.get("api/1/customers")
+        """
+        url = self.url(action)
+        if self.cache is None:
+            return await self.coalesced_get(url, headers)
+
+        hit, response = self.cache.get(action)
+        if hit:
+            return response
+        generation = self.cache.generation
+        response = await self.coalesced_get(url, headers)
+        # A 400 answer comes back as an ``{"error": ...}`` object, which is not cached
+        if not (isinstance(response, dict) and 'error' in response):
+            self.cache.set(action, response, generation)
+        return response
+
+    async def coalesced_get(self, url, headers=None):
+        """Coroutine version of :meth:`besepa.Api.coalesced_get`. The shared request runs in its own task, so
+        cancelling one of the callers does not cancel it for the others.
+        """
+        if self.flights is None:
+            return await self.request(url, 'GET', headers=headers or {})
+        tasks = self.flights.tasks
+        key = (asyncio.get_event_loop(), self.flight_key(url, headers))
+        task = tasks.get(key)
+        self.flights.count(task is not None)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(self.request(url, 'GET', headers=headers or {}))
+            task.add_done_callback(lambda _: tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def get_content(self, action, headers=None):
+        """Coroutine version of :meth:`besepa.Api.get_content`
+        """
+        return await self.request(self.url(action), 'GET', headers=headers or {}, raw=True)
+
+    async def post(self, action, params=None, headers=None, idempotency_key=None):
+        """Make POST request, see :meth:`besepa.Api.post` for idempotency keys
+
+        Usage::
+
+            >>> await api.post("api/1/customers", {'name': 'Ender Wiggin', 'taxid': '68571053A', 'reference: C1'})
+        """
+        url = self.url(action)
+        headers = headers or {}
+        key = self.idempotency_key(headers, idempotency_key)
+        if key is None:
+            try:
+                return await self.request(url, 'POST', body=params or {}, headers=headers)
+            finally:
+                self.invalidate(action)
+
+        record = self.replay(key)
+        if record is not None:
+            return record['response']
+        headers = util.merge_dict(headers, {IDEMPOTENCY_HEADER: key})
+        if self.idempotency_store is not None:
+            self.idempotency_store.sent(key, url)
+        try:
+            response = await self.request(url, 'POST', body=params or {}, headers=headers)
+        finally:
+            self.invalidate(action)
+        if self.idempotency_store is not None:
+            self.idempotency_store.completed(key, url, response)
+        return response
+
+    async def patch(self, action, params=None, headers=None):
+        """Make PATCH request
+
+        Usage::
+
+            >>> await api.patch("api/1/customers/1", {'name': 'Andrew Wiggins'})
+        """
+        try:
+            return await self.request(self.url(action), 'PATCH', body=params or {},
+                                      headers=headers or {})
+        finally:
+            self.invalidate(action)
+
+    async def delete(self, action, headers=None):
+        """Make DELETE request
+        """
+        try:
+            return await self.request(self.url(action), 'DELETE', headers=headers or {})
+        finally:
+            self.invalidate(action)
+
+
+__async_apis__ = weakref.WeakKeyDictionary()
+
+
+def async_api(api=None):
+    """Returns an `AsyncApi` for the given api object, or for the default one.
+
+    A synchronous `Api` gets a companion `AsyncApi` built from the same options, so resources fetched with
+    the blocking client can also use the coroutine methods. The companion shares the rate limiter, caches,
+    hooks and GETs in flight of `api`, and follows its current `endpoint` and `api_key`.
+    """
+    api = api or default_api()
+    if isinstance(api, AsyncApi):
+        return api
+    companion = __async_apis__.get(api)
+    if companion is None:
+        companion = __async_apis__[api] = AsyncApi(api.options)
+        companion.rate_limiter = api.rate_limiter
+        companion.cache = api.cache
+        companion.validators = api.validators
+        companion.hooks = api.hooks
+        companion.flights = api.flights
+    if companion.endpoint != api.endpoint:
+        companion.endpoint = api.endpoint
+    if companion.api_key != api.api_key:
+        companion.api_key = api.api_key
+    return companion
+
+
+async def get(path, cls, api=None, fields=None):
+    """GET `path` and build `cls` objects from a response that may be a JSON object or a JSON Array, keeping
+    only `fields` of the objects of a JSON Array when given. The objects are bound to `api`, which may be a
+    synchronous `Api`.
+    """
+    response = await async_api(api).get(path)
+    if isinstance(response, list):
+        if fields:
+            response = [util.project(elem, fields) for elem in response]
+        return [cls.from_response(elem, api=api) for elem in response]
+    return cls.from_response(response, api=api)
+
+
+async def find(cls, resource_id, api=None, fields=None):
+    client = async_api(api)
+    url = cls.resource_path(resource_id)
+    if not fields:
+        return cls.from_response(await client.get(url), api=api)
+    query = client.fields_params(fields)
+    if query:
+        url = util.join_url_params(url, query)
+    response = await client.get(url)
+    return cls.from_response(response if 'error' in response else util.project(response, fields), api=api)
+
+
+async def list_all(cls, params=None, api=None, fields=None):
+    query = async_api(api).fields_params(fields) if fields else None
+    if query:
+        params = util.merge_dict(params or {}, query)
+    url = cls.path if params is None else util.join_url_params(cls.path, params)
+    return await get(url, cls.list_class, api=api, fields=fields)
+
+
+async def create(resource, idempotency_key=None):
+    payload = {resource.payload_name(): resource.to_dict()}
+    new_attributes = await async_api(resource.api).post(resource.path, payload,
+                                                        resource.http_headers(idempotency_key))
+    resource.error = None
+    resource.merge(new_attributes)
+    return resource.success()
+
+
+async def update(resource, attributes=None):
+    if not attributes:
+        attributes = resource.changes() if resource._loaded else resource.to_dict()
+    if not attributes:
+        return resource.success()
+    url = resource.resource_path(resource['id'])
+    new_attributes = await async_api(resource.api).patch(url, attributes, resource.http_headers())
+    resource.error = None
+    resource.merge(new_attributes)
+    if resource.success() and isinstance(attributes, dict):
+        resource.mark_clean(attributes)
+    return resource.success()
+
+
+async def delete(resource):
+    url = resource.resource_path(resource['id'])
+    new_attributes = await async_api(resource.api).delete(url)
+    resource.error = None
+    resource.merge(new_attributes)
+    return resource.success()
+
+
+async def post(resource, name, attributes=None, cls=None, fieldname='id', idempotency_key=None):
+    from besepa.resource import Resource
+
+    api = resource.api
+    cls = cls or Resource
+    attributes = attributes or {}
+    url = resource.resource_path(resource[fieldname], name)
+    if not isinstance(attributes, Resource):
+        attributes = Resource(attributes, api=api)
+    new_attributes = await async_api(api).post(url, attributes.to_dict(), attributes.http_headers(idempotency_key))
+    if isinstance(cls, Resource):
+        cls.error = None
+        cls.merge(new_attributes)
+        return resource.success()
+    else:
+        return cls.from_response(new_attributes, api=api)
@@ -1,14 +1,23 @@
-import datetime
-import json
 import logging
 import os
 import platform
 import ssl
+import threading
+import time
+from contextlib import contextmanager
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from besepa import __version__, exceptions, util
-from besepa.config import __endpoint_map__
+from besepa.cache import ResponseCache, ValidatorCache
+from besepa.codec import get_codec
+from besepa.config import __endpoint_map__, __rate_limit_map__
+from besepa.idempotency import COMPLETED, IDEMPOTENCY_HEADER, new_key
+from besepa.metrics import RequestEvent
+from besepa.ratelimit import RateLimiter, parse_retry_after
+from besepa.retry import RetryPolicy
+from besepa.singleflight import SingleFlight
 
 log = logging.getLogger(__name__)
 
@@ -39,65 +48,355 @@ class Api(object):
         # Mandatory parameter, so not using `dict.get`
         self.api_key = kwargs["api_key"]
         self.proxies = kwargs.get("proxies", None)
+        # Convert nested response objects on first access instead of up front, see `Resource`
+        self.lazy = kwargs.get("lazy", False)
 
         self.options = kwargs
+        self.codec = self.build_codec()
+        self.session = self.build_session()
+        self.rate_limiter = self.build_rate_limiter()
+        self.retry_policy = self.build_retry_policy()
+        self.idempotency_store = kwargs.get("idempotency_store", None)
+        self.cache = self.build_cache()
+        self.validators = self.build_validators()
+        self.flights = self.build_flights()
+        # Instrumentation, see `besepa.metrics`
+        self.hooks = list(kwargs.get("hooks", ()))
+
+    def build_codec(self):
+        """JSON codec from the ``codec`` option: a name, a codec object, or None for the fastest installed
+        """
+        codec = self.options.get("codec", None)
+        if codec is None or isinstance(codec, str):
+            return get_codec(codec)
+        return codec
+
+    def build_session(self):
+        """Build the pooled HTTP session shared by every call made through this API object.
+
+        Connection pooling can be tuned with the ``pool_connections``, ``pool_maxsize`` and
+        ``pool_block`` options, and persistent connections disabled with ``keep_alive=False``.
+        A ``session`` option reuses an existing session, which `close` then leaves open.
+        """
+        if self.options.get("session") is not None:
+            return self.options["session"]
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.options.get("pool_connections", 10),
+                              pool_maxsize=self.options.get("pool_maxsize", 10),
+                              pool_block=self.options.get("pool_block", False))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.options.get("keep_alive", True):
+            session.headers["Connection"] = "close"
+        return session
+
+    def build_rate_limiter(self):
+        """Build the client side rate limiter from the ``rate_limit`` option.
+
+        ``rate_limit`` is either requests per second, a dict of them keyed by mode, or a `RateLimiter`,
+        which can be shared by several API objects. Defaults to the mode's entry in `__rate_limit_map__`.
+        """
+        rate_limit = self.options.get("rate_limit", __rate_limit_map__)
+        if isinstance(rate_limit, RateLimiter):
+            return rate_limit
+        if isinstance(rate_limit, dict):
+            rate_limit = rate_limit.get(self.mode)
+        return RateLimiter(rate_limit)
+
+    def build_retry_policy(self):
+        """Build the retry policy from the ``retry`` option: a `RetryPolicy`, or False to never retry.
+
+        By default idempotent GET and DELETE requests are retried on connection errors and 429/5xx responses.
+        """
+        retry = self.options.get("retry", True)
+        if isinstance(retry, RetryPolicy):
+            return retry
+        return RetryPolicy() if retry else RetryPolicy(max_attempts=1)
+
+    def build_cache(self):
+        """Build the GET response cache from the ``cache`` option: a `ResponseCache`, True for the default
+        one, or None (the default) to disable caching
+        """
+        cache = self.options.get("cache", None)
+        if cache is True:
+            return ResponseCache()
+        return cache if cache is not False else None
+
+    def build_validators(self):
+        """Build the conditional GET store from the ``conditional`` option: a `ValidatorCache`, True for the
+        default one, or None (the default) to never send conditional requests
+        """
+        conditional = self.options.get("conditional", None)
+        if conditional is True:
+            return ValidatorCache()
+        return conditional if conditional is not False else None
+
+    def build_flights(self):
+        """Build the registry of GETs in flight from the ``coalesce`` option: a `SingleFlight`, True for a new
+        one, or None (the default) to send every GET
+        """
+        coalesce = self.options.get("coalesce", None)
+        if coalesce is True:
+            return SingleFlight()
+        return coalesce if coalesce is not False else None
+
+    def fields_params(self, fields):
+        """Query parameters requesting only `fields` from the API, e.g. ``{'fields': 'id,status'}``, when the
+        ``fields_param`` option names the API's sparse fieldset parameter. Empty otherwise, and projections
+        are only applied client side.
+        """
+        param = self.options.get("fields_param", None)
+        return {param: ','.join(fields)} if param else {}
+
+    def conditional(self, method, url, kwargs):
+        """Add the validators of the previous response of a GET to the `kwargs` headers.
+
+        Returns a ``(validated, response)`` tuple, `response` being what to answer on 304 Not Modified.
+        """
+        if method != 'GET' or self.validators is None:
+            return False, None
+        conditional, response = self.validators.lookup(url)
+        if not conditional:
+            return False, None
+        kwargs['headers'] = util.merge_dict(kwargs.get('headers') or {}, conditional)
+        return True, response
+
+    def revalidated(self, method, url, validated, response, result):
+        """Store the validators of a GET response, and count conditional requests
+        """
+        if method != 'GET' or self.validators is None:
+            return
+        if validated:
+            self.validators.count(False)
+        self.validators.store(url, response.headers, result)
+
+    def add_hook(self, hook):
+        """Register a `besepa.metrics.Hooks` object to be told about every request made by this API object
+        """
+        self.hooks.append(hook)
+        return hook
+
+    def emit(self, name, event):
+        """Call the `name` method of every hook with `event`, logging hooks that fail
+        """
+        for hook in self.hooks:
+            try:
+                getattr(hook, name)(event)
+            except Exception:
+                log.exception('Hook %r failed on %s', hook, name)
+
+    def start_event(self, method, url, kwargs):
+        event = RequestEvent(method, url, bytes_out=len(kwargs.get('data') or b''))
+        if self.hooks:
+            self.emit('on_request', event)
+        return event
+
+    def finish_event(self, event, response, start):
+        """Record the outcome of the request `event` and tell the hooks about it
+        """
+        event.latency = util.monotonic() - start
+        event.status = response.status_code
+        event.bytes_in = len(response.content)
+        event.debug_id = response.headers.get('Besepa-Debug-Id')
+        if self.hooks:
+            self.emit('on_response', event)
+
+    def fail_event(self, event, error):
+        event.error = error
+        if self.hooks:
+            self.emit('on_error', event)
+
+    def retry_event(self, method, url, attempt, delay, error):
+        if self.hooks:
+            self.emit('on_retry', RequestEvent(method, url, error=error, attempt=attempt, delay=delay))
+
+    def invalidate(self, action):
+        """Drop cached responses made stale by a change to `action`
+        """
+        if self.cache is not None:
+            self.cache.invalidate(action)
+
+    def clone(self, **options):
+        """Returns a new API object with this one's options overridden by `options`, e.g. another ``api_key``
+        for a different tenant.
+
+        The clone shares the pooled connections, codec, retry policy and hooks of this API object. It gets
+        its own rate limiter, caches, GETs in flight and no idempotency store, as those hold state tied to the
+        credentials.
+
+        Usage::
+
+            >>> tenant_api = api.clone(api_key='TENANT_API_KEY')
+        """
+        rate_limit = self.options.get("rate_limit", __rate_limit_map__)
+        kwargs = util.merge_dict(self.options, {
+            "session": self.session,
+            "codec": self.codec,
+            "retry": self.retry_policy,
+            "hooks": self.hooks,
+            "rate_limit": self.rate_limiter.max_rate if isinstance(rate_limit, RateLimiter) else rate_limit,
+            "cache": ResponseCache(self.cache.maxsize, self.cache.ttl, dict(self.cache.ttls), self.cache.clock)
+            if self.cache is not None else None,
+            "conditional": ValidatorCache(self.validators.maxsize) if self.validators is not None else None,
+            "idempotency_store": None,
+            "coalesce": SingleFlight() if self.flights is not None else None,
+        })
+        return self.__class__(util.merge_dict(kwargs, options))
+
+    def close(self):
+        """Release the pooled connections held by this API object, unless its session was given
+        """
+        if self.options.get("session") is None:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def default_endpoint(self):
         return __endpoint_map__.get(self.mode)
 
-    def request(self, url, method, body=None, headers=None):
+    @property
+    def endpoint(self):
+        return self._endpoint
+
+    @endpoint.setter
+    def endpoint(self, endpoint):
+        self._endpoint = endpoint
+        # Prefix of every request url, see `url`
+        self._prefix = endpoint.rstrip('/') + '/' if endpoint else '/'
+
+    @property
+    def api_key(self):
+        return self._api_key
+
+    @api_key.setter
+    def api_key(self, api_key):
+        self._api_key = api_key
+        # Default headers only change with the api key, see `headers`
+        self._headers = {
+            "Authorization": ("Bearer %s" % api_key),
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "User-Agent": self.user_agent
+        }
+
+    def url(self, action):
+        """Absolute url of `action`, the same as ``util.join_url(self.endpoint, action)``
+        """
+        return self._prefix + action.lstrip('/')
+
+    def request(self, url, method, body=None, headers=None, raw=False):
         """Make HTTP call, formats response and does error handling. Uses http_call method in API class.
 
+        With `raw`, successful responses are returned as unparsed bytes and a 400 raises `BadRequest`.
+
         Usage::
 
             >>> api.request("https://sandbox.besepa.com/api/1/customers", "GET", {})
             >>> api.request("https://sandbox.besepa.com/api/1/customers", "POST",
              "{'name': 'Ender Wiggin', 'taxid': '68571053A', 'reference: C1'}", {} )
         """
-        http_headers = util.merge_dict(self.headers(), headers or {})
-
-        try:
-            return self.http_call(url, method, json=body, headers=http_headers)
-        # Format Error message for bad request
-        except exceptions.BadRequest as error:
-            return {"error": json.loads(error.content)}
-
-    def http_call(self, url, method, **kwargs):
+        http_headers = self.headers()
+        if headers:
+            http_headers.update(headers)
+
+        idempotent = IDEMPOTENCY_HEADER in http_headers
+        attempt = 1
+        while True:
+            try:
+                if raw:
+                    return self.http_call(url, method, raw=True, json=body, headers=http_headers)
+                return self.http_call(url, method, json=body, headers=http_headers)
+            # Format Error message for bad request
+            except exceptions.BadRequest as error:
+                if raw:
+                    raise
+                return {"error": self.codec.loads(error.content)}
+            except (exceptions.ConnectionError, requests.RequestException) as error:
+                delay = self.retry_policy.next_delay(method, url, attempt, error, idempotent)
+                if delay is None:
+                    raise
+                self.retry_event(method, url, attempt, delay, error)
+                time.sleep(delay)
+                attempt += 1
+
+    def http_call(self, url, method, raw=False, **kwargs):
         """Makes a http call. Logs response information.
-        """
-        log.info('Request[%s]: %s' % (method, url))
 
-        if self.mode.lower() != 'live':
-            request_headers = kwargs.get("headers", {})
-            request_body = kwargs.get("json", {})
-            log.debug("Level: " + self.mode)
-            log.debug('Request: \nHeaders: %s\nBody: %s' % (str(request_headers), str(request_body)))
-        else:  # pragma: no cover
+        `raw` skips parsing of successful responses, and conditional requests
+        """
+        log.info('Request[%s]: %s', method, url)
+
+        # Full requests and responses are only logged outside live mode, and only formatted when DEBUG is on
+        debug = self.mode != 'live' and log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug('Level: %s', self.mode)
+            log.debug('Request: \nHeaders: %s\nBody: %s', kwargs.get("headers", {}), kwargs.get("json", {}))
+        elif self.mode == 'live':  # pragma: no cover
             log.info('Not logging full request/response headers and body in live mode for compliance')
 
-        start_time = datetime.datetime.now()
-        response = requests.request(method, url, proxies=self.proxies, **kwargs)
-        duration = datetime.datetime.now() - start_time
-        log.info('Response[%d]: %s, Duration: %s.%ss.' % (
-            response.status_code, response.reason, duration.seconds, duration.microseconds))
-
-        debug_id = response.headers.get('Besepa-Debug-Id')
-        if debug_id:  # pragma: no cover
-            log.debug('debug_id: %s' % debug_id)
-        if self.mode.lower() != 'live':  # pragma: no cover
-            log.debug('Headers: %s\nBody: %s' % (str(response.headers), response.content.decode('utf-8')))
+        self.encode_body(kwargs)
+        validated, stored = self.conditional(method, url, kwargs) if not raw else (False, None)
+        event = self.start_event(method, url, kwargs)
+        self.rate_limiter.acquire()
+        try:
+            start = util.monotonic()
+            response = self.session.request(method, url, proxies=self.proxies, **kwargs)
+            self.finish_event(event, response, start)
+            log.info('Response[%d]: %s, Duration: %.6fs.', response.status_code, response.reason, event.latency)
+            self.pace(response)
+
+            if event.debug_id:
+                log.debug('debug_id: %s', event.debug_id)
+            if debug:
+                log.debug('Headers: %s\nBody: %s', response.headers, response.content.decode('utf-8', 'replace'))
+
+            if validated and response.status_code == 304:
+                log.info('Not modified, reusing stored response')
+                self.validators.count(True)
+                return stored
+            if raw and 200 <= response.status_code <= 299:
+                result = response.content
+            else:
+                result = self.handle_response(response, response.content)
+        except Exception as error:
+            self.fail_event(event, error)
+            raise
+        if not raw:
+            self.revalidated(method, url, validated, response, result)
+        return result
+
+    def encode_body(self, kwargs):
+        """Replace the `json` request argument by its encoding with the api codec
+        """
+        body = kwargs.pop("json", None)
+        if body is not None:
+            kwargs["data"] = self.codec.dumps(body)
 
-        return self.handle_response(response, response.content.decode('utf-8'))
+    def pace(self, response):
+        """Feed the response back to the rate limiter so it adapts to the server's limits
+        """
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if response.status_code == 429 or retry_after:
+            log.warning('Throttled by Besepa[%d], Retry-After: %s', response.status_code, retry_after)
+            self.rate_limiter.throttle(retry_after)
+        else:
+            self.rate_limiter.succeed()
 
-    @staticmethod
-    def handle_response(response, content):
-        """Validate HTTP response
+    def handle_response(self, response, content):
+        """Validate HTTP response, parsing successful `content` bytes with the api codec
         """
         status = response.status_code
+        if 200 <= status <= 299:
+            return self.codec.loads(content).get('response') if content else {}
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+
         if status in (301, 302, 303, 307):
             raise exceptions.Redirection(response, content)
-        elif 200 <= status <= 299:
-            return json.loads(content).get('response') if content else {}
         elif status == 400:
             raise exceptions.BadRequest(response, content)
         elif status == 401:
@@ -114,6 +413,8 @@ class Api(object):
             raise exceptions.ResourceGone(response, content)
         elif status == 422:
             raise exceptions.ResourceInvalid(response, content)
+        elif status == 429:
+            raise exceptions.TooManyRequests(response, content)
         elif 401 <= status <= 499:
             raise exceptions.ClientError(response, content)
         elif 500 <= status <= 599:
@@ -122,33 +423,107 @@ class Api(object):
             raise exceptions.ConnectionError(response, content, "Unknown response code: #{response.code}")
 
     def headers(self):
-        """Default HTTP headers
+        """Default HTTP headers, built when the api key is set. Returns a copy the caller can modify
         """
-        return {
-            "Authorization": ("Bearer %s" % self.api_key),
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "User-Agent": self.user_agent
-        }
+        return self._headers.copy()
 
     def get(self, action, headers=None):
-        """Make GET request
+        """Make GET request, answered from the ``cache`` option when it holds a fresh response, and shared
+        with identical GETs in flight with the ``coalesce`` option, see `besepa.singleflight`
 
         Usage::
 
             >>> api.get("api/1/customers")
             >>> api.get("api/1/customers/1")
         """
-        return self.request(util.join_url(self.endpoint, action), 'GET', headers=headers or {})
+        url = self.url(action)
+        if self.cache is None:
+            return self.coalesced_get(url, headers)
+
+        hit, response = self.cache.get(action)
+        if hit:
+            return response
+        generation = self.cache.generation
+        response = self.coalesced_get(url, headers)
+        # A 400 answer comes back as an ``{"error": ...}`` object, which is not cached
+        if not (isinstance(response, dict) and 'error' in response):
+            self.cache.set(action, response, generation)
+        return response
+
+    def flight_key(self, url, headers=None):
+        """Key of a GET of `url` among the requests in flight: the url, credentials and extra headers
+        """
+        return self.api_key, url, tuple(sorted(headers.items())) if headers else None
+
+    def coalesced_get(self, url, headers=None):
+        """GET `url`, sharing the request with identical GETs in flight when the ``coalesce`` option is set
+        """
+        if self.flights is None:
+            return self.request(url, 'GET', headers=headers or {})
+        return self.flights.do(self.flight_key(url, headers), lambda: self.request(url, 'GET', headers=headers or {}))
+
+    def get_content(self, action, headers=None):
+        """Make GET request and return the body of the response as unparsed bytes, bypassing the response
+        cache and validators, e.g. to parse it elsewhere
 
-    def post(self, action, params=None, headers=None):
+        Usage::
+
+            >>> api.get_content("api/1/customers?per_page=1000")
+            b'{"response": [...]}'
+        """
+        return self.request(self.url(action), 'GET', headers=headers or {}, raw=True)
+
+    def idempotency_key(self, headers, idempotency_key=None):
+        """Idempotency key for a POST: the given one, the one in `headers`, or a new one when the
+        ``idempotency_keys`` option is set
+        """
+        key = idempotency_key or headers.get(IDEMPOTENCY_HEADER)
+        if key is None and self.options.get("idempotency_keys", False):
+            key = new_key()
+        return key
+
+    def replay(self, key):
+        """Returns the stored record of an already completed idempotency key, if any
+        """
+        record = self.idempotency_store.get(key) if self.idempotency_store is not None else None
+        if record is not None and record['state'] == COMPLETED:
+            log.info('Idempotency-Key %s already completed, not sending it again', key)
+            return record
+        return None
+
+    def post(self, action, params=None, headers=None, idempotency_key=None):
         """Make POST request
 
+        A POST with an idempotency key, given as `idempotency_key` or as an `Idempotency-Key` header, is
+        retried like a GET, and answered from the ``idempotency_store`` option when already completed.
+
         Usage::
 
             >>> api.post("api/1/customers", {'name': 'Ender Wiggin', 'taxid': '68571053A', 'reference: C1'})
+            >>> api.post("api/1/customers/1/debits", {'amount': 100}, idempotency_key='debit-C1-2019-10')
         """
-        return self.request(util.join_url(self.endpoint, action), 'POST', body=params or {}, headers=headers or {})
+        url = self.url(action)
+        headers = headers or {}
+        key = self.idempotency_key(headers, idempotency_key)
+        if key is None:
+            try:
+                return self.request(url, 'POST', body=params or {}, headers=headers)
+            finally:
+                self.invalidate(action)
+
+        record = self.replay(key)
+        if record is not None:
+            return record['response']
+        headers = util.merge_dict(headers, {IDEMPOTENCY_HEADER: key})
+        if self.idempotency_store is not None:
+            self.idempotency_store.sent(key, url)
+        try:
+            response = self.request(url, 'POST', body=params or {}, headers=headers)
+        finally:
+            self.invalidate(action)
+        if self.idempotency_store is not None:
+            self.idempotency_store.completed(key, url, response)
+        return response
 
     def patch(self, action, params=None, headers=None):
         """Make PATCH request
@@ -157,39 +532,88 @@ class Api(object):
 
             >>> api.patch("api/1/customers/1", {'name': 'Andrew Wiggins'})
         """
-        return self.request(util.join_url(self.endpoint, action), 'PATCH', body=params or {}, headers=headers or {})
+        try:
+            return self.request(self.url(action), 'PATCH', body=params or {},
+                                headers=headers or {})
+        finally:
+            self.invalidate(action)
 
     def delete(self, action, headers=None):
         """Make DELETE request
         """
-        return self.request(util.join_url(self.endpoint, action), 'DELETE', headers=headers or {})
+        try:
+            return self.request(self.url(action), 'DELETE', headers=headers or {})
+        finally:
+            self.invalidate(action)
 
 
 __api__ = None
+__lock__ = threading.Lock()
+# API object of the current thread or asyncio task, see `use`
+__context_api__ = util.context_var('besepa_api')
 
 
 def default():
     """Returns default api object and if not present creates a new one
     By default points to developer sandbox
+
+    The api object set with `use` for the current thread or asyncio task takes precedence.
     """
+    api = __context_api__.get()
+    if api is not None:
+        return api
+    api = __api__
+    if api is None:
+        api = create_default()
+    return api
+
+
+def create_default():
     global __api__
-    if __api__ is None:
-        try:
-            api_key = os.environ["BESEPA_API_KEY"]
-        except KeyError:
-            raise exceptions.MissingConfig("Required BESEPA_API_KEY. \
-                Refer http://docs.besepaen.apiary.io/#introduction/authorization")
+    with __lock__:
+        # Another thread may have created it while this one was waiting for the lock
+        if __api__ is None:
+            try:
+                api_key = os.environ["BESEPA_API_KEY"]
+            except KeyError:
+                raise exceptions.MissingConfig("Required BESEPA_API_KEY. \
+                    Refer http://docs.besepaen.apiary.io/#introduction/authorization")
 
-        __api__ = Api(mode=os.environ.get("BESEPA_MODE", "sandbox"), api_key=api_key)
-    return __api__
+            __api__ = Api(mode=os.environ.get("BESEPA_MODE", "sandbox"), api_key=api_key)
+        return __api__
 
 
 def set_config(options=None, **config):
     """Create new default api object with given configuration
     """
     global __api__
-    __api__ = Api(options or {}, **config)
-    return __api__
+    api = Api(options or {}, **config)
+    with __lock__:
+        __api__ = api
+    return api
+
+
+@contextmanager
+def use(api):
+    """Make `api` the default api object of the current thread or asyncio task within the block, e.g. to
+    serve several tenants with their own credentials. Tasks and threads started elsewhere are not affected.
+
+    Before Python 3.7, which has no `contextvars`, it is scoped to threads only, and raises `InvalidConfig`
+    inside a running asyncio event loop, where tasks would share it: pass ``api=`` to each call instead.
+
+    Usage::
+
+        >>> with besepa.use(default().clone(api_key='TENANT_API_KEY')):
+        ...     customers = besepa.Customer.all()
+    """
+    if util.ContextVar is None and util.running_loop():
+        raise exceptions.InvalidConfig("besepa.use is scoped to threads before Python 3.7, "
+                                       "pass api= in asyncio tasks instead")
+    token = __context_api__.set(api)
+    try:
+        yield api
+    finally:
+        __context_api__.reset(token)
 
 
 configure = set_config
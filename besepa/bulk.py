@@ -0,0 +1,134 @@
+"""Concurrent bulk operations
+
+Usage::
+
+    >>> from besepa import bulk
+    >>> for result in bulk.submit_debits([('CUS1', {...}), ('CUS2', {...})], concurrency=8):
+    ...     if not result.success():
+    ...         print(result.customer_id, result.error)
+    >>> for result in bulk.list_bank_accounts(['CUS1', 'CUS2'], concurrency=8):
+    ...     print(result.customer_id, result.bank_accounts or result.error)
+"""
+import json
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from besepa import exceptions
+from besepa.api import default as default_api
+from besepa.customers import Customer
+
+DEFAULT_CONCURRENCY = 8
+
+# Errors reported per item instead of aborting the whole batch
+ITEM_ERRORS = (exceptions.ConnectionError, requests.RequestException)
+
+
+def imap(func, items, concurrency=DEFAULT_CONCURRENCY, errors=ITEM_ERRORS):
+    """Call `func` for every element of `items` on a pool of `concurrency` threads.
+
+    Yields ``(item, result, error)`` tuples in completion order. At most ``2 * concurrency`` items are
+    pulled from `items` ahead of the results, so arbitrarily long iterables run in constant memory.
+    Exceptions listed in `errors` are yielded as the item's error; anything else stops the batch.
+    """
+    items = iter(items)
+    window = 2 * concurrency
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+
+        def fill():
+            for item in items:
+                pending[executor.submit(func, item)] = item
+                if len(pending) >= window:
+                    break
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield item, future.result(), None
+                except errors as error:
+                    yield item, None, error
+            fill()
+
+
+def check(resource):
+    """Returns `resource`, or raises `BadRequest` when it was built from a 400 answer, which `Api.request`
+    returns as an ``{"error": ...}`` dict instead of raising
+    """
+    if resource.error is not None:
+        raise exceptions.BadRequest(None, json.dumps(resource.error))
+    return resource
+
+
+class DebitResult(namedtuple('DebitResult', 'customer_id attributes debit error')):
+    """Outcome of a single debit submitted through `submit_debits`
+    """
+    __slots__ = ()
+
+    def success(self):
+        return self.error is None
+
+
+def submit_debits(debits, concurrency=DEFAULT_CONCURRENCY, api=None, idempotency_key=None):
+    """Create many debits concurrently, streaming a `DebitResult` per debit as soon as it finishes.
+
+    `debits` is an iterable of ``(customer_id, attributes)`` pairs. A failing debit, e.g. one rejected
+    with a `ClientError` such as `BadRequest`, is reported in its result and the rest of the batch carries on.
+    The api object is shared by all workers, so give it a `pool_maxsize` of at least `concurrency`.
+
+    `idempotency_key`, called as ``idempotency_key(customer_id, attributes)``, derives a stable key for each
+    debit. Combined with an api `idempotency_store`, an interrupted run can then simply be started again:
+    debits already created are answered from the store and the rest are sent, without duplicates.
+
+    Usage::
+
+        >>> results = bulk.submit_debits(((row.customer, {'amount': row.amount}) for row in rows), 16)
+        >>> results = bulk.submit_debits(rows, 16, idempotency_key=lambda customer, debit: debit['reference'])
+    """
+    api = api or default_api()
+
+    def submit(debit):
+        customer_id, attributes = debit
+        key = idempotency_key(customer_id, attributes) if idempotency_key else None
+        return check(Customer({'id': customer_id}, api=api).create_debit(attributes, idempotency_key=key))
+
+    for (customer_id, attributes), debit, error in imap(submit, debits, concurrency):
+        yield DebitResult(customer_id, attributes, debit, error)
+
+
+class BankAccountsResult(namedtuple('BankAccountsResult', 'customer_id bank_accounts error')):
+    """Bank accounts of a single customer fetched through `list_bank_accounts`
+    """
+    __slots__ = ()
+
+    def success(self):
+        return self.error is None
+
+
+def list_bank_accounts(customer_ids, concurrency=DEFAULT_CONCURRENCY, api=None):
+    """List the bank accounts of many customers concurrently, streaming a `BankAccountsResult` per customer
+    as soon as its accounts arrive.
+
+    `bank_accounts` is always a list of `Resource`. A customer whose request fails, e.g. with
+    `ResourceNotFound` or `BadRequest`, gets its error in its result and the other customers carry on.
+
+    Usage::
+
+        >>> for result in bulk.list_bank_accounts(customer_ids, concurrency=32):
+        ...     mandates[result.customer_id] = [account.mandate for account in result.bank_accounts or []]
+    """
+    api = api or default_api()
+
+    def fetch(customer_id):
+        bank_accounts = Customer({'id': customer_id}, api=api).list_bank_accounts()
+        if not isinstance(bank_accounts, list):
+            bank_accounts = [bank_accounts]
+        return [check(account) for account in bank_accounts]
+
+    for customer_id, bank_accounts, error in imap(fetch, customer_ids, concurrency):
+        yield BankAccountsResult(customer_id, bank_accounts, error)
@@ -0,0 +1,161 @@
+"""Response caches for GET requests: `ResponseCache` answers fresh responses locally, `ValidatorCache`
+revalidates them with conditional requests
+
+Usage::
+
+    >>> cache = ResponseCache(maxsize=10000, ttl=60, ttls={'api/1/customers': 300})
+    >>> api = besepa.Api(api_key='...', cache=cache)
+    >>> besepa.Customer.find('1', api=api)  # network
+    >>> besepa.Customer.find('1', api=api)  # cache hit
+    >>> cache.stats()
+    {'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1}
+"""
+import threading
+from collections import OrderedDict
+
+from besepa import util
+
+
+def base_path(path):
+    return path.split('?', 1)[0].strip('/')
+
+
+class ResponseCache(object):
+    """Thread-safe LRU cache of parsed GET responses keyed by API path, holding up to `maxsize` entries.
+
+    Entries expire after `ttl` seconds, or after the TTL of the longest matching path prefix in `ttls`;
+    a TTL of 0 disables caching for that path. Cached responses are shared between callers and must not be
+    modified in place.
+
+    `invalidate` is called by `Api` on every POST, PATCH and DELETE and drops the changed path, everything
+    below it, and the listings of its parents, e.g. PATCH ``api/1/customers/1`` drops ``api/1/customers/1``,
+    ``api/1/customers/1/bank_accounts`` and ``api/1/customers?page=2``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, ttls=None, clock=util.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = sorted(((base_path(path), ttl) for path, ttl in (ttls or {}).items()),
+                           key=lambda item: len(item[0]), reverse=True)
+        self.clock = clock
+
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def ttl_for(self, path):
+        path = base_path(path)
+        for prefix, ttl in self.ttls:
+            if path == prefix or path.startswith(prefix + '/'):
+                return ttl
+        return self.ttl
+
+    def get(self, path):
+        """Returns a ``(hit, response)`` tuple for `path`
+        """
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is None or entry[0] <= self.clock():
+                self.misses += 1
+                return False, None
+            # Re-insert as most recently used
+            self.entries[path] = entry
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, path, response, generation=None):
+        """Store `response`, unless the cache was invalidated since `generation` was read
+        """
+        ttl = self.ttl_for(path)
+        if ttl <= 0:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries.pop(path, None)
+            self.entries[path] = (self.clock() + ttl, response)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path):
+        path = base_path(path)
+        parts = path.split('/')
+        parents = set('/'.join(parts[:i]) for i in range(1, len(parts)))
+        with self.lock:
+            self.generation += 1
+            for key in list(self.entries):
+                key_path = base_path(key)
+                if key_path in parents or key_path == path or key_path.startswith(path + '/'):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ValidatorCache(object):
+    """Thread-safe LRU of `ETag` / `Last-Modified` validators and parsed responses of GET requests, by URL.
+
+    `Api` sends the stored validators as `If-None-Match` / `If-Modified-Since` and, when the server answers
+    304 Not Modified, returns the stored response without transferring or parsing the body again.
+    Stored responses are shared between callers and must not be modified in place.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, url):
+        """Returns the conditional request headers for `url` and the response they validate, or ``({}, None)``
+        """
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is None:
+                return {}, None
+            self.entries[url] = entry
+            return entry
+
+    def store(self, url, headers, response):
+        """Remember `response` if its `headers` carry validators
+        """
+        conditional = {}
+        if headers.get('ETag'):
+            conditional['If-None-Match'] = headers['ETag']
+        if headers.get('Last-Modified'):
+            conditional['If-Modified-Since'] = headers['Last-Modified']
+        with self.lock:
+            self.entries.pop(url, None)
+            if conditional:
+                self.entries[url] = (conditional, response)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+
+    def count(self, not_modified):
+        with self.lock:
+            if not_modified:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
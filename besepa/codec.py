@@ -0,0 +1,79 @@
+"""JSON codecs used to encode request bodies and parse responses
+
+`Api` uses the fastest codec installed, orjson, then ujson, then the standard library `json`, unless one
+is chosen with the ``codec`` option. Codecs parse responses straight from bytes and encode to bytes.
+
+Usage::
+
+    >>> api = besepa.Api(api_key='...', codec='json')
+"""
+import json
+import sys
+
+from besepa import exceptions
+
+try:  # pragma: no cover
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:  # pragma: no cover
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+class JSONCodec(object):
+    """Standard library codec
+    """
+    name = 'json'
+
+    def loads(self, content):
+        # json.loads only accepts bytes from Python 3.6
+        if isinstance(content, bytes) and sys.version_info < (3, 6):  # pragma: no cover
+            content = content.decode('utf-8')
+        return json.loads(content)
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonCodec(object):
+    name = 'orjson'
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+
+class UjsonCodec(object):
+    name = 'ujson'
+
+    def loads(self, content):
+        return ujson.loads(content)
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+__codecs__ = {
+    'json': (JSONCodec, True),
+    'orjson': (OrjsonCodec, orjson is not None),
+    'ujson': (UjsonCodec, ujson is not None),
+}
+
+
+def get_codec(name=None):
+    """Returns the codec called `name`, or the fastest one installed
+    """
+    if name is None:
+        name = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'
+    try:
+        codec, available = __codecs__[name]
+    except KeyError:
+        raise exceptions.InvalidConfig("JSON codec invalid", "Received: %s" % name, "Required: json, orjson or ujson")
+    if not available:
+        raise exceptions.MissingConfig("JSON codec %s is not installed" % name)
+    return codec()
@@ -2,3 +2,10 @@ __endpoint_map__ = {
     "live": "https://api.besepa.com",
     "sandbox": "https://sandbox.besepa.com",
 }
+
+# Client side rate limit in requests per second by mode. None sends requests as fast as possible until the
+# API answers 429 Too Many Requests, then paces them from the rate observed so far, see `RateLimiter`.
+__rate_limit_map__ = {
+    "live": None,
+    "sandbox": None,
+}
@@ -1,7 +1,25 @@
-from besepa import util
-from besepa.resource import Create, Delete, Find, List, Post, Resource, Update
+from besepa.debits import Debit, Subscription
+from besepa.resource import Create, Delete, Find, List, Post, Resource, Update, register
 
 
+@register('mandate', 'mandates')
+class Mandate(Resource):
+    """SEPA mandate signed for a bank account, found nested in bank accounts
+    """
+    __slots__ = ()
+    fields = ('id', 'reference', 'status', 'signed_at', 'signature_type', 'mandate_type', 'scheme', 'url',
+              'created_at')
+
+
+@register('bank_account', 'bank_accounts', 'debtor_bank_account', 'creditor_bank_account')
+class BankAccount(Resource):
+    """Bank account of a customer, see `Customer.create_bank_account` and `Customer.list_bank_accounts`
+    """
+    __slots__ = ()
+    fields = ('id', 'iban', 'bic', 'bank_name', 'status', 'customer_id', 'mandate', 'created_at')
+
+
+@register('customer', 'customers')
 class Customer(List, Find, Create, Delete, Update, Post):
     """Customer class wrapping the REST api/1/customers endpoint
 
@@ -12,29 +30,72 @@ class Customer(List, Find, Create, Delete, Update, Post):
         >>> customer = Customer.new({})
         >>> customer.create()  # return True or False
     """
+    __slots__ = ()
     path = "api/1/customers"
+    fields = ('id', 'name', 'taxid', 'reference', 'contact_name', 'contact_email', 'contact_phone',
+              'address_street', 'address_city', 'address_postalcode', 'address_state', 'address_country',
+              'status', 'group_ids', 'bank_accounts', 'created_at')
 
-    def create_bank_account(self, attributes):
+    def create_bank_account(self, attributes, idempotency_key=None):
         # /customers/<CUSTOMER-ID>/bank_accounts
-        return self.post('bank_accounts', attributes)
+        return self.post('bank_accounts', attributes, BankAccount, idempotency_key=idempotency_key)
 
     def list_bank_accounts(self):
         # /customers/<CUSTOMER-ID>/bank_accounts
-        endpoint = util.join_url(self.path, str(self['id']), 'bank_accounts')
-        response = self.api.get(endpoint)
-        try:
-            return Resource(response, api=self.api)
-        except AttributeError:
-            # To handle the case when response is JSON Array
-            if isinstance(response, list):
-                new_resp = [Resource(elem, api=self.api) for elem in response]
-                return new_resp
-
-    def create_debit(self, attributes):
-        # /customers/invoices/<CUSTOMER-ID>/debits
-        return self.post('debits', attributes)
-
-
-Customer.convert_resources['bank_accounts'] = Resource
-Customer.convert_resources['bank_account'] = Resource
-Customer.convert_resources['mandate'] = Resource
+        return self.list_nested('bank_accounts', BankAccount)
+
+    def list_debits(self):
+        # /customers/<CUSTOMER-ID>/debits
+        return self.list_nested('debits', Debit)
+
+    def create_subscription(self, attributes, idempotency_key=None):
+        # /customers/<CUSTOMER-ID>/subscriptions
+        return self.post('subscriptions', attributes, Subscription, idempotency_key=idempotency_key)
+
+    def list_subscriptions(self):
+        # /customers/<CUSTOMER-ID>/subscriptions
+        return self.list_nested('subscriptions', Subscription)
+
+    def list_nested(self, name, cls):
+        """GET the `name` resources of this customer as `cls` objects
+        """
+        response = self.api.get(self.resource_path(self['id'], name))
+        # The response is a JSON Array
+        if isinstance(response, list):
+            return [cls.from_response(elem, api=self.api) for elem in response]
+        return cls.from_response(response, api=self.api)
+
+    @classmethod
+    def list_bank_accounts_many(cls, ids, concurrency=None, api=None):
+        """List the bank accounts of many customers concurrently, see :func:`besepa.bulk.list_bank_accounts`
+
+        Returns a ``(bank_accounts, errors)`` tuple of dicts keyed by customer id, holding the list of bank
+        accounts of every customer fetched, and the error of every customer that failed.
+
+        Usage::
+
+            >>> accounts, errors = Customer.list_bank_accounts_many(['CUS1', 'CUS2'], concurrency=16)
+        """
+        from besepa import bulk
+        bank_accounts, errors = {}, {}
+        for result in bulk.list_bank_accounts(ids, concurrency or bulk.DEFAULT_CONCURRENCY, api=api):
+            if result.success():
+                bank_accounts[result.customer_id] = result.bank_accounts
+            else:
+                errors[result.customer_id] = result.error
+        return bank_accounts, errors
+
+    def create_debit(self, attributes, idempotency_key=None):
+        # /customers/<CUSTOMER-ID>/debits
+        return self.post('debits', attributes, Debit, idempotency_key=idempotency_key)
+
+    def acreate_bank_account(self, attributes, idempotency_key=None):
+        return self.apost('bank_accounts', attributes, BankAccount, idempotency_key=idempotency_key)
+
+    def alist_bank_accounts(self):
+        from besepa import aio
+        endpoint = self.resource_path(self['id'], 'bank_accounts')
+        return aio.get(endpoint, BankAccount, api=self.api)
+
+    def acreate_debit(self, attributes, idempotency_key=None):
+        return self.apost('debits', attributes, Debit, idempotency_key=idempotency_key)
@@ -0,0 +1,33 @@
+from besepa.resource import Delete, Find, List, register
+
+
+@register('debit', 'debits')
+class Debit(List, Find):
+    """Debit class wrapping the REST api/1/debits endpoint. Debits are created with `Customer.create_debit`
+
+    Usage::
+
+        >>> debits = Debit.all({'status': 'READY'})
+        >>> debit = Debit.find("DEB1")
+    """
+    __slots__ = ()
+    path = "api/1/debits"
+    fields = ('id', 'reference', 'description', 'amount', 'currency', 'status', 'collect_at', 'sent_at',
+              'metadata', 'customer_id', 'debtor_bank_account_id', 'customer', 'debtor_bank_account',
+              'creditor_bank_account', 'created_at')
+
+
+@register('subscription', 'subscriptions')
+class Subscription(List, Find, Delete):
+    """Subscription class wrapping the REST api/1/subscriptions endpoint. Subscriptions are created with
+    `Customer.create_subscription`, and deleting one cancels it
+
+    Usage::
+
+        >>> subscriptions = Subscription.all()
+        >>> Subscription.find("SUB1").delete()
+    """
+    __slots__ = ()
+    path = "api/1/subscriptions"
+    fields = ('id', 'reference', 'status', 'starts_at', 'renew_at', 'setup_fee', 'product', 'customer_id',
+              'debtor_bank_account_id', 'metadata', 'created_at')
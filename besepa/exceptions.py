@@ -86,6 +86,12 @@ class ResourceInvalid(ClientError):
     pass
 
 
+class TooManyRequests(ClientError):
+    """429 Too Many Requests
+    """
+    pass
+
+
 class ServerError(ConnectionError):
     """5xx Server Error
     """
@@ -0,0 +1,199 @@
+"""Streaming export of resources to NDJSON or CSV
+
+Resources are fetched page by page and written as they arrive, so memory use does not grow with the
+number of resources exported. With a `checkpoint` file, an interrupted export resumes after the last page
+written: open the output in append mode and call the export again with the same checkpoint. Seekable
+outputs are first truncated to the end of that page, dropping any part of the page the interruption cut.
+
+Usage::
+
+    >>> from besepa import export
+    >>> with open('customers.csv', 'a') as fp:
+    ...     export.customers(fp, format='csv', fields=['id', 'name', 'bank_account.iban'],
+    ...                      checkpoint='customers.checkpoint')
+"""
+import csv
+import io
+import json
+import os
+import sys
+
+from besepa import exceptions, util
+from besepa.api import default as default_api
+from besepa.customers import Customer
+
+FORMATS = ('ndjson', 'csv')
+
+PY2 = sys.version_info < (3,)
+
+
+def flatten(data, prefix=''):
+    """Flatten nested dicts and lists into a single dict with dotted keys
+
+    Usage::
+
+        >>> export.flatten({'id': '1', 'bank_account': {'iban': 'ES66', 'mandate': {'status': 'SIGNED'}}})
+        {'id': '1', 'bank_account.iban': 'ES66', 'bank_account.mandate.status': 'SIGNED'}
+    """
+    flat = {}
+    items = enumerate(data) if isinstance(data, list) else data.items()
+    for key, value in items:
+        key = '%s%s' % (prefix, key)
+        if isinstance(value, (dict, list)) and value:
+            flat.update(flatten(value, key + '.'))
+        else:
+            flat[key] = value
+    return flat
+
+
+def encode(value):
+    """`value` encoded to UTF-8 when it is text, for the byte oriented csv module of Python 2
+    """
+    return value.encode('utf-8') if isinstance(value, type(u'')) else value
+
+
+def csv_text(elements, fields, header=False):
+    """CSV lines of the flattened `elements` in the `fields` columns, after a `header` line when set
+    """
+    if PY2:  # pragma: no cover
+        elements = [dict((encode(key), encode(value)) for key, value in elem.items()) for elem in elements]
+        fields = [encode(field) for field in fields]
+    buffer = io.BytesIO() if PY2 else io.StringIO()
+    writer = csv.DictWriter(buffer, fields, extrasaction='ignore', lineterminator='\n')
+    if header:
+        writer.writeheader()
+    writer.writerows(elements)
+    return buffer.getvalue().decode('utf-8') if PY2 else buffer.getvalue()
+
+
+def write(fp, text):
+    """Write `text` to `fp`, encoded to UTF-8 for the byte files returned by `open` on Python 2
+    """
+    if PY2 and not isinstance(fp, io.TextIOBase):  # pragma: no cover
+        text = text.encode('utf-8')
+    fp.write(text)
+
+
+def tell(fp):
+    """Position of `fp`, or None when it is not seekable
+    """
+    try:
+        return fp.tell()
+    except (AttributeError, IOError, ValueError):
+        return None
+
+
+class Checkpoint(object):
+    """Progress of an export, kept in a JSON file at `path` that is replaced atomically after every page.
+
+    The `page_size` and `params` of the listing are recorded too, as the saved page only points at the
+    same rows when the export is resumed with the same ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.page = 0
+        self.rows = 0
+        self.fields = None
+        self.offset = None
+        self.page_size = None
+        self.params = None
+        if os.path.exists(path):
+            with open(path) as fp:
+                state = json.load(fp)
+            self.page, self.rows, self.fields, self.offset = (state['page'], state['rows'], state['fields'],
+                                                              state['offset'])
+            self.page_size, self.params = state.get('page_size'), state.get('params')
+
+    def check(self, page_size, params):
+        """Raise `InvalidConfig` when `page_size` or `params` differ from those of the saved progress
+        """
+        # Compare the params as read back from JSON
+        params = json.loads(json.dumps(params))
+        # Checkpoints saved without them can not be checked
+        if self.page and self.page_size is not None and (self.page_size, self.params) != (page_size, params):
+            raise exceptions.InvalidConfig(
+                "Export checkpoint %s was saved for another listing" % self.path,
+                "Received: page_size=%s, params=%s" % (page_size, params),
+                "Required: page_size=%s, params=%s" % (self.page_size, self.params))
+
+    def save(self, page, rows, fields, offset, page_size=None, params=None):
+        self.page, self.rows, self.fields, self.offset = page, rows, fields, offset
+        self.page_size, self.params = page_size, params
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'page': page, 'rows': rows, 'fields': fields, 'offset': offset, 'page_size': page_size,
+                       'params': params}, fp)
+        if os.name == 'nt':  # pragma: no cover
+            # os.rename does not replace existing files on Windows
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        os.rename(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def export(cls, fp, format='ndjson', fields=None, params=None, page_size=100, checkpoint=None, prefetch=True,
+           api=None):
+    """Write every `cls` resource to the text file object `fp`, one page at a time. Returns the number of rows.
+    On Python 2, `fp` may also be a file returned by `open`, which gets UTF-8.
+
+    `format` is ``ndjson``, one JSON object per line, or ``csv``, with nested objects flattened into dotted
+    columns such as ``bank_account.mandate.status``. `fields` selects dotted fields to export; without it, CSV
+    columns are those of the first page. `checkpoint` is the path of a file recording the last page
+    written, removed once the export completes. Resuming with another `page_size` or `params` than the
+    interrupted export raises `InvalidConfig`, since its pages would hold other rows. A page rejected by the
+    API raises `BadRequest`, keeping the checkpoint of the pages written before it.
+    """
+    if format not in FORMATS:
+        raise exceptions.InvalidConfig("Export format invalid", "Received: %s" % format, "Required: ndjson or csv")
+    api = api or default_api()
+    state = Checkpoint(checkpoint) if checkpoint else None
+    rows = state.rows if state else 0
+    fields = list(fields) if fields else (state.fields if state else None)
+    params = dict(params or {})
+    resumed = state is not None and state.page > 0
+    # The listing the checkpoint is valid for, whatever page it starts from
+    listing = dict((key, value) for key, value in params.items() if key != 'page')
+    if state:
+        state.check(page_size, listing)
+    if resumed:
+        params['page'] = state.page + 1
+        if state.offset is not None:
+            fp.seek(state.offset)
+            fp.truncate()
+
+    header = not resumed
+    for page, elements in cls.iter_pages(params, page_size, prefetch, api):
+        # Only the current page is held in memory
+        if format == 'csv':
+            elements = [flatten(elem) for elem in elements]
+            if fields is None:
+                fields = sorted(set().union(*elements))
+            write(fp, csv_text(elements, fields, header))
+            header = False
+        else:
+            if fields:
+                elements = [util.project(elem, fields) for elem in elements]
+            write(fp, u''.join(api.codec.dumps(elem).decode('utf-8') + u'\n' for elem in elements))
+        rows += len(elements)
+        if state:
+            fp.flush()
+            state.save(page, rows, fields, tell(fp), page_size, listing)
+    if state:
+        state.clear()
+    return rows
+
+
+def customers(fp, format='ndjson', fields=None, params=None, page_size=100, checkpoint=None, prefetch=True,
+              api=None):
+    """Export every customer, see `export`
+
+    Usage::
+
+        >>> with open('customers.ndjson', 'w') as fp:
+        ...     export.customers(fp)
+    """
+    return export(Customer, fp, format, fields, params, page_size, checkpoint, prefetch, api)
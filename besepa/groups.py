@@ -0,0 +1,16 @@
+from besepa.resource import Create, Delete, Find, List, Update, register
+
+
+@register('group', 'groups')
+class Group(List, Find, Create, Delete, Update):
+    """Group class wrapping the REST api/1/groups endpoint
+
+    Usage::
+
+        >>> group = Group({'name': 'Premium', 'reference': 'G1'})
+        >>> group.create()  # return True or False
+        >>> customers = Customer.all({'group_id': group.id})
+    """
+    __slots__ = ()
+    path = "api/1/groups"
+    fields = ('id', 'name', 'reference', 'created_at')
@@ -0,0 +1,83 @@
+"""Idempotency keys for POST requests
+
+A POST carrying an `Idempotency-Key` header can be sent again after a timeout without creating the
+resource twice, so `Api` retries it like a GET. An `IdempotencyStore` remembers which keys were sent and
+which got a response, so an interrupted bulk run can be restarted with the same keys: completed ones
+are answered locally and pending ones are safely re-sent.
+
+Usage::
+
+    >>> store = IdempotencyStore('debits.keys')
+    >>> api = besepa.Api(api_key='...', idempotency_store=store)
+    >>> customer.create_debit({...}, idempotency_key='debit-2019-10-C1')
+"""
+import json
+import threading
+import uuid
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+SENT = 'sent'
+COMPLETED = 'completed'
+
+
+def new_key():
+    """Returns a new random idempotency key
+    """
+    return uuid.uuid4().hex
+
+
+class IdempotencyStore(object):
+    """Thread-safe record of idempotency keys and their responses.
+
+    Kept in memory, and appended as JSON lines to `path` when given so it survives restarts.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = {}
+        self.lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                for line in fp:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record['key']] = record
+        except IOError:
+            pass
+
+    def save(self, record):
+        self.records[record['key']] = record
+        if self.path is not None:
+            with open(self.path, 'a') as fp:
+                fp.write(json.dumps(record) + '\n')
+
+    def get(self, key):
+        """Returns the record of `key`, a dict with its `key`, `url`, `state` and `response`, or None
+        """
+        with self.lock:
+            return self.records.get(key)
+
+    def sent(self, key, url):
+        with self.lock:
+            self.save({'key': key, 'url': url, 'state': SENT, 'response': None})
+
+    def completed(self, key, url, response):
+        with self.lock:
+            self.save({'key': key, 'url': url, 'state': COMPLETED, 'response': response})
+
+    def pending(self):
+        """Keys sent without a known outcome, e.g. because the process died waiting for the response
+        """
+        with self.lock:
+            return [key for key, record in self.records.items() if record['state'] == SENT]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.records)
@@ -0,0 +1,268 @@
+"""Instrumentation hooks for API calls, and collectors built on them
+
+Every hook given with the ``hooks`` option, or added with `Api.add_hook`, has its `on_request`,
+`on_response`, `on_error` and `on_retry` methods called with a `RequestEvent`. Latencies are measured with
+a monotonic clock and paths are reported as templates, ``api/1/customers/{id}/debits``, so they can be
+aggregated per endpoint.
+
+Usage::
+
+    >>> histogram = LatencyHistogram()
+    >>> api = besepa.Api(api_key='...', hooks=[histogram])
+    >>> besepa.Customer.all(api=api)
+    >>> histogram.summary()
+    {('GET', 'api/1/customers'): {'count': 1, 'errors': 0, 'p50': 0.12, 'p90': 0.12, 'p99': 0.12, ...}}
+"""
+import bisect
+import threading
+
+from besepa import exceptions
+
+try:  # pragma: no cover
+    from urllib.parse import urlsplit
+except ImportError:  # pragma: no cover
+    from urlparse import urlsplit
+
+try:  # pragma: no cover
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+
+def path_template(url):
+    """Returns the path of `url` with its resource ids replaced by ``{id}``
+
+    Usage::
+
+        >>> metrics.path_template("https://sandbox.besepa.com/api/1/customers/CUS1/debits?page=2")
+        'api/1/customers/{id}/debits'
+    """
+    parts = urlsplit(url).path.strip('/').split('/')
+    # api/<version>/<collection>/<id>/<collection>/<id>...
+    return '/'.join(part if i < 2 or i % 2 == 0 else '{id}' for i, part in enumerate(parts))
+
+
+class RequestEvent(object):
+    """A request made by `Api`, as seen by the hooks.
+
+    `latency` is in seconds and only covers the HTTP exchange, not the client side rate limiting.
+    `status`, `latency`, `bytes_in` and `debug_id` are None until a response is received, `error` is set for
+    `on_error` and `on_retry`, and `attempt` and `delay` for `on_retry`.
+    """
+    __slots__ = ('method', 'url', 'status', 'latency', 'bytes_in', 'bytes_out', 'debug_id', 'error', 'attempt',
+                 'delay', '_path')
+
+    def __init__(self, method, url, bytes_out=0, error=None, attempt=1, delay=None):
+        self.method = method
+        self.url = url
+        self.status = None
+        self.latency = None
+        self.bytes_in = None
+        self.bytes_out = bytes_out
+        self.debug_id = None
+        self.error = error
+        self.attempt = attempt
+        self.delay = delay
+        self._path = None
+
+    @property
+    def path(self):
+        """Path template of the request url, see `path_template`
+        """
+        if self._path is None:
+            self._path = path_template(self.url)
+        return self._path
+
+    def __repr__(self):
+        return '<RequestEvent %s %s status=%s latency=%s>' % (self.method, self.path, self.status, self.latency)
+
+
+class Hooks(object):
+    """Base class of API hooks, whose methods do nothing. Subclasses override the events they need.
+
+    Hooks are called from the thread, or event loop, making the request, so they must be thread-safe and
+    should be quick. Exceptions raised by a hook are logged and do not fail the request.
+    """
+
+    def on_request(self, event):
+        """Called before the request is sent
+        """
+
+    def on_response(self, event):
+        """Called for every response received, whatever its status
+        """
+
+    def on_error(self, event):
+        """Called when a request fails, on a connection error or an error status
+        """
+
+    def on_retry(self, event):
+        """Called before a failed request is retried after `event.delay` seconds
+        """
+
+
+# Histogram bucket upper bounds in seconds, from 1ms to about 2 minutes in steps of 25%
+BUCKETS = tuple(0.001 * 1.25 ** i for i in range(53))
+
+
+class Series(object):
+    """Latencies and counters of one endpoint in a `LatencyHistogram`
+    """
+    __slots__ = ('counts', 'count', 'total', 'max', 'errors', 'retries', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def observe(self, latency):
+        self.counts[bisect.bisect_left(BUCKETS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the `q` quantile, 0 < q <= 1, or None without observations
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max  # pragma: no cover
+
+
+class LatencyHistogram(Hooks):
+    """Thread-safe in-memory latency histogram per ``(method, path template)``, with error, retry and byte
+    counters. Percentiles are accurate to the 25% wide bucket they fall in.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def get(self, event):
+        key = (event.method, event.path)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series.setdefault(key, Series())
+        return series
+
+    def on_response(self, event):
+        with self.lock:
+            series = self.get(event)
+            series.observe(event.latency)
+            series.bytes_in += event.bytes_in or 0
+            series.bytes_out += event.bytes_out or 0
+
+    def on_error(self, event):
+        with self.lock:
+            self.get(event).errors += 1
+
+    def on_retry(self, event):
+        with self.lock:
+            self.get(event).retries += 1
+
+    def percentile(self, method, path, q):
+        with self.lock:
+            series = self.series.get((method, path))
+            return series.percentile(q) if series is not None else None
+
+    def summary(self):
+        """Returns a dict of the count, errors, retries, bytes, mean, max and p50/p90/p99 latencies of every
+        endpoint, keyed by ``(method, path template)``
+        """
+        with self.lock:
+            return dict((key, {
+                'count': series.count,
+                'errors': series.errors,
+                'retries': series.retries,
+                'bytes_in': series.bytes_in,
+                'bytes_out': series.bytes_out,
+                'mean': series.total / series.count if series.count else None,
+                'max': series.max if series.count else None,
+                'p50': series.percentile(0.5),
+                'p90': series.percentile(0.9),
+                'p99': series.percentile(0.99),
+            }) for key, series in self.series.items())
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+class PrometheusHooks(Hooks):
+    """Export request latencies, errors, retries and bytes to Prometheus, requires ``prometheus_client``
+
+    Usage::
+
+        >>> api = besepa.Api(api_key='...', hooks=[PrometheusHooks()])
+        >>> prometheus_client.start_http_server(8000)
+    """
+
+    def __init__(self, namespace='besepa', registry=None):
+        if prometheus_client is None:
+            raise exceptions.MissingConfig("PrometheusHooks requires prometheus_client. "
+                                           "Install it with `pip install prometheus_client`")
+        registry = registry if registry is not None else prometheus_client.REGISTRY
+        self.latency = prometheus_client.Histogram(
+            'request_duration_seconds', 'Besepa API request latency', ('method', 'path', 'status'),
+            namespace=namespace, registry=registry)
+        self.errors = prometheus_client.Counter(
+            'request_errors_total', 'Failed Besepa API requests', ('method', 'path', 'error'),
+            namespace=namespace, registry=registry)
+        self.retries = prometheus_client.Counter(
+            'request_retries_total', 'Retried Besepa API requests', ('method', 'path'),
+            namespace=namespace, registry=registry)
+        self.bytes = prometheus_client.Counter(
+            'request_bytes_total', 'Bytes sent to and received from the Besepa API', ('method', 'path', 'direction'),
+            namespace=namespace, registry=registry)
+
+    def on_response(self, event):
+        self.latency.labels(event.method, event.path, str(event.status)).observe(event.latency)
+        self.bytes.labels(event.method, event.path, 'in').inc(event.bytes_in or 0)
+        self.bytes.labels(event.method, event.path, 'out').inc(event.bytes_out or 0)
+
+    def on_error(self, event):
+        self.errors.labels(event.method, event.path, type(event.error).__name__).inc()
+
+    def on_retry(self, event):
+        self.retries.labels(event.method, event.path).inc()
+
+
+class StatsdHooks(Hooks):
+    """Send request timings and counters to StatsD through `client`, any object with the ``timing(stat, ms)``
+    and ``incr(stat)`` methods of the ``statsd`` and ``datadog`` clients
+
+    Stats are named ``<prefix>.<method>.<path>``, e.g. ``besepa.GET.api.1.customers.id.debits.time``.
+
+    Usage::
+
+        >>> api = besepa.Api(api_key='...', hooks=[StatsdHooks(statsd.StatsClient('localhost', 8125))])
+    """
+
+    def __init__(self, client, prefix='besepa'):
+        self.client = client
+        self.prefix = prefix
+
+    def stat(self, event, name):
+        path = event.path.replace('{id}', 'id').replace('/', '.')
+        return '%s.%s.%s.%s' % (self.prefix, event.method, path, name)
+
+    def on_response(self, event):
+        self.client.timing(self.stat(event, 'time'), event.latency * 1000)
+        self.client.incr(self.stat(event, 'status.%s' % event.status))
+
+    def on_error(self, event):
+        self.client.incr(self.stat(event, 'errors'))
+
+    def on_retry(self, event):
+        self.client.incr(self.stat(event, 'retries'))
@@ -0,0 +1,181 @@
+"""Local SQLite mirror of resources, synced incrementally
+
+Every resource is stored as JSON with a hash of its content, so a sync only writes the records that
+changed. When the API can filter listings by modification date, set `since_param` and later syncs only
+download what changed since the newest `since_field` value seen. Otherwise every page is listed and
+compared by hash, and resources no longer listed are removed.
+
+Usage::
+
+    >>> from besepa.mirror import Mirror
+    >>> with Mirror('customers.db') as mirror:
+    ...     mirror.sync()
+    ...     mirror.get('CUS1')
+    ...     mirror.all("json_extract(data, '$.status') = ?", ('ACTIVE',))
+    SyncResult(added=120, updated=0, removed=0, unchanged=0)
+"""
+import hashlib
+import json
+import sqlite3
+from collections import namedtuple
+
+from besepa import exceptions
+from besepa.api import Api
+from besepa.api import default as default_api
+from besepa.customers import Customer
+
+SyncResult = namedtuple('SyncResult', 'added updated removed unchanged')
+
+# Most variables in an SQLite statement, 999 before SQLite 3.32
+MAX_VARIABLES = 999
+
+
+def content_hash(data):
+    """Stable hash of a response dict, independent of key order
+    """
+    return hashlib.sha1(json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class Mirror(object):
+    """Mirror of the `cls` resources in the SQLite database at `path`, in a table named after `cls`
+
+    Reading the mirror needs no credentials. Resources read from it are bound to `api`, or to the default
+    api object when one is configured. Otherwise they get an api object without an api key, which the
+    Besepa API rejects.
+    """
+
+    def __init__(self, path, cls=Customer, since_param=None, since_field='updated_at', api=None):
+        self.cls = cls
+        self.table = '"%s"' % cls.__name__.lower()
+        self.since_param = since_param
+        self.since_field = since_field
+        self.api = api
+        self.offline_api = None
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS %s (id TEXT PRIMARY KEY, hash TEXT NOT NULL, '
+                            'data TEXT NOT NULL)' % self.table)
+            self.db.execute('CREATE TABLE IF NOT EXISTS mirror_state (name TEXT PRIMARY KEY, since TEXT)')
+
+    def since(self):
+        """Newest `since_field` value of the last completed sync, or None
+        """
+        row = self.db.execute('SELECT since FROM mirror_state WHERE name = ?', (self.table,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, params=None, page_size=100, full=False):
+        """Bring the mirror up to date and return a `SyncResult` with the number of changed records.
+
+        Syncs are incremental when `since_param` is set, unless `full` is given. Each page is committed as
+        it is stored, so an interrupted sync keeps its progress. Removed resources are only detected by
+        complete, unfiltered listings. A page rejected by the API raises `BadRequest`.
+        """
+        api = self.api or default_api()
+        params = dict(params or {})
+        since = None if full or not self.since_param else self.since()
+        if since is not None:
+            params[self.since_param] = since
+        complete = since is None and not params
+
+        added = updated = unchanged = 0
+        newest = since
+        seen = set()
+        for _, elements in self.cls.iter_pages(params, page_size, True, api):
+            ids = [str(elem['id']) for elem in elements]
+            stored = {}
+            for start in range(0, len(ids), MAX_VARIABLES):
+                chunk = ids[start:start + MAX_VARIABLES]
+                stored.update(self.db.execute('SELECT id, hash FROM %s WHERE id IN (%s)' % (
+                    self.table, ','.join('?' * len(chunk))), chunk))
+            changes = []
+            for resource_id, elem in zip(ids, elements):
+                seen.add(resource_id)
+                digest = content_hash(elem)
+                if stored.get(resource_id) == digest:
+                    unchanged += 1
+                    continue
+                if resource_id in stored:
+                    updated += 1
+                else:
+                    added += 1
+                changes.append((resource_id, digest, json.dumps(elem)))
+                value = elem.get(self.since_field)
+                if value is not None and (newest is None or str(value) > newest):
+                    newest = str(value)
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO %s (id, hash, data) VALUES (?, ?, ?)' % self.table,
+                                    changes)
+
+        removed = 0
+        if complete:
+            stale = [(resource_id,) for resource_id, in self.db.execute('SELECT id FROM %s' % self.table)
+                     if resource_id not in seen]
+            removed = len(stale)
+        with self.db:
+            if removed:
+                self.db.executemany('DELETE FROM %s WHERE id = ?' % self.table, stale)
+            if newest is not None:
+                self.db.execute('INSERT OR REPLACE INTO mirror_state (name, since) VALUES (?, ?)',
+                                (self.table, newest))
+        return SyncResult(added, updated, removed, unchanged)
+
+    def refresh(self, resource_id):
+        """Fetch a single resource with `find` and store it, returning it. A resource the API no longer
+        finds is removed from the mirror and None is returned, and one it rejects raises `BadRequest`.
+        """
+        api = self.api or default_api()
+        try:
+            resource = self.cls.find(resource_id, api=api)
+        except exceptions.ResourceNotFound:
+            with self.db:
+                self.db.execute('DELETE FROM %s WHERE id = ?' % self.table, (str(resource_id),))
+            return None
+        if resource.error is not None:
+            raise exceptions.BadRequest(None, json.dumps(resource.error))
+        data = resource.to_dict()
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO %s (id, hash, data) VALUES (?, ?, ?)' % self.table,
+                            (str(resource_id), content_hash(data), json.dumps(data)))
+        return resource
+
+    def read_api(self):
+        """Api object of the resources read from the mirror, see `Mirror`
+        """
+        if self.api is not None:
+            return self.api
+        try:
+            return default_api()
+        except exceptions.MissingConfig:
+            # Not kept in `api`, so syncs still use the default api object once it is configured
+            if self.offline_api is None:
+                self.offline_api = Api(api_key=None)
+            return self.offline_api
+
+    def get(self, resource_id):
+        """Returns the mirrored resource `resource_id`, or None
+        """
+        row = self.db.execute('SELECT data FROM %s WHERE id = ?' % self.table, (str(resource_id),)).fetchone()
+        return self.cls.from_response(json.loads(row[0]), api=self.read_api()) if row else None
+
+    def all(self, where=None, params=()):
+        """Iterate over the mirrored resources, optionally filtered by the SQL condition `where`, which can
+        query the JSON `data` column, e.g. ``"json_extract(data, '$.status') = ?"``
+        """
+        sql = 'SELECT data FROM %s' % self.table
+        if where:
+            sql += ' WHERE %s' % where
+        api = self.read_api()
+        for data, in self.db.execute(sql + ' ORDER BY id', params):
+            yield self.cls.from_response(json.loads(data), api=api)
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM %s' % self.table).fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
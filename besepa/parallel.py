@@ -0,0 +1,114 @@
+"""Parallel parsing of very large listings across processes, for offline jobs
+
+Building resources from a page of thousands of objects is CPU-bound and runs on a single core. `iter_all`
+fetches the raw pages in the calling thread and parses them on a pool of worker processes into plain dicts,
+or compact `records` of a few `fields`, so parsing uses every core and overlaps with fetching the next
+pages. Resources are not built: use `List.iter_all` when they are needed.
+
+Usage::
+
+    >>> from besepa import parallel
+    >>> for customer in parallel.iter_all(Customer, page_size=1000, workers=4):
+    ...     reconcile(customer['id'], customer['bank_account']['iban'])
+    >>> for record in parallel.iter_all(Customer, fields=['id', 'bank_account.iban'], records=True):
+    ...     reconcile(record.id, record.bank_account_iban)
+"""
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from besepa import exceptions, util
+from besepa.api import default as default_api
+
+
+def parse_page(content, codec, fields=None, records=False):
+    """Parse the raw body of a listing into a list of dicts, projected to `fields` when given, or of tuples of
+    the `fields` values with `records`. Runs in the worker processes.
+    """
+    return parse_listing(content, codec, fields, records)[0]
+
+
+def parse_listing(content, codec, fields=None, records=False):
+    """`parse_page`, and whether the body was a single JSON object, which is the only and last page
+    """
+    response = codec.loads(content).get('response') if content else None
+    last = not isinstance(response, list)
+    if last:
+        response = [response] if response else []
+    if not fields:
+        return response, last
+    if not records:
+        return [util.project(elem, fields) for elem in response], last
+    paths = [field.split('.') for field in fields]
+    return [tuple(lookup(elem, path) for path in paths) for elem in response], last
+
+
+def lookup(data, path):
+    """Value at the dotted `path`, split in a list, of `data`, or None when missing
+    """
+    for key in path:
+        if isinstance(data, dict):
+            data = data.get(key)
+        elif isinstance(data, list) and key.isdigit() and int(key) < len(data):
+            data = data[int(key)]
+        else:
+            return None
+    return data
+
+
+def record_class(fields):
+    """namedtuple class of `records` of `fields`, whose dots are replaced by underscores
+    """
+    return namedtuple('Record', [field.replace('.', '_') for field in fields])
+
+
+def iter_all(cls, params=None, page_size=1000, fields=None, records=False, workers=None, api=None):
+    """Iterate over every `cls` resource as a plain dict, parsed on `workers` processes, the number of CPUs
+    by default. With `records`, yields namedtuples of the dotted `fields` instead, which are smaller and
+    cheaper to send back from the workers, e.g. ``record.bank_account_iban``.
+
+    The largest page seen is taken as the page size, which the API may cap below `page_size`, and the listing
+    ends at a page shorter than that. Pages are fetched ahead of the one being consumed, one at first and
+    twice as many after each full page, up to ``workers + 1``. No more are fetched once a page parsed ahead
+    ends the listing, so it is requested at most that many pages past its end, and a listing of a single
+    short page only twice. Resources are yielded in listing order.
+    """
+    if records and not fields:
+        raise exceptions.MissingParam("Records require fields")
+    api = api or default_api()
+    workers = workers or multiprocessing.cpu_count()
+    params = util.merge_dict(params or {}, {'per_page': page_size}, api.fields_params(fields) if fields else {})
+    page = int(params.pop('page', 1))
+    record = record_class(fields) if records else None
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        ahead, size = 1, 0
+        try:
+            while True:
+                # Parsing of the pages already fetched carries on in the workers while the next one arrives, and
+                # no more are fetched once one of them ends the listing
+                while len(pending) < ahead and not any(is_last(future, size) for future in pending if future.done()):
+                    content = api.get_content(util.join_url_params(cls.path, util.merge_dict(params, {'page': page})))
+                    pending.append(executor.submit(parse_listing, content, api.codec, fields, records))
+                    page += 1
+                elements, last = pending.popleft().result()
+                for elem in elements:
+                    yield record._make(elem) if records else elem
+                if last or not elements or len(elements) < size:
+                    break
+                if len(elements) >= page_size or len(elements) == size:
+                    ahead = min(ahead * 2, workers + 1)
+                size = max(size, len(elements))
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def is_last(future, size):
+    """Whether the parsed page of `future` ends a listing of pages of `size`
+    """
+    if future.exception() is not None:
+        return False
+    elements, last = future.result()
+    return last or not elements or len(elements) < size
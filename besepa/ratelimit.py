@@ -0,0 +1,145 @@
+import email.utils
+import threading
+import time
+from collections import deque
+
+from besepa import util
+
+
+def parse_retry_after(value):
+    """Seconds to wait according to a `Retry-After` header, given either as seconds or as an HTTP date.
+
+    Usage::
+
+        >>> ratelimit.parse_retry_after("120")
+        120.0
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class RateLimiter(object):
+    """Thread-safe token bucket pacing requests to `rate` per second, with bursts of up to `burst` requests.
+
+    The rate adapts to the server: every throttled response (429 or `Retry-After`) halves it, at most once
+    per `cooldown` seconds, and every successful one raises it back towards `rate` by `increase`. The limiter
+    therefore settles just under the rate the server accepts instead of alternating bursts and failures.
+
+    With `rate=None` requests are not paced until the first throttled response, which starts the adaptation
+    from the rate requests were being sent at, measured over the last `window` requests. With
+    `adaptive=False` the rate never changes, so `rate=None` never paces requests, and only `Retry-After`
+    pauses are honoured.
+
+    `reserve` never blocks, so asyncio code can wait the returned delay with `asyncio.sleep`.
+
+    Usage::
+
+        >>> limiter = RateLimiter(10)
+        >>> limiter.acquire()  # blocks until a request may be sent
+    """
+
+    def __init__(self, rate=None, burst=None, min_rate=0.5, increase=None, decrease=0.5, cooldown=1.0,
+                 adaptive=True, window=100, clock=util.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.increase = increase if increase is not None else (rate or 0) / 100.0
+        self.adaptive = adaptive
+        # Times of the last requests while unpaced, to start adapting from the observed rate
+        self.sent = deque(maxlen=window) if rate is None and adaptive else None
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tokens = float(self.burst)
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.last_decrease = None
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Take a token and return how many seconds the caller has to wait before sending its request
+        """
+        with self.lock:
+            now = self.clock()
+            delay = max(0.0, self.blocked_until - now)
+            if self.rate is None:
+                if self.sent is not None:
+                    self.sent.append(now)
+                return delay
+            self.refill(now)
+            self.tokens -= 1
+            if self.tokens < 0:
+                delay = max(delay, -self.tokens / self.rate)
+            return delay
+
+    def acquire(self):
+        """Block the calling thread until a request may be sent
+        """
+        delay = self.reserve()
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    def observed_rate(self, now):
+        """Requests per second sent over the last `window` requests, while unpaced
+        """
+        elapsed = now - self.sent[0] if self.sent else 0.0
+        if elapsed <= 0:
+            return float(max(1, len(self.sent or ())))
+        return len(self.sent) / elapsed
+
+    def start(self, now):
+        """Start pacing at the observed rate, before it is decreased by the throttled response
+        """
+        rate = max(self.min_rate, self.observed_rate(now))
+        self.max_rate = self.rate = rate
+        self.burst = max(1, int(rate))
+        if not self.increase:
+            self.increase = rate / 100.0
+        self.tokens = 0.0
+        self.updated = now
+        self.sent = None
+
+    def throttle(self, retry_after=None):
+        """Slow down after a throttled response, pausing every caller for `retry_after` seconds if given
+        """
+        with self.lock:
+            self.throttled += 1
+            now = self.clock()
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if not self.adaptive:
+                return
+            if self.rate is None:
+                self.start(now)
+            if self.last_decrease is None or now - self.last_decrease >= self.cooldown:
+                self.refill(now)
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                # Drop the saved burst so the slower rate applies straight away
+                self.tokens = min(self.tokens, 0.0)
+                self.last_decrease = now
+
+    def succeed(self):
+        """Recover speed after a successful response
+        """
+        if self.rate is None or self.rate >= self.max_rate:
+            return
+        with self.lock:
+            self.refill(self.clock())
+            self.rate = min(self.max_rate, self.rate + self.increase)
@@ -1,26 +1,166 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import besepa.exceptions as exceptions
 import besepa.util as util
 from besepa.api import default as default_api
+from besepa.idempotency import IDEMPOTENCY_HEADER
+
+# The coroutine variants (`afind`, `aall`, `acreate`, ...) import `besepa.aio` on demand, since it uses
+# async syntax and must not be loaded on Python 2.
+
+# Normalized prefix of every resource `path`, see `Resource.resource_path`
+__path_prefixes__ = {}
+
+# Resource classes by the response keys they are found under, filled by `register` as resource modules are
+# imported, and shared as the default `Resource.convert_resources`
+__resources__ = {}
+
+
+def dump(value):
+    """Plain JSON value of `value`, converting resources and lists of them
+    """
+    if isinstance(value, Resource):
+        return value.to_dict()
+    elif isinstance(value, list):
+        return list(map(dump, value))
+    else:
+        return value
+
+
+def is_dirty(value):
+    """Whether `value` is a resource, or a list holding one, with changes
+    """
+    if isinstance(value, Resource):
+        return value.is_dirty()
+    elif isinstance(value, list):
+        return any(is_dirty(elem) for elem in value)
+    return False
+
+
+def register(*names):
+    """Class decorator registering a resource class for the response keys `names`, so nested objects found
+    under them are converted to it. The first name is the singular one, used as the `create` payload key.
+
+    Usage::
+
+        >>> @register('debit', 'debits')
+        ... class Debit(List, Find):
+        ...     path = "api/1/debits"
+    """
+    def decorator(cls):
+        cls.resource_name = names[0]
+        for name in names:
+            __resources__[name] = cls
+        return cls
+    return decorator
 
 
 class Resource(object):
     """Base class for all REST services
+
+    Resources are slotted, holding no instance `__dict__`, and only allocate their `header` and `headers`
+    dicts when first used, which keeps large result sets small. Subclasses should declare
+    ``__slots__ = ()`` to stay compact.
+
+    When the api object is created with ``lazy=True``, nested objects and lists are kept as raw JSON and only
+    converted when first read through attribute or item access; `to_dict` returns untouched raw values as
+    they are, so they must not be modified in place.
+
+    Keys assigned through attribute or item access are tracked until they are merged again, so `changes`
+    only holds what was modified locally, see `Update.update`. Values modified in place, e.g. a list
+    appended to, are not tracked: assign them again. Resources built from API responses, see
+    `from_response`, or merged with one are loaded; those built from local attributes are not.
     """
-    convert_resources = {}
+    __slots__ = ('api', '__data__', 'error', '_header', '_headers', '_pending', '_dirty', '_loaded')
+    # Classes of nested objects by response key, a single lookup per key, see `register`
+    convert_resources = __resources__
+    # Payload key of `Create.create`, set by `register`; the lowercase class name otherwise
+    resource_name = None
+    # Fields expected in responses, for compact representations and projections
+    fields = ()
 
     def __init__(self, attributes=None, api=None):
         attributes = attributes or {}
-        self.__dict__['api'] = api or default_api()
+        super(Resource, self).__setattr__('api', api or default_api())
 
         super(Resource, self).__setattr__('__data__', {})
         super(Resource, self).__setattr__('error', None)
-        super(Resource, self).__setattr__('headers', {})
-        super(Resource, self).__setattr__('header', {})
-        self.merge(attributes)
+        super(Resource, self).__setattr__('_headers', None)
+        super(Resource, self).__setattr__('_header', None)
+        # Keys of raw values still waiting for conversion, in lazy mode
+        super(Resource, self).__setattr__('_pending', None)
+        # Keys assigned since they were last merged
+        super(Resource, self).__setattr__('_dirty', None)
+        # Whether the attributes come from the API, see `from_response`
+        super(Resource, self).__setattr__('_loaded', False)
+        self.set_attributes(attributes)
+
+    @classmethod
+    def from_response(cls, response, api=None):
+        """Build a loaded resource from an API `response`, whose nested resources are loaded too
+
+        Usage::
 
-    def http_headers(self):
+            >>> customer = Customer.from_response(api.get('api/1/customers/1'), api=api)
+        """
+        resource = cls(api=api)
+        resource.merge(response or {})
+        return resource
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            super(Resource, self).__setattr__('_headers', {})
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        super(Resource, self).__setattr__('_headers', value)
+
+    @property
+    def header(self):
+        if self._header is None:
+            super(Resource, self).__setattr__('_header', {})
+        return self._header
+
+    @header.setter
+    def header(self, value):
+        super(Resource, self).__setattr__('_header', value)
+
+    def http_headers(self, idempotency_key=None):
         """Generate HTTP header
         """
-        return util.merge_dict(self.header, self.headers)
+        headers = dict(self._header) if self._header else {}
+        if self._headers:
+            headers.update(self._headers)
+        if idempotency_key is not None:
+            headers[IDEMPOTENCY_HEADER] = idempotency_key
+        return headers
+
+    @classmethod
+    def payload_name(cls):
+        """Key wrapping the attributes of the resource in `create` requests
+        """
+        return cls.resource_name or cls.__name__.lower()
+
+    @classmethod
+    def resource_path(cls, resource_id, name=None):
+        """Path of the resource `resource_id`, followed by `name` when given, the same as
+        ``util.join_url(cls.path, str(resource_id), name)`` but from a prefix normalized once per `path`
+
+        Usage::
+
+            >>> Customer.resource_path('1', 'debits')
+            'api/1/customers/1/debits'
+        """
+        prefix = __path_prefixes__.get(cls.path)
+        if prefix is None:
+            prefix = __path_prefixes__[cls.path] = cls.path.strip('/') + '/'
+        path = prefix + str(resource_id).strip('/')
+        if name is not None:
+            path += '/' + name.lstrip('/')
+        return path
 
     def __str__(self):
         return self.__data__.__str__()
@@ -29,6 +169,8 @@ class Resource(object):
         return self.__data__.__str__()
 
     def __getattr__(self, name):
+        if self._pending and name in self._pending:
+            return self.materialize(name)
         return self.__data__.get(name)
 
     def __setattr__(self, name, value):
@@ -38,6 +180,9 @@ class Resource(object):
             super(Resource, self).__setattr__(name, value)
         except AttributeError:
             self.__data__[name] = self.convert(name, value)
+            if self._pending:
+                self._pending.discard(name)
+            self.mark_dirty(name)
 
     def __contains__(self, item):
         return item in self.__data__
@@ -46,17 +191,106 @@ class Resource(object):
         return self.error is None
 
     def merge(self, new_attributes):
-        """Merge new attributes e.g. response from a post to Resource
+        """Merge new attributes e.g. response from a post to Resource. Merged keys are no longer dirty, and
+        the resource is loaded unless they hold an ``error``.
+        """
+        if 'error' not in new_attributes:
+            super(Resource, self).__setattr__('_loaded', True)
+        self.set_attributes(new_attributes)
+
+    def set_attributes(self, new_attributes):
+        """Store `new_attributes`, which are no longer dirty, converting their nested objects
+        """
+        cls = type(self)
+        if not getattr(self.api, 'lazy', False):
+            data = self.__data__
+            for k, v in new_attributes.items():
+                if hasattr(cls, k):
+                    setattr(self, k, v)
+                    continue
+                data[k] = self.convert(k, v)
+                if self._pending:
+                    self._pending.discard(k)
+        else:
+            for k, v in new_attributes.items():
+                if hasattr(cls, k):
+                    setattr(self, k, v)
+                    continue
+                self.__data__[k] = v
+                if isinstance(v, (dict, list)):
+                    if self._pending is None:
+                        super(Resource, self).__setattr__('_pending', set())
+                    self._pending.add(k)
+                elif self._pending:
+                    self._pending.discard(k)
+        if self._dirty:
+            self._dirty.difference_update(new_attributes)
+
+    def mark_dirty(self, key):
+        """Record that `key` was modified locally
         """
-        for k, v in new_attributes.items():
-            setattr(self, k, v)
+        if self._dirty is None:
+            super(Resource, self).__setattr__('_dirty', set())
+        self._dirty.add(key)
+
+    def mark_clean(self, keys=None):
+        """Forget the local modifications of `keys`, or of every key, including those of nested resources
+        """
+        pending = self._pending or ()
+        for key in self.__data__ if keys is None else keys:
+            if key in self.__data__ and key not in pending:
+                value = self.__data__[key]
+                for elem in value if isinstance(value, list) else (value,):
+                    if isinstance(elem, Resource):
+                        elem.mark_clean()
+        if self._dirty:
+            if keys is None:
+                self._dirty.clear()
+            else:
+                self._dirty.difference_update(keys)
+
+    def is_dirty(self):
+        """Whether any key was assigned since it was last merged, here or in a nested resource
+        """
+        if self._dirty:
+            return True
+        pending = self._pending or ()
+        return any(is_dirty(value) for key, value in self.__data__.items() if key not in pending)
+
+    def changes(self):
+        """Dict of the keys modified locally, see `is_dirty`, and of the nested resources holding
+        modifications, which are sent whole
+
+        Usage::
+
+            >>> customer.name = 'Andrew Wiggin'
+            >>> customer.changes()
+            {'name': 'Andrew Wiggin'}
+        """
+        dirty = self._dirty or ()
+        pending = self._pending or ()
+        changes = {}
+        for key, value in self.__data__.items():
+            if key in pending:
+                if key in dirty:
+                    changes[key] = value
+            elif key in dirty or is_dirty(value):
+                changes[key] = dump(value)
+        return changes
+
+    def materialize(self, name):
+        """Convert the raw value of `name` kept in lazy mode
+        """
+        self._pending.discard(name)
+        value = self.__data__[name] = self.convert(name, self.__data__[name])
+        return value
 
     def convert(self, name, value):
         """Convert the attribute values to configured class
         """
         if isinstance(value, dict):
             cls = self.convert_resources.get(name, Resource)
-            return cls(value, api=self.api)
+            return cls.from_response(value, api=self.api) if self._loaded else cls(value, api=self.api)
         elif isinstance(value, list):
             new_list = []
             for obj in value:
@@ -66,100 +300,228 @@ class Resource(object):
             return value
 
     def __getitem__(self, key):
+        if self._pending and key in self._pending:
+            return self.materialize(key)
         return self.__data__[key]
 
     def __setitem__(self, key, value):
         self.__data__[key] = self.convert(key, value)
+        if self._pending:
+            self._pending.discard(key)
+        self.mark_dirty(key)
 
     def to_dict(self):
-
-        def parse_object(value):
-            if isinstance(value, Resource):
-                return value.to_dict()
-            elif isinstance(value, list):
-                return list(map(parse_object, value))
-            else:
-                return value
-
-        return dict((key, parse_object(value)) for (key, value) in self.__data__.items())
+        pending = self._pending or ()
+        return dict((key, value if key in pending else dump(value)) for (key, value) in self.__data__.items())
 
 
 class Find(Resource):
+    __slots__ = ()
 
     @classmethod
-    def find(cls, resource_id, api=None):
+    def find(cls, resource_id, api=None, fields=None):
         """Locate resource e.g. customer with given id
 
+        Only the `fields` given, if any, are kept, see `List.all`.
+
         Usage::
             >>> payment = Customer.find("1")
+            >>> customer = Customer.find("1", fields=['id', 'reference', 'status'])
         """
         api = api or default_api()
 
-        url = util.join_url(cls.path, str(resource_id))
-        return cls(api.get(url), api=api)
+        url = cls.resource_path(resource_id)
+        if not fields:
+            return cls.from_response(api.get(url), api=api)
+        query = api.fields_params(fields)
+        if query:
+            url = util.join_url_params(url, query)
+        response = api.get(url)
+        # A 400 answer is an ``{"error": ...}`` object, kept whole so that `success` reports it
+        return cls.from_response(response if 'error' in response else util.project(response, fields), api=api)
+
+    @classmethod
+    def afind(cls, resource_id, api=None, fields=None):
+        """Coroutine version of `find`, see :mod:`besepa.aio`
+
+        Usage::
+            >>> customer = await Customer.afind("1")
+        """
+        from besepa import aio
+        return aio.find(cls, resource_id, api=api, fields=fields)
 
 
 class List(Resource):
+    __slots__ = ()
 
     list_class = Resource
 
     @classmethod
-    def all(cls, params=None, api=None):
+    def all(cls, params=None, api=None, fields=None):
         """Get list of resources
 
+        With `fields`, only those fields, possibly dotted paths such as ``bank_account.iban``, are kept. They are
+        dropped before the resources are built, saving the work of converting unused nested objects, and
+        also requested from the API when the api object has a ``fields_param`` option.
+
         Usage::
 
             >>> payment_histroy = Customer.all({'per_page': 2})
+            >>> customers = Customer.all(fields=['id', 'reference', 'status'])
         """
         api = api or default_api()
+        query = api.fields_params(fields) if fields else None
+        if query:
+            params = util.merge_dict(params or {}, query)
         url = cls.path if params is None else util.join_url_params(cls.path, params)
 
+        response = api.get(url)
+        # The response is usually a JSON Array
+        if isinstance(response, list):
+            if fields:
+                response = [util.project(elem, fields) for elem in response]
+            return [cls.list_class.from_response(elem, api=api) for elem in response]
+        return cls.list_class.from_response(response, api=api)
+
+    @classmethod
+    def iter_all(cls, params=None, page_size=50, prefetch=False, api=None, fields=None):
+        """Iterate over every resource, fetching pages of `page_size` lazily
+
+        Only the current page (plus the next one when `prefetch` is set) is held in memory. With
+        `prefetch`, the next page is requested in a background thread while the current one is consumed.
+        Iteration stops at an empty page, or at one holding less resources than the previous pages. The
+        API may cap `page_size`, so a short first page is not taken as the last one. `fields` works as in
+        `all`.
+
+        Usage::
+
+            >>> for customer in Customer.iter_all({'group_id': 4321}, page_size=100, prefetch=True):
+            ...     print(customer.id)
+        """
+        api = api or default_api()
+        for _, elements in cls.iter_pages(params, page_size, prefetch, api, fields):
+            for elem in elements:
+                yield cls.list_class.from_response(elem, api=api)
+
+    @classmethod
+    def iter_pages(cls, params=None, page_size=50, prefetch=False, api=None, fields=None):
+        """Iterate over ``(page, elements)`` tuples of the raw response dicts of every page, see `iter_all`.
+
+        A ``page`` entry in `params` starts from that page, e.g. to resume an interrupted run. Raises
+        `BadRequest` when a page is rejected, which `Api.request` returns as an ``{"error": ...}`` object.
+        """
+        api = api or default_api()
+        params = util.merge_dict(params or {}, {'per_page': page_size}, api.fields_params(fields) if fields else {})
+        page = int(params.pop('page', 1))
+
+        def fetch(page):
+            """Returns the elements of `page`, and whether it is the last one
+            """
+            response = api.get(util.join_url_params(cls.path, util.merge_dict(params, {'page': page})))
+            last = not isinstance(response, list)
+            if last and 'error' in (response or {}):
+                raise exceptions.BadRequest(None, json.dumps(response['error']))
+            if last:
+                # A single JSON object is the only and last page
+                response = [response] if response else []
+            if fields:
+                response = [util.project(elem, fields) for elem in response]
+            return response, last
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
         try:
-            response = api.get(url)
-            return cls.list_class(response, api=api)
-        except AttributeError:
-            # To handle the case when response is JSON Array
-            if isinstance(response, list):
-                new_resp = [cls.list_class(elem, api=api) for elem in response]
-                return new_resp
+            # Largest page seen, the page size the API actually uses
+            size = 0
+            elements, last = fetch(page)
+            while elements:
+                next_page = None
+                if not last and len(elements) >= size:
+                    size = len(elements)
+                    next_page = executor.submit(fetch, page + 1) if executor else page + 1
+                yield page, elements
+                if next_page is None:
+                    break
+                elements, last = next_page.result() if executor else fetch(next_page)
+                page += 1
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+
+    @classmethod
+    def aall(cls, params=None, api=None, fields=None):
+        """Coroutine version of `all`, see :mod:`besepa.aio`
+
+        Usage::
+
+            >>> customers = await Customer.aall({'per_page': 2})
+        """
+        from besepa import aio
+        return aio.list_all(cls, params=params, api=api, fields=fields)
 
 
 class Create(Resource):
+    __slots__ = ()
 
-    def create(self):
+    def create(self, idempotency_key=None):
         """Creates a resource e.g. payment
 
+        An `idempotency_key` makes the request safe to retry, see :mod:`besepa.idempotency`.
+
         Usage::
 
             >>> customer = Customer({})
             >>> customer.create() # return True or False
         """
-        resource_name = self.__class__.__name__.lower()
-        payload = {resource_name: self.to_dict()}
-        new_attributes = self.api.post(self.path, payload, self.http_headers())
+        payload = {self.payload_name(): self.to_dict()}
+        new_attributes = self.api.post(self.path, payload, self.http_headers(idempotency_key))
         self.error = None
         self.merge(new_attributes)
         return self.success()
 
+    def acreate(self, idempotency_key=None):
+        """Coroutine version of `create`, see :mod:`besepa.aio`
+        """
+        from besepa import aio
+        return aio.create(self, idempotency_key)
+
 
 class Update(Resource):
     """Partial update or modify resource
 
+    Without `attributes`, only the `changes` made locally are sent, and nothing is sent when there are none.
+    A resource that is not loaded, e.g. built as ``Customer({'id': '1', 'name': 'Andrew'})``, sends its whole
+    `to_dict` instead, as it may hold any number of attributes the API does not have.
+
     Usage::
 
         >>> customer.update([{'name': 'Andrew'}])
+        >>> customer.name = 'Andrew'
+        >>> customer.update()
     """
+    __slots__ = ()
 
     def update(self, attributes=None):
-        attributes = attributes or self.to_dict()
-        url = util.join_url(self.path, str(self['id']))
+        if not attributes:
+            attributes = self.changes() if self._loaded else self.to_dict()
+        if not attributes:
+            return self.success()
+        url = self.resource_path(self['id'])
         new_attributes = self.api.patch(url, attributes, self.http_headers())
         self.error = None
         self.merge(new_attributes)
+        if self.success() and isinstance(attributes, dict):
+            self.mark_clean(attributes)
         return self.success()
 
+    def aupdate(self, attributes=None):
+        """Coroutine version of `update`, see :mod:`besepa.aio`
+        """
+        from besepa import aio
+        return aio.update(self, attributes)
+
 
 class Delete(Resource):
+    __slots__ = ()
 
     def delete(self):
         """Deletes a resource e.g. bank_account
@@ -168,31 +530,44 @@ class Delete(Resource):
 
             >>> bank_account.delete()
         """
-        url = util.join_url(self.path, str(self['id']))
+        url = self.resource_path(self['id'])
         new_attributes = self.api.delete(url)
         self.error = None
         self.merge(new_attributes)
         return self.success()
 
+    def adelete(self):
+        """Coroutine version of `delete`, see :mod:`besepa.aio`
+        """
+        from besepa import aio
+        return aio.delete(self)
+
 
 class Post(Resource):
+    __slots__ = ()
 
-    def post(self, name, attributes=None, cls=Resource, fieldname='id'):
+    def post(self, name, attributes=None, cls=Resource, fieldname='id', idempotency_key=None):
         """Constructs url with passed in headers and makes post request via
-        post method in api class.
+        post method in api class. An `idempotency_key` makes the request safe to retry.
 
         Usage::
 
             >>> client.post("stats", {'id': '1234'}, client)  # return True or False
         """
         attributes = attributes or {}
-        url = util.join_url(self.path, str(self[fieldname]), name)
+        url = self.resource_path(self[fieldname], name)
         if not isinstance(attributes, Resource):
             attributes = Resource(attributes, api=self.api)
-        new_attributes = self.api.post(url, attributes.to_dict(), attributes.http_headers())
+        new_attributes = self.api.post(url, attributes.to_dict(), attributes.http_headers(idempotency_key))
         if isinstance(cls, Resource):
             cls.error = None
             cls.merge(new_attributes)
             return self.success()
         else:
-            return cls(new_attributes, api=self.api)
+            return cls.from_response(new_attributes, api=self.api)
+
+    def apost(self, name, attributes=None, cls=Resource, fieldname='id', idempotency_key=None):
+        """Coroutine version of `post`, see :mod:`besepa.aio`
+        """
+        from besepa import aio
+        return aio.post(self, name, attributes, cls, fieldname, idempotency_key)
@@ -0,0 +1,77 @@
+import logging
+import random
+import threading
+
+import requests
+
+from besepa import exceptions
+from besepa.ratelimit import parse_retry_after
+
+log = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """Retry transient failures with capped exponential backoff and full jitter.
+
+    Attempt ``n`` failing with one of `errors`, or with a response whose status is in `statuses`, is retried
+    after a random delay between 0 and ``min(cap, backoff * 2 ** (n - 1))`` seconds (exactly that delay when
+    `jitter` is off), or after the server's `Retry-After` if longer. Only `methods` are retried, GET and DELETE
+    by default, as retrying a POST or PATCH may apply it twice unless it carries an idempotency key.
+
+    `retries` and `slept` count the retries made and the seconds spent waiting, and `on_retry`, when given,
+    is called as ``on_retry(method, url, attempt, delay, error)`` before each retry.
+
+    Usage::
+
+        >>> api = besepa.Api(api_key='...', retry=RetryPolicy(max_attempts=5, backoff=1))
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.5, cap=30.0, jitter=True, statuses=(429, 500, 502, 503, 504),
+                 errors=(requests.ConnectionError, requests.Timeout), methods=('GET', 'DELETE'), on_retry=None):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.cap = cap
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.errors = tuple(errors)
+        self.methods = frozenset(method.upper() for method in methods)
+        self.on_retry = on_retry
+
+        self.retries = 0
+        self.slept = 0.0
+        self.lock = threading.Lock()
+
+    def is_retryable(self, method, error, idempotent=False):
+        if not idempotent and method.upper() not in self.methods:
+            return False
+        if isinstance(error, self.errors):
+            return True
+        return (isinstance(error, exceptions.ConnectionError) and
+                getattr(error.response, 'status_code', None) in self.statuses)
+
+    def delay(self, attempt, error=None):
+        """Seconds to wait before retrying after failed attempt number `attempt`
+        """
+        delay = min(self.cap, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        return max(delay, min(self.cap, retry_after or 0))
+
+    def next_delay(self, method, url, attempt, error, idempotent=False):
+        """Seconds to wait before retrying `error`, or None when it has to be raised to the caller.
+
+        `idempotent` allows retrying any method, e.g. a POST carrying an idempotency key.
+        """
+        if attempt >= self.max_attempts or not self.is_retryable(method, error, idempotent):
+            return None
+        delay = self.delay(attempt, error)
+        with self.lock:
+            self.retries += 1
+            self.slept += delay
+        log.warning('Retrying %s %s in %.3fs (attempt %d of %d): %r', method, url, delay, attempt + 1,
+                    self.max_attempts, error)
+        if self.on_retry is not None:
+            self.on_retry(method, url, attempt, delay, error)
+        return delay
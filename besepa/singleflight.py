@@ -0,0 +1,89 @@
+"""Request coalescing: concurrent identical GETs share a single request in flight
+
+With the ``coalesce`` option, a GET made while the same one, for the same url, credentials and headers, is
+already in flight on the api object waits for that request instead of sending its own, and gets its result.
+It works for threads and, through `besepa.aio`, for coroutines. Responses are shared like cached ones:
+resources built from them convert their nested objects and lists, but the raw response must not be
+modified in place.
+
+Usage::
+
+    >>> api = besepa.Api(api_key='...', coalesce=True)
+    >>> bulk.imap(lambda _: besepa.Customer.find('CUS1', api=api), range(16), concurrency=16)
+    >>> api.flights.stats()
+    {'requests': 1, 'coalesced': 15, 'in_flight': 0}
+"""
+import threading
+
+
+class Call(object):
+    """A request in flight, and its outcome once `done` is set
+    """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Thread-safe registry of the requests in flight by key, with counters of the requests sent and of the
+    ones coalesced into them
+    """
+
+    def __init__(self):
+        self.calls = {}
+        # asyncio tasks by ``(loop, key)``, managed by `besepa.aio`
+        self.tasks = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        """Returns the result of ``func()``, or of the call for `key` already in flight, whose exception is
+        raised in every caller sharing it
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = Call()
+                self.requests += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def count(self, coalesced):
+        """Count a request sent, or one `coalesced` into a request in flight
+        """
+        with self.lock:
+            if coalesced:
+                self.coalesced += 1
+            else:
+                self.requests += 1
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'coalesced': self.coalesced,
+                    'in_flight': len(self.calls) + len(self.tasks)}
+
+    def __len__(self):
+        return len(self.calls) + len(self.tasks)
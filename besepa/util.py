@@ -1,9 +1,61 @@
+import threading
 
 try:  # pragma: no cover
     from urllib.parse import urlencode
 except ImportError:  # pragma: no cover
     from urllib import urlencode
 
+try:  # pragma: no cover
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic  # noqa
+
+try:  # pragma: no cover
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    ContextVar = None
+
+
+class LocalVar(object):
+    """Thread-local stand-in for `contextvars.ContextVar` on Pythons without it, scoping values to threads
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        self.local = threading.local()
+
+    def get(self):
+        return getattr(self.local, 'value', self.default)
+
+    def set(self, value):
+        token = self.get()
+        self.local.value = value
+        return token
+
+    def reset(self, token):
+        self.local.value = token
+
+
+def context_var(name, default=None):
+    """Returns a `ContextVar`, scoped to threads and asyncio tasks, or a thread-local `LocalVar` before
+    Python 3.7
+    """
+    if ContextVar is None:  # pragma: no cover
+        return LocalVar(name, default)
+    return ContextVar(name, default=default)
+
+
+def running_loop():
+    """Whether an asyncio event loop is running in the current thread
+    """
+    try:
+        from asyncio import events
+    except ImportError:  # pragma: no cover
+        return False
+    get_running_loop = getattr(events, '_get_running_loop', None)
+    return get_running_loop is not None and get_running_loop() is not None
+
 
 def join_url(url, *paths):
     """
@@ -42,3 +94,93 @@ def merge_dict(data, *override):
     for current_dict in (data,) + override:
         result.update(current_dict)
     return result
+
+
+# Trees of the dotted paths of `project` by fields, see `path_tree`
+__path_trees__ = {}
+
+
+def path_tree(fields):
+    """Nested dict of the dotted `fields`, whose leaves are None, e.g. ``{'id': None, 'mandate': {'status': None}}``
+    """
+    key = tuple(fields)
+    tree = __path_trees__.get(key)
+    if tree is None:
+        tree = {}
+        for field in fields:
+            node, parts = tree, field.split('.')
+            for part in parts[:-1]:
+                child = node.setdefault(part, {})
+                if child is None:
+                    # A parent field is kept whole
+                    break
+                node = child
+            else:
+                node[parts[-1]] = None
+        if len(__path_trees__) < 1024:
+            __path_trees__[key] = tree
+    return tree
+
+
+# Result of `project_tree` when none of the paths are found
+NOTHING = object()
+
+
+def project_tree(value, tree):
+    """Project `value` to the paths of `tree`, see `path_tree`. Returns `NOTHING` when none are found.
+    """
+    if isinstance(value, dict):
+        projected = {}
+        for key, subtree in tree.items():
+            if key in value:
+                child = value[key] if subtree is None else project_tree(value[key], subtree)
+                if child is not NOTHING:
+                    projected[key] = child
+        return projected if projected else NOTHING
+    if isinstance(value, list):
+        # Keys that are not indices apply to every element
+        common = dict((key, subtree) for key, subtree in tree.items() if not key.isdigit())
+        projected, found = [], False
+        for index, elem in enumerate(value):
+            key = str(index)
+            if key in tree:
+                if tree[key] is None:
+                    projected.append(elem)
+                    found = True
+                    continue
+                subtree = dict(common, **tree[key]) if common else tree[key]
+            elif common:
+                subtree = common
+            else:
+                continue
+            child = project_tree(elem, subtree)
+            if child is not NOTHING:
+                projected.append(child)
+                found = True
+            elif common:
+                # Keep the positions of the elements missing the common fields
+                projected.append({})
+        return projected if found else NOTHING
+    return NOTHING
+
+
+def project(data, fields):
+    """Keep only the `fields` of `data`, which may be dotted paths into nested dicts and lists, preserving
+    its nesting. A list index keeps that element, and any other key applies to every element of a list.
+
+    Usage::
+
+        >>> util.project({'id': '1', 'name': 'Ender', 'mandate': {'id': 'M1', 'status': 'SIGNED'}},
+        ...              ['id', 'mandate.status'])
+        {'id': '1', 'mandate': {'status': 'SIGNED'}}
+        >>> util.project({'bank_accounts': [{'id': 'BA1', 'iban': 'ES66'}, {'id': 'BA2', 'iban': 'ES77'}]},
+        ...              ['bank_accounts.iban'])
+        {'bank_accounts': [{'iban': 'ES66'}, {'iban': 'ES77'}]}
+    """
+    for field in fields:
+        if '.' in field:
+            break
+    else:
+        return dict((field, data[field]) for field in fields if field in data)
+    projected = project_tree(data, path_tree(fields))
+    return projected if projected is not NOTHING else {}
@@ -0,0 +1,15 @@
+from besepa.resource import Create, Delete, Find, List, Update, register
+
+
+@register('webhook', 'webhooks')
+class Webhook(List, Find, Create, Delete, Update):
+    """Webhook class wrapping the REST api/1/webhooks endpoint
+
+    Usage::
+
+        >>> webhook = Webhook({'url': 'https://example.com/besepa'})
+        >>> webhook.create()  # return True or False
+    """
+    __slots__ = ()
+    path = "api/1/webhooks"
+    fields = ('id', 'url', 'created_at')
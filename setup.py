@@ -35,8 +35,14 @@ setup(
         2. http://docs.besepaen.apiary.io - API Reference
     """,
     install_requires=[
-        'requests>=2.22.0,<3.0'
+        'requests>=2.22.0,<3.0',
+        'futures; python_version < "3"',
     ],
+    extras_require={
+        'async': ['aiohttp>=3.0'],
+        'speedups': ['orjson'],
+        'metrics': ['prometheus_client'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -0,0 +1,352 @@
+import asyncio
+import json
+import sys
+
+import pytest
+
+import besepa
+from besepa import aio, exceptions
+from besepa.resource import Resource
+
+try:  # pragma: no cover
+    from unittest.mock import Mock, patch
+except ImportError:  # pragma: no cover
+    from mock import Mock, patch
+
+besepa.configure(api_key='dummy')
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class FakeAsyncApi(aio.AsyncApi):
+    """AsyncApi recording requests instead of hitting the network"""
+
+    def __init__(self, *responses):
+        super(FakeAsyncApi, self).__init__(api_key='dummy')
+        self.responses = list(responses)
+        self.calls = []
+
+    async def request(self, url, method, body=None, headers=None):
+        self.calls.append((method, url, body))
+        await asyncio.sleep(0)
+        return self.responses.pop(0) if self.responses else {}
+
+
+@pytest.fixture
+def api():
+    return aio.AsyncApi(api_key='dummy')
+
+
+class TestAsyncApi(object):
+
+    def test_verbs(self):
+        api = FakeAsyncApi()
+        run(api.get('api/1/customers'))
+        run(api.post('api/1/customers', {'name': 'Ender'}))
+        run(api.patch('api/1/customers/1', {'name': 'Andrew'}))
+        run(api.delete('api/1/customers/1'))
+
+        assert api.calls == [
+            ('GET', 'https://sandbox.besepa.com/api/1/customers', None),
+            ('POST', 'https://sandbox.besepa.com/api/1/customers', {'name': 'Ender'}),
+            ('PATCH', 'https://sandbox.besepa.com/api/1/customers/1', {'name': 'Andrew'}),
+            ('DELETE', 'https://sandbox.besepa.com/api/1/customers/1', None),
+        ]
+
+    def test_http_call_uses_handle_response(self, api):
+        raw = Mock(status=404, reason='Not Found', headers={})
+
+        async def read():
+            return b'{"error": "missing"}'
+
+        raw.read = read
+
+        class Context(object):
+            async def __aenter__(self):
+                return raw
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+        api.session = Mock()
+        api.session.request.return_value = Context()
+        with pytest.raises(besepa.exceptions.ResourceNotFound) as error:
+            run(api.http_call('https://sandbox.besepa.com/api/1/customers/2', 'GET'))
+        assert error.value.response.status_code == 404
+        assert error.value.content == '{"error": "missing"}'
+
+    def test_http_call_hooks(self, api):
+        raw = Mock(status=200, reason='OK', headers={'Besepa-Debug-Id': 'abc'})
+
+        async def read():
+            return b'{"response": {"id": "1"}}'
+
+        raw.read = read
+
+        class Context(object):
+            async def __aenter__(self):
+                return raw
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+        hooks = api.add_hook(Mock())
+        api.session = Mock()
+        api.session.request.return_value = Context()
+        assert run(api.http_call('https://sandbox.besepa.com/api/1/customers/1', 'GET')) == {'id': '1'}
+
+        event = hooks.on_response.call_args[0][0]
+        assert (event.path, event.status, event.bytes_in, event.debug_id) == ('api/1/customers/{id}', 200, 25, 'abc')
+        assert event.latency >= 0
+        assert not hooks.on_error.called
+
+    def test_get_content(self, api):
+        raw = Mock(status=200, reason='OK', headers={})
+
+        async def read():
+            return b'{"response": [{"id": "1"}]}'
+
+        raw.read = read
+
+        class Context(object):
+            async def __aenter__(self):
+                return raw
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+        api.session = Mock()
+        api.session.request.return_value = Context()
+        assert run(api.get_content('api/1/customers')) == b'{"response": [{"id": "1"}]}'
+
+    def test_sync_context_manager(self, api):
+        with pytest.raises(TypeError):
+            with api:
+                pass  # pragma: no cover
+
+    def test_bad_request(self, api):
+        async def http_call(*args, **kwargs):
+            raise besepa.exceptions.BadRequest('error', json.dumps({'taxid': 'invalid'}))
+
+        api.http_call = http_call
+        assert run(api.request('https://sandbox.besepa.com/api/1/customers', 'POST')) == {
+            'error': {'taxid': 'invalid'}}
+
+    def test_retries(self, api, monkeypatch):
+        attempts = []
+
+        async def http_call(*args, **kwargs):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise asyncio.TimeoutError()
+            return {'id': '1'}
+
+        async def sleep(delay):
+            pass
+
+        monkeypatch.setattr(aio.asyncio, 'sleep', sleep)
+        api.http_call = http_call
+        assert run(api.get('api/1/customers/1')) == {'id': '1'}
+        assert len(attempts) == 2
+
+    def test_coalesced_get(self):
+        api = aio.AsyncApi(api_key='dummy', coalesce=True)
+        calls = []
+
+        async def request(url, method, body=None, headers=None):
+            calls.append(url)
+            await asyncio.sleep(0.01)
+            return {'id': '1'}
+
+        async def main():
+            api.request = request
+            first = asyncio.ensure_future(api.get('api/1/customers/1'))
+            await asyncio.sleep(0)
+            # Cancelling a caller does not cancel the request shared with the others
+            first.cancel()
+            return await asyncio.gather(*[api.get('api/1/customers/1') for _ in range(3)])
+
+        assert run(main()) == [{'id': '1'}] * 3
+        assert calls == ['https://sandbox.besepa.com/api/1/customers/1']
+        assert api.flights.stats() == {'requests': 1, 'coalesced': 3, 'in_flight': 0}
+
+    def test_error_not_cached(self):
+        api = FakeAsyncApi({'error': {'error': 'invalid id'}}, {'id': '1'})
+        api.cache = besepa.cache.ResponseCache()
+
+        assert run(api.get('api/1/customers/1')) == {'error': {'error': 'invalid id'}}
+        assert run(api.get('api/1/customers/1')) == {'id': '1'}
+        assert run(api.get('api/1/customers/1')) == {'id': '1'}
+        assert len(api.calls) == 2
+
+    def test_missing_aiohttp(self, api, monkeypatch):
+        monkeypatch.setattr(aio, 'aiohttp', None)
+        with pytest.raises(besepa.exceptions.MissingConfig):
+            api.get_session()
+
+    def test_async_api_companion(self):
+        api = besepa.Api(api_key='dummy', coalesce=True)
+        companion = aio.async_api(api)
+
+        assert isinstance(companion, aio.AsyncApi)
+        assert companion is aio.async_api(api)
+        assert companion.api_key == 'dummy'
+        assert aio.async_api(companion) is companion
+        assert companion.rate_limiter is api.rate_limiter
+        assert companion.hooks is api.hooks
+        assert companion.flights is api.flights
+
+        api.endpoint = 'http://localhost:8000'
+        api.api_key = 'tenant'
+        assert aio.async_api(api) is companion
+        assert companion.url('api/1/customers') == 'http://localhost:8000/api/1/customers'
+        assert companion.headers()['Authorization'] == 'Bearer tenant'
+
+    def test_session_per_loop(self, api):
+        async def session():
+            return api.get_session()
+
+        first = run(session())
+        second = run(session())
+        assert first is not second
+        # The session of the closed loop was closed when the next one was created
+        assert first.closed
+        assert list(api.sessions.values()) == [second]
+        aio.close_sessions(api.sessions)
+        assert second.closed
+        assert api.sessions == {}
+
+    @pytest.mark.skipif(sys.version_info < (3, 7), reason="besepa.use is scoped to threads without contextvars")
+    def test_use_per_task(self):
+        apis = [besepa.Api(api_key='tenant%d' % i) for i in range(10)]
+
+        async def task(api):
+            with besepa.use(api):
+                for _ in range(10):
+                    await asyncio.sleep(0)
+                    assert aio.async_api().api_key == api.api_key
+                return besepa.Customer({}).api
+
+        async def main():
+            return await asyncio.gather(*[task(api) for api in apis])
+
+        assert run(main()) == apis
+
+    @patch('besepa.util.ContextVar', None)
+    def test_use_in_loop_without_contextvars(self):
+        async def task():
+            with besepa.use(besepa.Api(api_key='tenant')):
+                pass
+
+        with pytest.raises(exceptions.InvalidConfig):
+            run(task())
+        with besepa.use(besepa.Api(api_key='tenant')) as api:
+            assert besepa.api.default() is api
+
+
+class TestAsyncResource(object):
+
+    def test_afind(self):
+        api = FakeAsyncApi({'id': '1', 'name': 'Ender'})
+        customer = run(besepa.Customer.afind('1', api=api))
+
+        assert isinstance(customer, besepa.Customer)
+        assert customer.name == 'Ender'
+        assert customer.api is api
+        assert api.calls == [('GET', 'https://sandbox.besepa.com/api/1/customers/1', None)]
+
+    def test_afind_fields(self):
+        api = FakeAsyncApi({'id': '1', 'name': 'Ender', 'status': 'ACTIVE'})
+        customer = run(besepa.Customer.afind('1', api=api, fields=['id', 'status']))
+
+        assert customer.to_dict() == {'id': '1', 'status': 'ACTIVE'}
+
+    def test_afind_fields_bad_request(self):
+        api = FakeAsyncApi({'error': {'error': 'invalid id'}})
+        customer = run(besepa.Customer.afind('1', api=api, fields=['id', 'status']))
+
+        assert not customer.success()
+
+    def test_aall(self):
+        api = FakeAsyncApi([{'id': '1'}, {'id': '2'}])
+        customers = run(besepa.Customer.aall({'per_page': 2}, api=api))
+
+        assert [customer.id for customer in customers] == ['1', '2']
+        assert api.calls == [('GET', 'https://sandbox.besepa.com/api/1/customers?per_page=2', None)]
+
+    def test_acreate_aupdate_adelete(self):
+        api = FakeAsyncApi({'id': '1'}, {'id': '1', 'name': 'Andrew'}, {'id': '1', 'status': 'REMOVED'})
+        customer = besepa.Customer({'name': 'Ender'}, api=api)
+
+        assert run(customer.acreate()) is True
+        assert run(customer.aupdate({'name': 'Andrew'})) is True
+        assert run(customer.adelete()) is True
+        assert customer.status == 'REMOVED'
+        assert [call[:2] for call in api.calls] == [
+            ('POST', 'https://sandbox.besepa.com/api/1/customers'),
+            ('PATCH', 'https://sandbox.besepa.com/api/1/customers/1'),
+            ('DELETE', 'https://sandbox.besepa.com/api/1/customers/1'),
+        ]
+        assert api.calls[0][2] == {'customer': {'name': 'Ender'}}
+
+    def test_aupdate_changes(self):
+        api = FakeAsyncApi({'id': '1', 'name': 'Andrew'})
+        customer = besepa.Customer.from_response({'id': '1', 'name': 'Ender'}, api=api)
+
+        assert run(customer.aupdate()) is True
+        assert api.calls == []
+        customer.name = 'Andrew'
+        assert run(customer.aupdate()) is True
+        assert api.calls == [('PATCH', 'https://sandbox.besepa.com/api/1/customers/1', {'name': 'Andrew'})]
+        assert not customer.is_dirty()
+
+    def test_acreate_debit(self):
+        api = FakeAsyncApi({'id': 'D1'})
+        customer = besepa.Customer({'id': '1'}, api=api)
+        debit = run(customer.acreate_debit({'amount': 100}))
+
+        assert isinstance(debit, Resource)
+        assert debit.id == 'D1'
+        assert api.calls == [('POST', 'https://sandbox.besepa.com/api/1/customers/1/debits', {'amount': 100})]
+
+    def test_alist_bank_accounts(self):
+        api = FakeAsyncApi([{'id': 'BA1'}])
+        customer = besepa.Customer({'id': '1'}, api=api)
+        bank_accounts = run(customer.alist_bank_accounts())
+
+        assert [bank_account.id for bank_account in bank_accounts] == ['BA1']
+
+    def test_sync_resource_uses_companion(self):
+        customer = besepa.Customer({'id': '1'})
+        companion = aio.async_api(customer.api)
+        companion.request = FakeAsyncApi({'id': '1', 'name': 'Andrew'}).request
+
+        assert run(customer.aupdate({'name': 'Andrew'})) is True
+        assert customer.name == 'Andrew'
+
+    def test_afind_keeps_sync_api(self):
+        api = besepa.Api(api_key='dummy')
+        aio.async_api(api).request = FakeAsyncApi({'id': '1', 'name': 'Ender'}).request
+        api.http_call = Mock(return_value={'id': '1', 'name': 'Andrew'})
+
+        customer = run(besepa.Customer.afind('1', api=api))
+        assert customer.api is api
+        customer.name = 'Andrew'
+        assert customer.update() is True
+        assert api.http_call.call_args[0][1] == 'PATCH'
+
+    def test_concurrent(self):
+        api = FakeAsyncApi(*[{'id': str(i)} for i in range(50)])
+
+        async def find_many():
+            return await asyncio.gather(*[besepa.Customer.afind(str(i), api=api) for i in range(50)])
+
+        customers = run(find_many())
+        assert len(customers) == 50
+        assert len(api.calls) == 50
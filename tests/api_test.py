@@ -1,10 +1,20 @@
 import json
+import logging
 import os
+import threading
+import time
 from collections import namedtuple
 
 import pytest
+import requests
 
 import besepa
+import besepa.cache
+import besepa.codec
+import besepa.idempotency
+import besepa.ratelimit
+import besepa.retry
+import besepa.singleflight
 
 try:  # pragma: no cover
     from unittest.mock import Mock, patch
@@ -44,14 +54,265 @@ class TestApi(object):
         with pytest.raises(besepa.exceptions.InvalidConfig):
             besepa.Api(mode='bad', api_key='dummy')
 
-    @patch('besepa.api.requests.request', return_value=Mock)
-    def test_http_call(self, requests_mock, api):
+    def test_http_call(self, api):
         Response = namedtuple('Response', 'status_code reason headers content')
-        requests_mock.return_value = Response(200, 'Failed', {}, 'Test'.encode())
+        api.session.request = Mock(return_value=Response(200, 'Failed', {}, 'Test'.encode()))
+        api.handle_response = Mock()
+        api.http_call('https://sandbox.besepa.com/api/1/customers', 'GET')
+        api.session.request.assert_called_once_with('GET', 'https://sandbox.besepa.com/api/1/customers', proxies=None)
+        api.handle_response.assert_called_once_with(api.session.request.return_value, b'Test')
+
+    def test_http_call_encodes_body(self, api):
+        response = Mock(status_code=200, reason='OK', headers={}, content=b'{"response": {"id": "1"}}')
+        api.session.request = Mock(return_value=response)
+
+        assert api.http_call('https://sandbox.besepa.com/api/1/customers', 'POST',
+                             json={'name': 'Ender'}, headers={}) == {'id': '1'}
+        kwargs = api.session.request.call_args[1]
+        assert 'json' not in kwargs
+        assert api.codec.loads(kwargs['data']) == {'name': 'Ender'}
+
+    @pytest.mark.parametrize('name', ['json', besepa.codec.get_codec().name])
+    def test_codec_option(self, name):
+        new_api = besepa.Api(api_key='dummy', codec=name)
+        response = Mock(status_code=200)
+
+        assert new_api.codec.name == name
+        assert new_api.handle_response(response, b'{"response": [{"id": "1"}]}') == [{'id': '1'}]
+
+    def test_error_content_decoded(self, api):
+        response = Mock(status_code=404)
+        with pytest.raises(besepa.ResourceNotFound) as error:
+            api.handle_response(response, b'{"error": "not found"}')
+        assert error.value.content == '{"error": "not found"}'
+
+    @pytest.mark.parametrize('mode, level, logged', [
+        ('sandbox', logging.DEBUG, True), ('sandbox', logging.INFO, False), ('live', logging.DEBUG, False),
+    ])
+    def test_http_call_debug_logging(self, caplog, mode, level, logged):
+        class Content(bytes):
+            decoded = 0
+
+            def decode(self, *args):
+                Content.decoded += 1
+                return super(Content, self).decode(*args)
+
+        codec = Mock(loads=Mock(return_value={'response': {}}), dumps=Mock(return_value=b'{}'))
+        new_api = besepa.Api(mode=mode, api_key='dummy', codec=codec)
+        new_api.session.request = Mock(return_value=Mock(
+            status_code=200, reason='OK', headers={'Besepa-Debug-Id': 'abc'}, content=Content(b'{"response": {}}')))
+        caplog.set_level(level, logger='besepa.api')
+        new_api.http_call('https://sandbox.besepa.com/api/1/customers', 'POST', json={'name': 'Ender'}, headers={})
+
+        assert ('Body: {"response": {}}' in caplog.text) is logged
+        assert ("Body: {'name': 'Ender'}" in caplog.text) is logged
+        assert Content.decoded == (1 if logged else 0)
+        assert ('debug_id: abc' in caplog.text) is (level == logging.DEBUG)
+
+    def test_session_pool_options(self):
+        new_api = besepa.Api(api_key='dummy', pool_connections=4, pool_maxsize=32, pool_block=True)
+        adapter = new_api.session.get_adapter('https://sandbox.besepa.com')
+
+        assert adapter._pool_connections == 4
+        assert adapter._pool_maxsize == 32
+        assert adapter._pool_block is True
+        assert new_api.session.headers['Connection'] == 'keep-alive'
+
+    def test_session_keep_alive_disabled(self):
+        new_api = besepa.Api(api_key='dummy', keep_alive=False)
+
+        assert new_api.session.headers['Connection'] == 'close'
+
+    def test_session_reused(self, api):
+        assert api.session is api.session
+        with patch.object(api.session, 'request') as request:
+            request.return_value = Mock(status_code=200, reason='OK', headers={}, content=b'')
+            api.http_call('https://sandbox.besepa.com/api/1/customers', 'GET')
+            api.http_call('https://sandbox.besepa.com/api/1/customers/1', 'GET')
+        assert request.call_count == 2
+
+    def test_rate_limit_option(self):
+        assert besepa.Api(api_key='dummy').rate_limiter.rate is None
+        assert besepa.Api(api_key='dummy', rate_limit=5).rate_limiter.rate == 5
+        assert besepa.Api(mode='live', api_key='dummy', rate_limit={'live': 20, 'sandbox': 2}).rate_limiter.rate == 20
+
+        limiter = besepa.ratelimit.RateLimiter(3)
+        assert besepa.Api(api_key='dummy', rate_limit=limiter).rate_limiter is limiter
+
+    @pytest.mark.parametrize('status, headers, throttled', [
+        (200, {}, False), (429, {}, True), (503, {'Retry-After': '2'}, True), (500, {}, False),
+    ])
+    def test_http_call_paces(self, api, status, headers, throttled):
+        api.rate_limiter = Mock()
+        api.session.request = Mock(return_value=Mock(status_code=status, reason='', headers=headers, content=b''))
         api.handle_response = Mock()
         api.http_call('https://sandbox.besepa.com/api/1/customers', 'GET')
-        requests_mock.assert_called_once_with('GET', 'https://sandbox.besepa.com/api/1/customers', proxies=None)
-        api.handle_response.assert_called_once_with(requests_mock.return_value, 'Test')
+
+        api.rate_limiter.acquire.assert_called_once_with()
+        assert api.rate_limiter.throttle.called is throttled
+        assert api.rate_limiter.succeed.called is not throttled
+        if headers:
+            api.rate_limiter.throttle.assert_called_once_with(2.0)
+
+    @patch('besepa.api.time.sleep')
+    def test_request_retries_idempotent(self, sleep, http_call_mock):
+        http_call_mock.http_call.side_effect = [requests.ConnectionError(), {'id': '1'}]
+
+        assert http_call_mock.request('https://sandbox.besepa.com/api/1/customers/1', 'GET') == {'id': '1'}
+        assert http_call_mock.http_call.call_count == 2
+        assert sleep.call_count == 1
+        assert http_call_mock.retry_policy.retries == 1
+
+    @patch('besepa.api.time.sleep')
+    def test_request_retries_exhausted(self, sleep, http_call_mock):
+        error = besepa.exceptions.ServerError(Mock(status_code=503, headers={}))
+        http_call_mock.http_call.side_effect = error
+
+        with pytest.raises(besepa.exceptions.ServerError):
+            http_call_mock.request('https://sandbox.besepa.com/api/1/customers/1', 'DELETE')
+        assert http_call_mock.http_call.call_count == 3
+
+    @patch('besepa.api.time.sleep')
+    def test_request_does_not_retry_post(self, sleep, http_call_mock):
+        http_call_mock.http_call.side_effect = requests.ConnectionError()
+
+        with pytest.raises(requests.ConnectionError):
+            http_call_mock.request('https://sandbox.besepa.com/api/1/customers', 'POST', {})
+        assert http_call_mock.http_call.call_count == 1
+        assert not sleep.called
+
+    @patch('besepa.api.time.sleep')
+    def test_request_retries_post_with_idempotency_key(self, sleep, http_call_mock):
+        http_call_mock.http_call.side_effect = [requests.Timeout(), {'id': '1'}]
+
+        assert http_call_mock.post('api/1/customers', {}, idempotency_key='key') == {'id': '1'}
+        assert http_call_mock.http_call.call_count == 2
+
+    def test_retry_option(self):
+        assert besepa.Api(api_key='dummy').retry_policy.max_attempts == 3
+        assert besepa.Api(api_key='dummy', retry=False).retry_policy.max_attempts == 1
+
+        policy = besepa.retry.RetryPolicy(max_attempts=5)
+        assert besepa.Api(api_key='dummy', retry=policy).retry_policy is policy
+
+    def test_cache_option(self):
+        assert besepa.Api(api_key='dummy').cache is None
+        assert isinstance(besepa.Api(api_key='dummy', cache=True).cache, besepa.cache.ResponseCache)
+
+        cache = besepa.cache.ResponseCache()
+        assert besepa.Api(api_key='dummy', cache=cache).cache is cache
+
+    def test_cached_get(self):
+        new_api = besepa.Api(api_key='dummy', cache=True)
+        new_api.request = Mock(return_value={'id': '1'})
+
+        assert new_api.get('api/1/customers/1') == {'id': '1'}
+        assert new_api.get('api/1/customers/1') == {'id': '1'}
+        assert new_api.request.call_count == 1
+        assert new_api.cache.stats()['hits'] == 1
+
+    def test_error_not_cached(self):
+        new_api = besepa.Api(api_key='dummy', cache=True)
+        new_api.request = Mock(return_value={'error': {'error': 'invalid id'}})
+
+        assert new_api.get('api/1/customers/1') == {'error': {'error': 'invalid id'}}
+        new_api.get('api/1/customers/1')
+        assert new_api.request.call_count == 2
+        assert len(new_api.cache) == 0
+
+    @pytest.mark.parametrize('method, args', [
+        ('patch', ('api/1/customers/1', {'name': 'Andrew'})),
+        ('delete', ('api/1/customers/1',)),
+        ('post', ('api/1/customers/1/debits', {'amount': 1})),
+    ])
+    def test_cache_invalidated(self, method, args):
+        new_api = besepa.Api(api_key='dummy', cache=True)
+        new_api.request = Mock(return_value={'id': '1'})
+        new_api.get('api/1/customers/1')
+        new_api.get('api/1/customers?page=1')
+        new_api.get('api/1/debits')
+        getattr(new_api, method)(*args)
+
+        assert list(new_api.cache.entries) == ['api/1/debits']
+
+    def test_cache_invalidated_on_error(self):
+        new_api = besepa.Api(api_key='dummy', cache=True)
+        new_api.request = Mock(return_value={'id': '1'})
+        new_api.get('api/1/customers/1')
+        new_api.request.side_effect = requests.Timeout()
+
+        with pytest.raises(requests.Timeout):
+            new_api.patch('api/1/customers/1', {'name': 'Andrew'})
+        assert len(new_api.cache) == 0
+
+    def test_conditional_get(self):
+        new_api = besepa.Api(api_key='dummy', conditional=True)
+        url = 'https://sandbox.besepa.com/api/1/customers?page=1'
+        body = json.dumps({'response': [{'id': '1'}]}).encode()
+        new_api.session.request = Mock(side_effect=[
+            Mock(status_code=200, reason='OK', headers={'ETag': '"v1"'}, content=body),
+            Mock(status_code=304, reason='Not Modified', headers={}, content=b''),
+            Mock(status_code=200, reason='OK', headers={'ETag': '"v2"'}, content=body),
+        ])
+
+        first = new_api.http_call(url, 'GET', headers={'Accept': 'application/json'})
+        second = new_api.http_call(url, 'GET', headers={'Accept': 'application/json'})
+        third = new_api.http_call(url, 'GET', headers={'Accept': 'application/json'})
+
+        assert first == second == third == [{'id': '1'}]
+        calls = new_api.session.request.call_args_list
+        assert 'If-None-Match' not in calls[0][1]['headers']
+        assert calls[1][1]['headers'] == {'Accept': 'application/json', 'If-None-Match': '"v1"'}
+        assert calls[2][1]['headers']['If-None-Match'] == '"v1"'
+        assert new_api.validators.lookup(url)[0] == {'If-None-Match': '"v2"'}
+        assert new_api.validators.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    def test_conditional_only_get(self):
+        new_api = besepa.Api(api_key='dummy', conditional=True)
+        url = 'https://sandbox.besepa.com/api/1/customers/1'
+        new_api.validators.store(url, {'ETag': '"v1"'}, {'id': '1'})
+        new_api.session.request = Mock(return_value=Mock(status_code=200, reason='OK', headers={}, content=b''))
+
+        new_api.http_call(url, 'PATCH', headers={})
+        assert new_api.session.request.call_args[1]['headers'] == {}
+
+    def test_close(self):
+        with besepa.Api(api_key='dummy') as new_api:
+            new_api.session.close = Mock()
+        new_api.session.close.assert_called_once_with()
+
+    def test_url(self, api):
+        assert api.url('api/1/customers') == 'https://sandbox.besepa.com/api/1/customers'
+        api.endpoint = 'http://127.0.0.1:8000/'
+        assert api.url('/api/1/customers/1') == besepa.util.join_url(api.endpoint, '/api/1/customers/1')
+
+    def test_headers_cached(self, api):
+        headers = api.headers()
+        headers['X-Test'] = '1'
+
+        assert 'X-Test' not in api.headers()
+        assert api.headers()['Authorization'] == 'Bearer dummy'
+        api.api_key = 'other'
+        assert api.headers()['Authorization'] == 'Bearer other'
+
+    def test_clone(self):
+        cache = besepa.cache.ResponseCache(ttls={'api/1/customers': 300})
+        limiter = besepa.ratelimit.RateLimiter(5)
+        new_api = besepa.Api(api_key='dummy', cache=cache, rate_limit=limiter, pool_maxsize=20,
+                             idempotency_store=besepa.idempotency.IdempotencyStore())
+        tenant = new_api.clone(api_key='tenant')
+
+        assert tenant.api_key == 'tenant'
+        assert tenant.headers()['Authorization'] == 'Bearer tenant'
+        assert tenant.session is new_api.session
+        assert tenant.codec is new_api.codec
+        assert tenant.cache is not cache and tenant.cache.ttl_for('api/1/customers/1') == 300
+        assert tenant.rate_limiter is not limiter and tenant.rate_limiter.rate == 5
+        assert tenant.idempotency_store is None
+
+        new_api.session.close = Mock()
+        tenant.close()
+        assert not new_api.session.close.called
 
     def test_bad_request(self, http_call_mock):
         http_call_mock.http_call.side_effect = besepa.exceptions.BadRequest('error', '""')
@@ -62,6 +323,64 @@ class TestApi(object):
             'https://sandbox.besepa.com/api/1/customers', 'GET', json=None, headers=http_call_mock.headers())
         assert customer.get('error') is not None
 
+    def test_coalesce_option(self):
+        assert besepa.Api(api_key='dummy').flights is None
+        assert isinstance(besepa.Api(api_key='dummy', coalesce=True).flights, besepa.singleflight.SingleFlight)
+        flights = besepa.singleflight.SingleFlight()
+        assert besepa.Api(api_key='dummy', coalesce=flights).flights is flights
+        assert besepa.Api(api_key='dummy', coalesce=flights).clone().flights not in (None, flights)
+
+    def test_coalesced_get(self):
+        new_api = besepa.Api(api_key='dummy', coalesce=True)
+        release = threading.Event()
+
+        def request(url, method, body=None, headers=None):
+            release.wait(5)
+            return {'id': '1', 'bank_accounts': [{'id': 'BA1'}]}
+
+        new_api.request = Mock(side_effect=request)
+        customers = []
+        threads = [threading.Thread(target=lambda: customers.append(besepa.Customer.find('1', api=new_api)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while new_api.flights.stats()['coalesced'] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        new_api.request.assert_called_once_with('https://sandbox.besepa.com/api/1/customers/1', 'GET', headers={})
+        assert [customer.bank_accounts[0].id for customer in customers] == ['BA1'] * 4
+        # Each caller gets its own resource
+        assert len(set(id(customer.bank_accounts) for customer in customers)) == 4
+
+    def test_flight_key(self, api):
+        url = 'https://sandbox.besepa.com/api/1/customers/1'
+        assert api.flight_key(url) == api.flight_key(url, {})
+        assert api.flight_key(url) != api.clone(api_key='other').flight_key(url)
+        assert api.flight_key(url, {'X-Tenant': '1'}) != api.flight_key(url)
+
+    def test_get_content(self):
+        new_api = besepa.Api(api_key='dummy', conditional=True, cache=True)
+        url = 'https://sandbox.besepa.com/api/1/customers?page=1'
+        body = b'{"response": [{"id": "1"}]}'
+        new_api.session.request = Mock(return_value=Mock(status_code=200, reason='OK', headers={'ETag': '"v1"'},
+                                                         content=body))
+
+        assert new_api.get_content('api/1/customers?page=1') == body
+        assert new_api.get_content('api/1/customers?page=1') == body
+        assert new_api.session.request.call_count == 2
+        assert 'If-None-Match' not in new_api.session.request.call_args[1]['headers']
+        assert new_api.validators.lookup(url) == ({}, None)
+
+    def test_get_content_bad_request(self, api):
+        api.session.request = Mock(return_value=Mock(status_code=400, reason='Bad Request', headers={},
+                                                     content=b'{"error": "invalid"}'))
+
+        with pytest.raises(besepa.exceptions.BadRequest):
+            api.get_content('api/1/customers')
+
     def test_get(self, request_mock):
         request_mock.get('api/1/customers?page=1')
 
@@ -79,6 +398,41 @@ class TestApi(object):
         assert customer.get('error') is None
         assert customer.get('id') is not None
 
+    def test_post_idempotency_key(self, request_mock):
+        request_mock.post('api/1/customers', {'name': 'Ender'}, {'X': '1'}, idempotency_key='key')
+
+        request_mock.request.assert_called_once_with(
+            'https://sandbox.besepa.com/api/1/customers', 'POST', body={'name': 'Ender'},
+            headers={'X': '1', 'Idempotency-Key': 'key'})
+
+    def test_post_generated_idempotency_key(self):
+        new_api = besepa.Api(api_key='dummy', idempotency_keys=True)
+        new_api.request = Mock()
+        new_api.post('api/1/customers', {})
+        new_api.post('api/1/customers', {})
+
+        keys = [call[1]['headers']['Idempotency-Key'] for call in new_api.request.call_args_list]
+        assert len(set(keys)) == 2
+
+    def test_post_idempotency_store(self):
+        store = besepa.idempotency.IdempotencyStore()
+        new_api = besepa.Api(api_key='dummy', idempotency_store=store)
+        new_api.request = Mock(return_value={'id': 'D1'})
+
+        assert new_api.post('api/1/customers/1/debits', {}, {'Idempotency-Key': 'key'}) == {'id': 'D1'}
+        assert new_api.post('api/1/customers/1/debits', {}, idempotency_key='key') == {'id': 'D1'}
+        assert new_api.request.call_count == 1
+        assert store.get('key')['url'] == 'https://sandbox.besepa.com/api/1/customers/1/debits'
+
+    def test_post_idempotency_store_pending_on_error(self):
+        store = besepa.idempotency.IdempotencyStore()
+        new_api = besepa.Api(api_key='dummy', idempotency_store=store)
+        new_api.request = Mock(side_effect=requests.Timeout())
+
+        with pytest.raises(requests.Timeout):
+            new_api.post('api/1/customers/1/debits', {}, idempotency_key='key')
+        assert store.pending() == ['key']
+
     def test_patch(self, request_mock):
         request_mock.request.return_value = {'id': 'test'}
         customer_attributes = {'name': 'Andrew Wiggin'}
@@ -119,6 +473,7 @@ class TestApi(object):
         (409, besepa.exceptions.ResourceConflict),
         (410, besepa.exceptions.ResourceGone),
         (422, besepa.exceptions.ResourceInvalid),
+        (429, besepa.exceptions.TooManyRequests),
         (402, besepa.exceptions.ClientError),
         (500, besepa.exceptions.ServerError),
         (600, besepa.exceptions.ConnectionError),
@@ -149,3 +504,76 @@ def test_default_configuration_missing_api_key():
     with pytest.raises(besepa.exceptions.MissingConfig):
         besepa.api.default()
     besepa.api.__api__ = default
+
+
+def test_default_configuration_thread_safe(monkeypatch):
+    monkeypatch.setattr(besepa.api, '__api__', None)
+    monkeypatch.setenv('BESEPA_API_KEY', 'dummy')
+    created = []
+
+    class SlowApi(besepa.Api):
+        def __init__(self, *args, **kwargs):
+            time.sleep(0.01)
+            super(SlowApi, self).__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(besepa.api, 'Api', SlowApi)
+    start = threading.Event()
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(besepa.api.default())
+
+    threads = [threading.Thread(target=worker) for _ in range(32)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert len(results) == 32 and all(result is created[0] for result in results)
+
+
+def test_use(monkeypatch):
+    default = besepa.Api(api_key='dummy')
+    monkeypatch.setattr(besepa.api, '__api__', default)
+    tenant = besepa.Api(api_key='tenant')
+    other = besepa.Api(api_key='other')
+
+    with besepa.use(tenant):
+        assert besepa.api.default() is tenant
+        assert besepa.Customer({'id': '1'}).api is tenant
+        with besepa.use(other):
+            assert besepa.api.default() is other
+        assert besepa.api.default() is tenant
+    assert besepa.api.default() is default
+
+
+def test_use_stress(monkeypatch):
+    default = besepa.Api(api_key='dummy')
+    monkeypatch.setattr(besepa.api, '__api__', default)
+    apis = [default.clone(api_key='tenant%d' % i) for i in range(16)]
+    start = threading.Event()
+    failures = []
+
+    def worker(api):
+        start.wait()
+        with besepa.use(api):
+            for _ in range(500):
+                if besepa.api.default() is not api or besepa.Customer({}).api.api_key != api.api_key:
+                    failures.append(api.api_key)
+                time.sleep(0)
+        if besepa.api.default() is not default:
+            failures.append(api.api_key)
+
+    threads = [threading.Thread(target=worker, args=(api,)) for api in apis]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+
+    assert failures == []
+    assert all(api.session is default.session for api in apis)
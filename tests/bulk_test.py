@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+
+import pytest
+
+import besepa
+import besepa.idempotency
+from besepa import bulk
+
+try:  # pragma: no cover
+    from unittest.mock import Mock, patch
+except ImportError:  # pragma: no cover
+    from mock import Mock, patch
+
+besepa.configure(api_key='dummy')
+
+
+class Crash(Exception):
+    pass
+
+
+class TestImap(object):
+
+    def test_all_items(self):
+        results = list(bulk.imap(lambda x: x * 2, range(20), concurrency=4))
+
+        assert sorted(result for _, result, _ in results) == [x * 2 for x in range(20)]
+        assert all(error is None for _, _, error in results)
+
+    def test_item_errors(self):
+        def func(x):
+            if x % 2:
+                raise besepa.exceptions.ServerError('error')
+            return x
+
+        results = dict((item, (result, error)) for item, result, error in bulk.imap(func, range(6), concurrency=3))
+
+        assert results[0] == (0, None)
+        assert isinstance(results[1][1], besepa.exceptions.ServerError)
+
+    def test_unexpected_errors_propagate(self):
+        def func(x):
+            raise ValueError(x)
+
+        with pytest.raises(ValueError):
+            list(bulk.imap(func, range(3)))
+
+    def test_bounded_concurrency(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def func(x):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        list(bulk.imap(func, range(20), concurrency=3))
+        assert state['peak'] <= 3
+
+    def test_lazy_consumption(self):
+        pulled = []
+
+        def items():
+            for x in range(1000):
+                pulled.append(x)
+                yield x
+
+        results = bulk.imap(lambda x: x, items(), concurrency=2)
+        next(results)
+        assert len(pulled) <= 5
+        results.close()
+
+
+class TestSubmitDebits(object):
+
+    @patch('bulk_test.besepa.Api.post', autospec=True)
+    def test_submit_debits(self, mock):
+        def post(api, url, params, headers):
+            if url.endswith('/2/debits'):
+                raise besepa.exceptions.ResourceInvalid('error', '{"amount": "invalid"}')
+            return {'id': 'D' + url.split('/')[-2], 'amount': params['amount']}
+
+        mock.side_effect = post
+        debits = [(str(i), {'amount': i * 100}) for i in range(1, 5)]
+
+        results = dict((result.customer_id, result) for result in bulk.submit_debits(debits, concurrency=2))
+
+        assert sorted(results) == ['1', '2', '3', '4']
+        assert results['1'].success()
+        assert results['1'].debit.id == 'D1'
+        assert results['1'].debit.amount == 100
+        assert not results['2'].success()
+        assert isinstance(results['2'].error, besepa.exceptions.ClientError)
+        assert results['2'].attributes == {'amount': 200}
+        assert mock.call_count == 4
+
+    def test_submit_debits_bad_request(self):
+        api = besepa.Api(api_key='dummy')
+        api.http_call = Mock(side_effect=besepa.exceptions.BadRequest(None, '{"error": "invalid amount"}'))
+
+        result, = bulk.submit_debits([('1', {'amount': -1})], api=api)
+
+        assert not result.success()
+        assert result.debit is None
+        assert isinstance(result.error, besepa.exceptions.BadRequest)
+        assert json.loads(result.error.content) == {'error': 'invalid amount'}
+
+    def test_submit_debits_resume(self):
+        store = besepa.idempotency.IdempotencyStore()
+        api = besepa.Api(api_key='dummy', idempotency_store=store)
+        sent = []
+
+        def request(url, method, body=None, headers=None):
+            sent.append(headers['Idempotency-Key'])
+            if headers['Idempotency-Key'] == crash_at:
+                raise Crash()
+            return {'id': 'D-' + body['reference']}
+
+        api.request = request
+        debits = [(str(i), {'reference': 'R%d' % i}) for i in range(5)]
+        key = lambda customer_id, attributes: attributes['reference']  # noqa: E731
+
+        crash_at = 'R2'
+        with pytest.raises(Crash):
+            list(bulk.submit_debits(debits, concurrency=1, api=api, idempotency_key=key))
+        assert 'R2' in store.pending()
+        completed = set(sent) - set(['R2'])
+
+        crash_at = None
+        del sent[:]
+        results = list(bulk.submit_debits(debits, concurrency=1, api=api, idempotency_key=key))
+
+        assert sorted(sent) == sorted(set('R%d' % i for i in range(5)) - completed)
+        assert 'R0' not in sent and 'R2' in sent
+        assert sorted(result.debit.id for result in results) == ['D-R%d' % i for i in range(5)]
+
+
+class TestListBankAccounts(object):
+
+    @staticmethod
+    def get(api, url):
+        customer_id = url.split('/')[-2]
+        if customer_id == '2':
+            raise besepa.exceptions.ResourceNotFound('error')
+        if customer_id == '3':
+            return {'id': 'BA3'}
+        if customer_id == '4':
+            # What `Api.request` answers for a 400
+            return {'error': {'error': 'invalid customer'}}
+        return [{'id': 'BA%s' % customer_id}, {'id': 'BA%s-2' % customer_id}]
+
+    @patch('bulk_test.besepa.Api.get', autospec=True)
+    def test_list_bank_accounts(self, mock):
+        mock.side_effect = self.get
+        results = dict((result.customer_id, result) for result in bulk.list_bank_accounts(['1', '2', '3', '4'], 2))
+
+        assert [account.id for account in results['1'].bank_accounts] == ['BA1', 'BA1-2']
+        assert [account.id for account in results['3'].bank_accounts] == ['BA3']
+        assert not results['2'].success()
+        assert isinstance(results['2'].error, besepa.exceptions.ResourceNotFound)
+        assert results['4'].bank_accounts is None
+        assert isinstance(results['4'].error, besepa.exceptions.BadRequest)
+
+    @patch('bulk_test.besepa.Api.get', autospec=True)
+    def test_list_bank_accounts_many(self, mock):
+        mock.side_effect = self.get
+        accounts, errors = besepa.Customer.list_bank_accounts_many((str(i) for i in range(1, 21)), concurrency=4)
+
+        assert sorted(accounts, key=int) == [str(i) for i in range(1, 21) if i not in (2, 4)]
+        assert accounts['5'][1].id == 'BA5-2'
+        assert sorted(errors) == ['2', '4']
+        assert isinstance(errors['4'], besepa.exceptions.BadRequest)
+        assert mock.call_count == 20
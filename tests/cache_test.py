@@ -0,0 +1,145 @@
+import threading
+
+import pytest
+
+from besepa.cache import ResponseCache, ValidatorCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestResponseCache(object):
+
+    def test_hit_and_miss(self, clock):
+        cache = ResponseCache(clock=clock)
+
+        assert cache.get('api/1/customers/1') == (False, None)
+        cache.set('api/1/customers/1', {'id': '1'})
+        assert cache.get('api/1/customers/1') == (True, {'id': '1'})
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1}
+
+    def test_ttl(self, clock):
+        cache = ResponseCache(ttl=10, ttls={'api/1/customers/': 60, 'api/1/customers/1/bank_accounts': 0},
+                              clock=clock)
+        cache.set('api/1/debits', [])
+        cache.set('api/1/customers?page=1', [])
+        cache.set('api/1/customers/1/bank_accounts', [])
+
+        assert cache.ttl_for('api/1/customers/1') == 60
+        assert cache.ttl_for('api/1/customersX') == 10
+        assert len(cache) == 2
+        clock.now += 11
+        assert cache.get('api/1/debits') == (False, None)
+        assert cache.get('api/1/customers?page=1') == (True, [])
+        clock.now += 50
+        assert cache.get('api/1/customers?page=1') == (False, None)
+
+    def test_lru_eviction(self, clock):
+        cache = ResponseCache(maxsize=2, clock=clock)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('b') == (False, None)
+        assert cache.get('a') == (True, 1)
+        assert cache.get('c') == (True, 3)
+        assert cache.evictions == 1
+
+    def test_invalidate(self, clock):
+        cache = ResponseCache(clock=clock)
+        for path in ('api/1/customers?page=1', 'api/1/customers/1', 'api/1/customers/1/bank_accounts',
+                     'api/1/customers/12', 'api/1/customers/2', 'api/1/debits'):
+            cache.set(path, {})
+        cache.invalidate('api/1/customers/1')
+
+        assert sorted(cache.entries) == ['api/1/customers/12', 'api/1/customers/2', 'api/1/debits']
+
+    def test_invalidate_nested(self, clock):
+        cache = ResponseCache(clock=clock)
+        cache.set('api/1/customers/1', {})
+        cache.set('api/1/customers/1/debits', {})
+        cache.set('api/1/customers/2', {})
+        cache.invalidate('/api/1/customers/1/debits')
+
+        assert sorted(cache.entries) == ['api/1/customers/2']
+
+    def test_stale_set_ignored(self, clock):
+        cache = ResponseCache(clock=clock)
+        generation = cache.generation
+        cache.invalidate('api/1/customers/1')
+        cache.set('api/1/customers/1', {'name': 'stale'}, generation)
+
+        assert len(cache) == 0
+
+    def test_clear(self, clock):
+        cache = ResponseCache(clock=clock)
+        cache.set('a', 1)
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_thread_safe(self):
+        cache = ResponseCache(maxsize=50)
+
+        def worker(offset):
+            for i in range(500):
+                cache.set(str((offset + i) % 80), i)
+                cache.get(str(i % 80))
+                if i % 50 == 0:
+                    cache.invalidate(str(i % 80))
+
+        threads = [threading.Thread(target=worker, args=(i * 10,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(cache) <= 50
+        assert cache.hits + cache.misses == 2000
+
+
+class TestValidatorCache(object):
+
+    def test_store_and_lookup(self):
+        cache = ValidatorCache()
+        cache.store('url/1', {'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}, {'id': '1'})
+        cache.store('url/2', {'ETag': '"def"'}, [{'id': '2'}])
+        cache.store('url/3', {}, {'id': '3'})
+
+        assert cache.lookup('url/1') == ({'If-None-Match': '"abc"',
+                                          'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}, {'id': '1'})
+        assert cache.lookup('url/2') == ({'If-None-Match': '"def"'}, [{'id': '2'}])
+        assert cache.lookup('url/3') == ({}, None)
+
+    def test_response_without_validators_forgets_url(self):
+        cache = ValidatorCache()
+        cache.store('url/1', {'ETag': '"abc"'}, {'id': '1'})
+        cache.store('url/1', {}, {'id': '1'})
+
+        assert cache.lookup('url/1') == ({}, None)
+
+    def test_lru(self):
+        cache = ValidatorCache(maxsize=2)
+        for url in ('a', 'b', 'c'):
+            cache.store(url, {'ETag': url}, url)
+
+        assert len(cache) == 2
+        assert cache.lookup('a') == ({}, None)
+
+    def test_stats(self):
+        cache = ValidatorCache()
+        cache.count(True)
+        cache.count(False)
+        cache.count(True)
+
+        assert cache.stats() == {'hits': 2, 'misses': 1, 'size': 0}
@@ -0,0 +1,34 @@
+import pytest
+
+from besepa import codec, exceptions
+
+DATA = {'response': [{'id': '1', 'name': u'Ender Wiggin \xe7', 'amount': 10.5, 'active': True, 'tags': None}]}
+
+
+def installed():
+    return [name for name, (_, available) in sorted(codec.__codecs__.items()) if available]
+
+
+class TestCodec(object):
+
+    @pytest.mark.parametrize('name', installed())
+    def test_round_trip(self, name):
+        json_codec = codec.get_codec(name)
+        encoded = json_codec.dumps(DATA)
+
+        assert isinstance(encoded, bytes)
+        assert json_codec.loads(encoded) == DATA
+        assert codec.JSONCodec().loads(encoded) == DATA
+
+    def test_default_is_fastest(self):
+        expected = 'orjson' if codec.orjson else 'ujson' if codec.ujson else 'json'
+        assert codec.get_codec().name == expected
+
+    def test_invalid(self):
+        with pytest.raises(exceptions.InvalidConfig):
+            codec.get_codec('yaml')
+
+    def test_not_installed(self, monkeypatch):
+        monkeypatch.setitem(codec.__codecs__, 'ujson', (codec.UjsonCodec, False))
+        with pytest.raises(exceptions.MissingConfig):
+            codec.get_codec('ujson')
@@ -0,0 +1,4 @@
+import sys
+
+# besepa.aio and its tests use async syntax
+collect_ignore = ['aio_test.py'] if sys.version_info < (3, 5) else []
@@ -1,7 +1,7 @@
 try:  # pragma: no cover
-    from unittest.mock import patch
+    from unittest.mock import Mock, patch
 except ImportError:  # pragma: no cover
-    from mock import patch
+    from mock import Mock, patch
 import besepa
 from besepa.resource import Resource
 
@@ -34,3 +34,66 @@ class TestResource(object):
         mock.assert_called_once_with(response[0].api, 'api/1/customers/1/bank_accounts')
         assert len(response) == 1
         assert isinstance(response[0], Resource)
+
+    def test_cached_find(self):
+        api = besepa.Api(api_key='dummy', cache=True)
+        api.request = Mock(side_effect=[{'id': '1', 'name': 'Ender'}, [{'id': 'BA1'}],
+                                        {'id': '1', 'name': 'Andrew'}, {'id': '1', 'name': 'Andrew'}])
+
+        customer = besepa.Customer.find('1', api=api)
+        customer.list_bank_accounts()
+        assert besepa.Customer.find('1', api=api).name == 'Ender'
+        assert customer.list_bank_accounts()[0].id == 'BA1'
+        assert api.request.call_count == 2
+
+        customer.update({'name': 'Andrew'})
+        assert besepa.Customer.find('1', api=api).name == 'Andrew'
+        assert api.request.call_count == 4
+
+
+class TestNestedResources(object):
+
+    def test_nested_conversion(self):
+        customer = besepa.Customer({'id': '1', 'bank_accounts': [
+            {'id': 'BA1', 'mandate': {'id': 'MA1', 'status': 'SIGNED'}}]})
+
+        assert isinstance(customer.bank_accounts[0], besepa.BankAccount)
+        assert isinstance(customer.bank_accounts[0].mandate, besepa.Mandate)
+        assert customer.bank_accounts[0].mandate.status == 'SIGNED'
+
+    def test_registry(self):
+        from besepa.resource import Resource, __resources__
+
+        assert __resources__['debits'] is besepa.Debit
+        assert __resources__['customer'] is besepa.Customer
+        assert besepa.Customer.convert_resources is Resource.convert_resources
+        assert besepa.BankAccount.payload_name() == 'bank_account'
+        assert 'iban' in besepa.BankAccount.fields
+
+    @patch('customers_test.besepa.Api.post', autospec=True)
+    def test_create_debit(self, mock):
+        mock.return_value = {'id': 'DEB1', 'amount': 100, 'customer': {'id': '1'}}
+        debit = besepa.Customer({'id': '1'}).create_debit({'amount': 100})
+
+        assert isinstance(debit, besepa.Debit)
+        assert isinstance(debit.customer, besepa.Customer)
+        assert mock.call_args[0][1] == 'api/1/customers/1/debits'
+
+    @patch('customers_test.besepa.Api.get', autospec=True)
+    def test_list_debits_and_subscriptions(self, mock):
+        customer = besepa.Customer({'id': '1'})
+        mock.return_value = [{'id': 'DEB1'}]
+        assert isinstance(customer.list_debits()[0], besepa.Debit)
+        mock.return_value = [{'id': 'SUB1'}]
+        assert isinstance(customer.list_subscriptions()[0], besepa.Subscription)
+
+        assert [call[0][1] for call in mock.call_args_list] == [
+            'api/1/customers/1/debits', 'api/1/customers/1/subscriptions']
+
+    @patch('customers_test.besepa.Api.post', autospec=True)
+    def test_create_subscription(self, mock):
+        mock.return_value = {'id': 'SUB1', 'status': 'ACTIVE'}
+        subscription = besepa.Customer({'id': '1'}).create_subscription({'product_id': 'PR1'})
+
+        assert isinstance(subscription, besepa.Subscription)
+        assert mock.call_args[0][1:3] == ('api/1/customers/1/subscriptions', {'product_id': 'PR1'})
@@ -0,0 +1,39 @@
+try:  # pragma: no cover
+    from unittest.mock import patch
+except ImportError:  # pragma: no cover
+    from mock import patch
+import besepa
+
+besepa.configure(api_key='dummy')
+
+
+class TestDebit(object):
+
+    @patch('debits_test.besepa.Api.get', autospec=True)
+    def test_all(self, mock):
+        mock.return_value = [{'id': 'DEB1', 'debtor_bank_account': {'id': 'BA1'}}]
+        debits = besepa.Debit.all({'status': 'READY'})
+
+        mock.assert_called_once_with(debits[0].api, 'api/1/debits?status=READY')
+        assert isinstance(debits[0].debtor_bank_account, besepa.BankAccount)
+
+    @patch('debits_test.besepa.Api.get', autospec=True)
+    def test_find(self, mock):
+        mock.return_value = {'id': 'DEB1', 'amount': 100}
+        debit = besepa.Debit.find('DEB1')
+
+        mock.assert_called_once_with(debit.api, 'api/1/debits/DEB1')
+        assert isinstance(debit, besepa.Debit)
+        assert debit.amount == 100
+
+
+class TestSubscription(object):
+
+    @patch('debits_test.besepa.Api.delete', autospec=True)
+    def test_delete(self, mock):
+        mock.return_value = {'id': 'SUB1', 'status': 'CANCELED'}
+        subscription = besepa.Subscription({'id': 'SUB1'})
+
+        assert subscription.delete()
+        mock.assert_called_once_with(subscription.api, 'api/1/subscriptions/SUB1')
+        assert subscription.status == 'CANCELED'
@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+
+import pytest
+
+import besepa
+from besepa import export
+
+try:  # pragma: no cover
+    from unittest.mock import patch
+except ImportError:  # pragma: no cover
+    from mock import patch
+
+besepa.configure(api_key='dummy')
+
+
+def customer(i):
+    return {'id': str(i), 'name': 'Customer %d' % i,
+            'bank_account': {'iban': 'ES%02d' % i, 'mandate': {'status': 'SIGNED'}}}
+
+
+def pages(total, fail_at=None, rejected_at=None):
+    def get(api, url):
+        query = dict(part.split('=') for part in url.split('?')[1].split('&'))
+        page, per_page = int(query['page']), int(query['per_page'])
+        if page == fail_at:
+            raise besepa.exceptions.ServerError(None)
+        if page == rejected_at:
+            return {'error': {'error': 'bad page'}}
+        return [customer(i) for i in range((page - 1) * per_page, min(page * per_page, total))]
+    return get
+
+
+def test_flatten():
+    data = {'id': '1', 'tags': ['a', 'b'], 'empty': {}, 'bank_account': customer(1)['bank_account']}
+    assert export.flatten(data) == {
+        'id': '1', 'tags.0': 'a', 'tags.1': 'b', 'empty': {}, 'bank_account.iban': 'ES01',
+        'bank_account.mandate.status': 'SIGNED'}
+
+
+class TestExport(object):
+
+    @patch('export_test.besepa.Api.get', autospec=True)
+    def test_ndjson(self, mock):
+        mock.side_effect = pages(5)
+        fp = io.StringIO()
+
+        assert export.customers(fp, page_size=2) == 5
+        lines = [json.loads(line) for line in fp.getvalue().splitlines()]
+        assert lines == [customer(i) for i in range(5)]
+        assert mock.call_count == 3
+
+    @patch('export_test.besepa.Api.get', autospec=True)
+    def test_ndjson_fields(self, mock):
+        mock.side_effect = pages(2)
+        fp = io.StringIO()
+
+        export.customers(fp, fields=['id', 'bank_account.iban'])
+        assert json.loads(fp.getvalue().splitlines()[1]) == {'id': '1', 'bank_account': {'iban': 'ES01'}}
+
+    @patch('export_test.besepa.Api.get', autospec=True)
+    def test_csv(self, mock):
+        mock.side_effect = pages(3)
+        fp = io.StringIO()
+
+        export.customers(fp, format='csv', page_size=2)
+        rows = list(csv.DictReader(io.StringIO(fp.getvalue())))
+        assert len(rows) == 3
+        assert rows[2] == {'id': '2', 'name': 'Customer 2', 'bank_account.iban': 'ES02',
+                           'bank_account.mandate.status': 'SIGNED'}
+
+    @pytest.mark.parametrize('format', ['ndjson', 'csv'])
+    @patch('export_test.besepa.Api.get', autospec=True)
+    def test_non_ascii(self, mock, format, tmpdir):
+        mock.side_effect = [[{'id': '1', 'name': u'Andr\xe9 Wiggin'}], []]
+        output = str(tmpdir.join('customers'))
+        with io.open(output, 'w', encoding='utf-8') as fp:
+            export.customers(fp, format)
+        with io.open(output, encoding='utf-8') as fp:
+            assert u'Andr\xe9 Wiggin' in fp.read()
+
+    def test_bad_format(self):
+        with pytest.raises(besepa.exceptions.InvalidConfig):
+            export.customers(io.StringIO(), format='xml')
+
+    @pytest.mark.parametrize('format', ['ndjson', 'csv'])
+    @patch('export_test.besepa.Api.get', autospec=True)
+    def test_resume(self, mock, format, tmpdir):
+        output, checkpoint = str(tmpdir.join('customers')), str(tmpdir.join('checkpoint'))
+        mock.side_effect = pages(7, fail_at=3)
+        with open(output, 'w') as fp:
+            with pytest.raises(besepa.exceptions.ServerError):
+                export.customers(fp, format, page_size=2, checkpoint=checkpoint)
+            # Part of a page written before the interruption
+            fp.write('partial')
+        assert json.load(open(checkpoint))['page'] == 2
+
+        mock.side_effect = pages(7)
+        with open(output, 'a') as fp:
+            assert export.customers(fp, format, page_size=2, checkpoint=checkpoint) == 7
+        assert not tmpdir.join('checkpoint').exists()
+
+        with open(output) as fp:
+            if format == 'csv':
+                ids = [row['id'] for row in csv.DictReader(fp)]
+            else:
+                ids = [json.loads(line)['id'] for line in fp]
+        assert ids == [str(i) for i in range(7)]
+
+    @patch('export_test.besepa.Api.get', autospec=True)
+    def test_bad_request(self, mock, tmpdir):
+        checkpoint = str(tmpdir.join('checkpoint'))
+        mock.side_effect = pages(7, rejected_at=2)
+        fp = io.StringIO()
+
+        with pytest.raises(besepa.exceptions.BadRequest):
+            export.customers(fp, page_size=2, checkpoint=checkpoint)
+        assert [json.loads(line)['id'] for line in fp.getvalue().splitlines()] == ['0', '1']
+        assert json.load(open(checkpoint))['page'] == 1
+
+    @patch('export_test.besepa.Api.get', autospec=True)
+    def test_resume_other_listing(self, mock, tmpdir):
+        checkpoint = str(tmpdir.join('checkpoint'))
+        mock.side_effect = pages(7, fail_at=2)
+        with pytest.raises(besepa.exceptions.ServerError):
+            export.customers(io.StringIO(), page_size=2, params={'status': 'ACTIVE'}, checkpoint=checkpoint)
+        assert json.load(open(checkpoint))['params'] == {'status': 'ACTIVE'}
+
+        mock.reset_mock()
+        mock.side_effect = pages(7)
+        for page_size, params in ((3, {'status': 'ACTIVE'}), (2, None), (2, {'status': 'REMOVED'})):
+            with pytest.raises(besepa.exceptions.InvalidConfig):
+                export.customers(io.StringIO(), page_size=page_size, params=params, checkpoint=checkpoint)
+        assert not mock.called
+
+        assert export.customers(io.StringIO(), page_size=2, params={'status': 'ACTIVE'},
+                                checkpoint=checkpoint) == 7
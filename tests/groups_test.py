@@ -0,0 +1,27 @@
+try:  # pragma: no cover
+    from unittest.mock import patch
+except ImportError:  # pragma: no cover
+    from mock import patch
+import besepa
+
+besepa.configure(api_key='dummy')
+
+
+class TestGroup(object):
+
+    @patch('groups_test.besepa.Api.post', autospec=True)
+    def test_create(self, mock):
+        mock.return_value = {'id': 'G1', 'name': 'Premium'}
+        group = besepa.Group({'name': 'Premium'})
+
+        assert group.create()
+        mock.assert_called_once_with(group.api, 'api/1/groups', {'group': {'name': 'Premium'}}, {})
+        assert group.id == 'G1'
+
+    @patch('groups_test.besepa.Api.patch', autospec=True)
+    def test_update(self, mock):
+        mock.return_value = {'id': 'G1', 'name': 'Gold'}
+        group = besepa.Group({'id': 'G1', 'name': 'Premium'})
+
+        assert group.update({'name': 'Gold'})
+        mock.assert_called_once_with(group.api, 'api/1/groups/G1', {'name': 'Gold'}, {})
@@ -0,0 +1,35 @@
+from besepa.idempotency import COMPLETED, SENT, IdempotencyStore, new_key
+
+
+class TestIdempotencyStore(object):
+
+    def test_new_key(self):
+        assert new_key() != new_key()
+        assert len(new_key()) == 32
+
+    def test_records(self):
+        store = IdempotencyStore()
+        store.sent('k1', 'url/1')
+        store.sent('k2', 'url/2')
+        store.completed('k1', 'url/1', {'id': '1'})
+
+        assert store.get('k1') == {'key': 'k1', 'url': 'url/1', 'state': COMPLETED, 'response': {'id': '1'}}
+        assert store.get('k2')['state'] == SENT
+        assert store.get('k3') is None
+        assert store.pending() == ['k2']
+        assert 'k1' in store and 'k3' not in store
+        assert len(store) == 2
+
+    def test_persistence(self, tmpdir):
+        path = str(tmpdir.join('keys'))
+        store = IdempotencyStore(path)
+        store.sent('k1', 'url/1')
+        store.completed('k1', 'url/1', {'id': '1'})
+        store.sent('k2', 'url/2')
+
+        reloaded = IdempotencyStore(path)
+        assert reloaded.get('k1')['response'] == {'id': '1'}
+        assert reloaded.pending() == ['k2']
+
+    def test_missing_file(self, tmpdir):
+        assert len(IdempotencyStore(str(tmpdir.join('missing')))) == 0
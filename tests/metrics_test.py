@@ -0,0 +1,144 @@
+import pytest
+import requests
+
+import besepa
+from besepa import metrics
+
+try:  # pragma: no cover
+    from unittest.mock import Mock, patch
+except ImportError:  # pragma: no cover
+    from mock import Mock, patch
+
+
+def event(method='GET', url='https://sandbox.besepa.com/api/1/customers', status=200, latency=0.1, **kwargs):
+    event = metrics.RequestEvent(method, url, **kwargs)
+    event.status = status
+    event.latency = latency
+    event.bytes_in = 10
+    return event
+
+
+@pytest.mark.parametrize('url, template', [
+    ('https://sandbox.besepa.com/api/1/customers', 'api/1/customers'),
+    ('https://sandbox.besepa.com/api/1/customers?page=2', 'api/1/customers'),
+    ('https://sandbox.besepa.com/api/1/customers/CUS1', 'api/1/customers/{id}'),
+    ('https://sandbox.besepa.com/api/1/customers/CUS1/debits/DEB1/', 'api/1/customers/{id}/debits/{id}'),
+])
+def test_path_template(url, template):
+    assert metrics.path_template(url) == template
+
+
+class TestLatencyHistogram(object):
+
+    def test_percentiles(self):
+        histogram = metrics.LatencyHistogram()
+        for i in range(1, 101):
+            histogram.on_response(event(latency=i / 1000.0))
+        histogram.on_response(event(url='https://sandbox.besepa.com/api/1/customers/1', latency=2))
+
+        assert 0.05 <= histogram.percentile('GET', 'api/1/customers', 0.5) <= 0.05 * 1.25
+        assert 0.099 <= histogram.percentile('GET', 'api/1/customers', 0.99) <= 0.1
+        assert histogram.percentile('GET', 'api/1/customers/{id}', 0.5) == 2
+        assert histogram.percentile('POST', 'api/1/customers', 0.5) is None
+
+    def test_summary(self):
+        histogram = metrics.LatencyHistogram()
+        histogram.on_response(event(latency=0.2, bytes_out=5))
+        histogram.on_error(event(status=500))
+        histogram.on_retry(event(status=None))
+
+        summary = histogram.summary()[('GET', 'api/1/customers')]
+        assert summary['count'] == 1
+        assert summary['errors'] == summary['retries'] == 1
+        assert (summary['bytes_in'], summary['bytes_out']) == (10, 5)
+        assert summary['mean'] == summary['max'] == summary['p50'] == summary['p99'] == 0.2
+
+        histogram.clear()
+        assert histogram.summary() == {}
+
+
+class TestStatsdHooks(object):
+
+    def test_stats(self):
+        client = Mock()
+        hooks = metrics.StatsdHooks(client)
+        hooks.on_response(event(url='https://sandbox.besepa.com/api/1/customers/1/debits', latency=0.25))
+        hooks.on_retry(event())
+
+        client.timing.assert_called_once_with('besepa.GET.api.1.customers.id.debits.time', 250)
+        assert [call[0][0] for call in client.incr.call_args_list] == [
+            'besepa.GET.api.1.customers.id.debits.status.200', 'besepa.GET.api.1.customers.retries']
+
+
+class TestPrometheusHooks(object):
+
+    def test_missing_prometheus_client(self, monkeypatch):
+        monkeypatch.setattr(metrics, 'prometheus_client', None)
+        with pytest.raises(besepa.exceptions.MissingConfig):
+            metrics.PrometheusHooks()
+
+    def test_metrics(self):
+        prometheus_client = pytest.importorskip('prometheus_client')
+        registry = prometheus_client.CollectorRegistry()
+        hooks = metrics.PrometheusHooks(registry=registry)
+        hooks.on_response(event(latency=0.5))
+        hooks.on_error(event(error=requests.Timeout()))
+
+        labels = {'method': 'GET', 'path': 'api/1/customers'}
+        assert registry.get_sample_value('besepa_request_duration_seconds_sum',
+                                         dict(labels, status='200')) == 0.5
+        assert registry.get_sample_value('besepa_request_errors_total', dict(labels, error='Timeout')) == 1
+        assert registry.get_sample_value('besepa_request_bytes_total', dict(labels, direction='in')) == 10
+
+
+class TestApiHooks(object):
+
+    def test_response(self):
+        hooks = Mock()
+        api = besepa.Api(api_key='dummy', hooks=[hooks])
+        api.session.request = Mock(return_value=Mock(
+            status_code=201, reason='Created', headers={'Besepa-Debug-Id': 'abc'}, content=b'{"response": {}}'))
+
+        api.http_call('https://sandbox.besepa.com/api/1/customers', 'POST', json={'name': 'Ender'})
+
+        request = hooks.on_request.call_args[0][0]
+        assert request is hooks.on_response.call_args[0][0]
+        assert (request.method, request.path, request.status) == ('POST', 'api/1/customers', 201)
+        assert (request.bytes_in, request.bytes_out, request.debug_id) == (16, 16, 'abc')
+        assert request.latency >= 0
+        assert not hooks.on_error.called
+
+    @pytest.mark.parametrize('outcome, error', [
+        (requests.ConnectionError(), requests.ConnectionError),
+        (Mock(status_code=404, reason='Not Found', headers={}, content=b''), besepa.exceptions.ResourceNotFound),
+    ])
+    def test_error(self, outcome, error):
+        api = besepa.Api(api_key='dummy')
+        hooks = api.add_hook(Mock())
+        if isinstance(outcome, Exception):
+            api.session.request = Mock(side_effect=outcome)
+        else:
+            api.session.request = Mock(return_value=outcome)
+
+        with pytest.raises(error):
+            api.http_call('https://sandbox.besepa.com/api/1/customers/1', 'GET')
+        assert isinstance(hooks.on_error.call_args[0][0].error, error)
+        assert hooks.on_response.called is not isinstance(outcome, Exception)
+
+    @patch('besepa.api.time.sleep')
+    def test_retry(self, sleep):
+        histogram = metrics.LatencyHistogram()
+        api = besepa.Api(api_key='dummy', hooks=[histogram])
+        api.http_call = Mock(side_effect=[requests.Timeout(), {'id': '1'}])
+
+        api.request('https://sandbox.besepa.com/api/1/customers/1', 'GET')
+        assert histogram.summary()[('GET', 'api/1/customers/{id}')]['retries'] == 1
+
+    def test_failing_hook_is_ignored(self):
+        hooks = Mock()
+        hooks.on_response.side_effect = ValueError()
+        api = besepa.Api(api_key='dummy', hooks=[hooks])
+        api.session.request = Mock(return_value=Mock(status_code=200, reason='OK', headers={},
+                                                     content=b'{"response": {"id": "1"}}'))
+
+        assert api.http_call('https://sandbox.besepa.com/api/1/customers/1', 'GET') == {'id': '1'}
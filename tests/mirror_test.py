@@ -0,0 +1,147 @@
+import json
+
+import pytest
+
+import besepa
+from besepa import mirror as mirror_module
+from besepa.mirror import Mirror, SyncResult, content_hash
+
+try:  # pragma: no cover
+    from unittest.mock import patch
+except ImportError:  # pragma: no cover
+    from mock import patch
+
+besepa.configure(api_key='dummy')
+
+
+class FakeListing(object):
+    """Paginated customer listing, recording the requested urls"""
+
+    def __init__(self, customers):
+        self.customers = customers
+        self.urls = []
+
+    def __call__(self, api, url):
+        self.urls.append(url)
+        query = dict(part.split('=') for part in url.split('?')[1].split('&'))
+        page, per_page = int(query['page']), int(query['per_page'])
+        customers = [customer for customer in self.customers
+                     if customer.get('updated_at', '') > query.get('updated_since', '')]
+        return customers[(page - 1) * per_page:page * per_page]
+
+
+def customer(i, name=None, updated_at='2019-10-01'):
+    return {'id': 'CUS%d' % i, 'name': name or 'Customer %d' % i, 'status': 'ACTIVE', 'updated_at': updated_at}
+
+
+@pytest.fixture
+def mirror():
+    with Mirror(':memory:') as mirror:
+        yield mirror
+
+
+def test_content_hash():
+    assert content_hash({'a': 1, 'b': {'c': 2}}) == content_hash({'b': {'c': 2}, 'a': 1})
+    assert content_hash({'a': 1}) != content_hash({'a': 2})
+
+
+class TestMirror(object):
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_sync(self, mock, mirror):
+        listing = mock.side_effect = FakeListing([customer(i) for i in range(5)])
+        assert mirror.sync(page_size=2) == SyncResult(added=5, updated=0, removed=0, unchanged=0)
+        assert len(mirror) == 5
+
+        listing.customers[1] = customer(1, name='Ender')
+        del listing.customers[3]
+        assert mirror.sync(page_size=2) == SyncResult(added=0, updated=1, removed=1, unchanged=3)
+        assert mirror.get('CUS1').name == 'Ender'
+        assert mirror.get('CUS3') is None
+        assert [resource.id for resource in mirror.all()] == ['CUS0', 'CUS1', 'CUS2', 'CUS4']
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_incremental_sync(self, mock, mirror):
+        mirror.since_param = 'updated_since'
+        listing = mock.side_effect = FakeListing([customer(i) for i in range(3)])
+        mirror.sync()
+        assert mirror.since() == '2019-10-01'
+
+        listing.customers.append(customer(3, updated_at='2019-10-02'))
+        listing.urls = []
+        assert mirror.sync() == SyncResult(added=1, updated=0, removed=0, unchanged=0)
+        assert 'updated_since=2019-10-01' in listing.urls[0]
+        assert mirror.since() == '2019-10-02'
+        assert len(mirror) == 4
+
+        listing.urls = []
+        assert mirror.sync(full=True) == SyncResult(added=0, updated=0, removed=0, unchanged=4)
+        assert 'updated_since' not in listing.urls[0]
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_filtered_sync_keeps_unlisted(self, mock, mirror):
+        listing = mock.side_effect = FakeListing([customer(i) for i in range(3)])
+        mirror.sync()
+        listing.customers = listing.customers[:1]
+        assert mirror.sync({'group_id': 1}).removed == 0
+        assert len(mirror) == 3
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_query(self, mock, mirror):
+        customers = [customer(i) for i in range(3)]
+        customers[2]['status'] = 'REMOVED'
+        mock.side_effect = FakeListing(customers)
+        mirror.sync()
+
+        active = mirror.all("json_extract(data, '$.status') = ?", ('ACTIVE',))
+        assert [resource.id for resource in active] == ['CUS0', 'CUS1']
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_refresh(self, mock, mirror):
+        mock.return_value = customer(1, name='Ender')
+        assert mirror.refresh('CUS1').name == 'Ender'
+        assert mirror.get('CUS1').name == 'Ender'
+
+        mock.side_effect = besepa.exceptions.ResourceNotFound(None)
+        assert mirror.refresh('CUS1') is None
+        assert len(mirror) == 0
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_bad_request(self, mock, mirror):
+        mock.return_value = {'error': {'error': 'invalid params'}}
+        with pytest.raises(besepa.exceptions.BadRequest):
+            mirror.sync()
+        with pytest.raises(besepa.exceptions.BadRequest):
+            mirror.refresh('CUS1')
+        assert len(mirror) == 0
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_large_pages(self, mock, mirror, monkeypatch):
+        monkeypatch.setattr(mirror_module, 'MAX_VARIABLES', 3)
+        mock.side_effect = FakeListing([customer(i) for i in range(7)])
+        assert mirror.sync(page_size=10) == SyncResult(added=7, updated=0, removed=0, unchanged=0)
+        assert mirror.sync(page_size=10) == SyncResult(added=0, updated=0, removed=0, unchanged=7)
+
+    @patch('mirror_test.besepa.Api.get', autospec=True)
+    def test_persistent(self, mock, tmpdir):
+        path = str(tmpdir.join('customers.db'))
+        mock.side_effect = FakeListing([customer(1)])
+        with Mirror(path) as mirror:
+            mirror.sync()
+        with Mirror(path) as mirror:
+            assert mirror.get('CUS1').name == 'Customer 1'
+
+
+def test_read_without_credentials(tmpdir, monkeypatch):
+    path = str(tmpdir.join('customers.db'))
+    with Mirror(path) as mirror:
+        mirror.db.execute('INSERT INTO customer (id, hash, data) VALUES (?, ?, ?)',
+                          ('CUS1', content_hash(customer(1)), json.dumps(customer(1))))
+        mirror.db.commit()
+
+    monkeypatch.setattr(besepa.api, '__api__', None)
+    monkeypatch.delenv('BESEPA_API_KEY', raising=False)
+    with Mirror(path) as mirror:
+        assert mirror.get('CUS1').name == 'Customer 1'
+        assert [resource.id for resource in mirror.all()] == ['CUS1']
+        assert len(mirror) == 1
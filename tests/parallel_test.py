@@ -0,0 +1,107 @@
+import json
+import time
+
+import pytest
+
+import besepa
+from besepa import parallel
+
+try:  # pragma: no cover
+    from unittest.mock import patch
+except ImportError:  # pragma: no cover
+    from mock import patch
+
+besepa.configure(api_key='dummy')
+
+
+def customer(i):
+    return {'id': str(i), 'name': 'Customer %d' % i, 'bank_account': {'iban': 'ES%02d' % i}}
+
+
+def pages(total, cap=None):
+    def get_content(api, url):
+        query = dict(part.split('=') for part in url.split('?')[1].split('&'))
+        page, per_page = int(query['page']), min(int(query['per_page']), cap or int(query['per_page']))
+        response = [customer(i) for i in range((page - 1) * per_page, min(page * per_page, total))]
+        return json.dumps({'response': response}).encode()
+    return get_content
+
+
+def test_parse_page():
+    content = json.dumps({'response': [customer(1), {'id': '2'}]}).encode()
+    codec = besepa.codec.get_codec('json')
+
+    assert parallel.parse_page(content, codec) == [customer(1), {'id': '2'}]
+    assert parallel.parse_page(content, codec, ['id', 'bank_account.iban']) == [
+        {'id': '1', 'bank_account': {'iban': 'ES01'}}, {'id': '2'}]
+    assert parallel.parse_page(content, codec, ['id', 'bank_account.iban'], records=True) == [
+        ('1', 'ES01'), ('2', None)]
+    assert parallel.parse_page(b'{"response": {"id": "1"}}', codec) == [{'id': '1'}]
+    assert parallel.parse_page(b'', codec) == []
+
+
+class TestIterAll(object):
+
+    @patch('parallel_test.besepa.Api.get_content', autospec=True)
+    def test_dicts(self, mock):
+        mock.side_effect = pages(25)
+
+        customers = list(parallel.iter_all(besepa.Customer, page_size=10, workers=2))
+        assert customers == [customer(i) for i in range(25)]
+        assert mock.call_args_list[0][0][1] == 'api/1/customers?per_page=10&page=1'
+
+    @patch('parallel_test.besepa.Api.get_content', autospec=True)
+    def test_stops_fetching_at_last_page(self, mock):
+        get_content = pages(25)
+
+        def slow(api, url):
+            time.sleep(0.1)
+            return get_content(api, url)
+        mock.side_effect = slow
+
+        customers = list(parallel.iter_all(besepa.Customer, page_size=10, workers=4))
+        assert customers == [customer(i) for i in range(25)]
+        # The third page is parsed while the fourth is fetched, which is the only one past the end
+        assert mock.call_count == 4
+
+    @patch('parallel_test.besepa.Api.get_content', autospec=True)
+    def test_single_page(self, mock):
+        mock.side_effect = pages(5)
+
+        customers = list(parallel.iter_all(besepa.Customer, page_size=10, workers=4))
+        assert customers == [customer(i) for i in range(5)]
+        assert mock.call_count == 2
+
+    @patch('parallel_test.besepa.Api.get_content', autospec=True)
+    def test_capped_page_size(self, mock):
+        mock.side_effect = pages(25, cap=4)
+
+        customers = list(parallel.iter_all(besepa.Customer, page_size=10, workers=2))
+        assert customers == [customer(i) for i in range(25)]
+
+    @patch('parallel_test.besepa.Api.get_content', autospec=True)
+    def test_single_object(self, mock):
+        mock.return_value = json.dumps({'response': customer(1)}).encode()
+
+        assert list(parallel.iter_all(besepa.Customer, workers=1)) == [customer(1)]
+
+    @patch('parallel_test.besepa.Api.get_content', autospec=True)
+    def test_records(self, mock):
+        mock.side_effect = pages(3)
+
+        records = list(parallel.iter_all(besepa.Customer, {'page': 2}, page_size=2, workers=1,
+                                         fields=['id', 'bank_account.iban'], records=True))
+        assert records == [('2', 'ES02')]
+        assert records[0].bank_account_iban == 'ES02'
+        assert 'page=2' in mock.call_args_list[0][0][1]
+
+    @patch('parallel_test.besepa.Api.get_content', autospec=True)
+    def test_fields(self, mock):
+        mock.side_effect = pages(2)
+
+        assert list(parallel.iter_all(besepa.Customer, fields=['name'], workers=1)) == [
+            {'name': 'Customer 0'}, {'name': 'Customer 1'}]
+
+    def test_records_require_fields(self):
+        with pytest.raises(besepa.exceptions.MissingParam):
+            next(parallel.iter_all(besepa.Customer, records=True))
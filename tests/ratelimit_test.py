@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+from besepa.ratelimit import RateLimiter, parse_retry_after
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestParseRetryAfter(object):
+    @pytest.mark.parametrize('value, expected', [
+        (None, None), ('', None), ('120', 120.0), ('1.5', 1.5), ('-3', 0.0), ('soon', None),
+        ('Wed, 21 Oct 2015 07:28:00 GMT', 0.0),
+    ])
+    def test_parse(self, value, expected):
+        assert parse_retry_after(value) == expected
+
+
+class TestRateLimiter(object):
+    def test_unlimited(self, clock):
+        limiter = RateLimiter(clock=clock)
+        assert all(limiter.reserve() == 0 for _ in range(1000))
+
+    def test_burst_then_paced(self, clock):
+        limiter = RateLimiter(10, burst=5, clock=clock)
+
+        assert [limiter.reserve() for _ in range(5)] == [0] * 5
+        assert limiter.reserve() == pytest.approx(0.1)
+        assert limiter.reserve() == pytest.approx(0.2)
+
+    def test_acquire_sleeps(self, clock):
+        limiter = RateLimiter(2, burst=1, clock=clock, sleep=clock.sleep)
+        start = clock.now
+        for _ in range(5):
+            limiter.acquire()
+
+        assert clock.now - start == pytest.approx(2.0)
+
+    def test_throttle_halves_rate_once_per_cooldown(self, clock):
+        limiter = RateLimiter(10, clock=clock)
+        limiter.throttle()
+        limiter.throttle()
+
+        assert limiter.rate == 5
+        assert limiter.throttled == 2
+        clock.now += 1
+        limiter.throttle()
+        assert limiter.rate == 2.5
+
+    def test_throttle_min_rate(self, clock):
+        limiter = RateLimiter(1, clock=clock, cooldown=0)
+        for _ in range(10):
+            limiter.throttle()
+
+        assert limiter.rate == 0.5
+
+    def test_succeed_recovers(self, clock):
+        limiter = RateLimiter(10, clock=clock, increase=1)
+        limiter.throttle()
+        for _ in range(3):
+            limiter.succeed()
+        assert limiter.rate == 8
+
+        for _ in range(10):
+            limiter.succeed()
+        assert limiter.rate == 10
+
+    def test_unlimited_starts_adapting_when_throttled(self, clock):
+        limiter = RateLimiter(clock=clock, increase=1)
+        # 20 requests per second, until the server pushes back
+        for _ in range(40):
+            assert limiter.reserve() == 0
+            clock.now += 0.05
+        limiter.throttle()
+
+        assert limiter.max_rate == pytest.approx(20)
+        assert limiter.rate == pytest.approx(limiter.max_rate / 2)
+        assert limiter.reserve() > 0
+        for _ in range(100):
+            limiter.succeed()
+        assert limiter.rate == limiter.max_rate
+
+    def test_not_adaptive(self, clock):
+        limiter = RateLimiter(clock=clock, adaptive=False)
+        for _ in range(5):
+            limiter.throttle()
+
+        assert limiter.rate is None
+        assert limiter.reserve() == 0
+
+        limiter = RateLimiter(10, clock=clock, adaptive=False)
+        limiter.throttle()
+        assert limiter.rate == 10
+
+    def test_retry_after_blocks(self, clock):
+        limiter = RateLimiter(clock=clock, adaptive=False)
+        limiter.throttle(retry_after=3)
+
+        assert limiter.reserve() == 3
+        clock.now += 3
+        assert limiter.reserve() == 0
+
+    def test_thread_safe(self):
+        limiter = RateLimiter(1000, burst=1, clock=lambda: 0.0)
+
+        def reserve():
+            for _ in range(250):
+                limiter.reserve()
+
+        threads = [threading.Thread(target=reserve) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert limiter.tokens == pytest.approx(1 - 1000)
@@ -1,11 +1,12 @@
 try:  # pragma: no cover
-    from unittest.mock import patch
+    from unittest.mock import Mock, patch
 except ImportError:  # pragma: no cover
-    from mock import patch
+    from mock import Mock, patch
 
 import pytest
 
 import besepa
+from besepa import util
 from besepa.resource import Create, Delete, Find, List, Post, Resource, Update
 
 besepa.configure(api_key='dummy')
@@ -85,6 +86,44 @@ class TestResource(object):
         assert resource.header == {'My-Header': 'testing'}
         assert resource.http_headers() == {'My-Header': 'testing'}
 
+    def test_compact(self):
+        resource = besepa.Customer({'id': '1', 'bank_account': {'id': 'BA1'}})
+
+        assert besepa.Customer.__dictoffset__ == 0
+        assert Resource.__dictoffset__ == 0
+        assert isinstance(resource.bank_account, Resource)
+        assert resource._header is None and resource._headers is None
+        assert resource.http_headers() == {}
+        assert resource._header is None and resource._headers is None
+
+    def test_lazy_headers(self):
+        resource = Resource({'name': 'testing'})
+        resource.headers['X-Test'] = '1'
+        resource.header = {'My-Header': 'testing'}
+
+        assert resource.http_headers() == {'My-Header': 'testing', 'X-Test': '1'}
+        assert 'headers' not in resource and 'header' not in resource
+
+    @pytest.mark.parametrize('path, resource_id, name', [
+        ('api/1/customers', '1', None),
+        ('api/1/customers', 1, 'debits'),
+        ('/api/1/customers/', '/1/', '/bank_accounts'),
+        ('/', 'CUS1', None),
+    ])
+    def test_resource_path(self, path, resource_id, name):
+        class TestResource(Resource):
+            pass
+        TestResource.path = path
+
+        parts = (str(resource_id),) if name is None else (str(resource_id), name)
+        assert TestResource.resource_path(resource_id, name) == util.join_url(path, *parts)
+
+    def test_class_attributes_are_data(self):
+        resource = besepa.Customer({'id': '1', 'path': 'other'})
+
+        assert resource['path'] == 'other'
+        assert besepa.Customer.path == 'api/1/customers'
+
     def test_passing_api(self):
         """
         Check that api objects are passed on to new resources when given
@@ -163,6 +202,67 @@ class TestResource(object):
         assert resource.success() is False
 
 
+class TestLazyResource(object):
+    data = {
+        'id': '1',
+        'bank_account': {'id': 'BA1', 'mandate': {'id': 'MA1'}},
+        'debits': [{'id': 'D1'}, {'id': 'D2'}],
+        'tags': ['a', 'b'],
+    }
+
+    @pytest.fixture
+    def api(self):
+        return besepa.Api(api_key='dummy', lazy=True)
+
+    def test_raw_until_accessed(self, api):
+        resource = besepa.Customer(self.data, api=api)
+
+        assert resource._pending == set(['bank_account', 'debits', 'tags'])
+        assert resource.__data__['bank_account'] is self.data['bank_account']
+        assert resource.id == '1'
+
+        bank_account = resource.bank_account
+        assert isinstance(bank_account, Resource)
+        assert bank_account.api is api
+        assert resource.bank_account is bank_account
+        assert isinstance(bank_account.mandate, Resource)
+        assert [debit.id for debit in resource['debits']] == ['D1', 'D2']
+        assert resource._pending == set(['tags'])
+
+    def test_to_dict(self, api):
+        resource = besepa.Customer(self.data, api=api)
+        resource.bank_account.status = 'ACTIVE'
+        result = resource.to_dict()
+
+        assert result['debits'] is self.data['debits']
+        assert result['bank_account'] == {'id': 'BA1', 'mandate': {'id': 'MA1'}, 'status': 'ACTIVE'}
+        assert 'status' not in self.data['bank_account']
+
+    def test_overwrite_pending(self, api):
+        resource = Resource(self.data, api=api)
+        resource.debits = []
+        resource['tags'] = ['c']
+        resource.merge({'bank_account': None})
+
+        assert resource.debits == []
+        assert resource.tags == ['c']
+        assert resource.bank_account is None
+        assert not resource._pending
+
+    def test_special_attributes(self, api):
+        resource = Resource({'error': 'failed', 'header': {'My-Header': 'testing'}}, api=api)
+
+        assert resource.error == 'failed'
+        assert resource.http_headers() == {'My-Header': 'testing'}
+
+    def test_matches_eager(self, api):
+        lazy = besepa.Customer(self.data, api=api)
+        eager = besepa.Customer(self.data)
+
+        assert lazy.to_dict() == eager.to_dict() == self.data
+        assert lazy.bank_account.mandate.id == eager.bank_account.mandate.id
+
+
 class TestCreate(object):
     @patch('resource_test.besepa.Api.post', autospec=True)
     def test_create(self, mock):
@@ -176,14 +276,25 @@ class TestCreate(object):
         mock.assert_called_once_with(resource.api, '/', {'testresource': attributes}, {})
         assert True is response
 
+    @patch('resource_test.besepa.Api.post', autospec=True)
+    def test_create_idempotency_key(self, mock):
+        class TestResource(Create):
+            path = '/'
+
+        resource = TestResource({'name': 'Ender Wiggin'})
+        resource.create(idempotency_key='key')
+
+        mock.assert_called_once_with(resource.api, '/', {'testresource': {'name': 'Ender Wiggin'}},
+                                     {'Idempotency-Key': 'key'})
+
 
 class TestList(object):
     @patch('resource_test.besepa.Api.get', autospec=True)
-    def test_all(self, mock):
+    def test_all(self, mock, monkeypatch):
         class TestResource(List):
             path = '/'
 
-        TestResource.convert_resources['response'] = TestResource
+        monkeypatch.setitem(besepa.resource.__resources__, 'response', TestResource)
         mock.return_value = {
             'count': 1, 'response': [{'id': '1', 'name': 'Ender Wiggin', 'taxid': '68571053A', 'reference': '1'}]}
         response = TestResource.all()
@@ -205,6 +316,127 @@ class TestList(object):
         assert isinstance(response[0], Resource)
 
 
+class TestIterAll(object):
+    @staticmethod
+    def pages(total):
+        def get(api, url):
+            query = dict(part.split('=') for part in url.split('?')[1].split('&'))
+            page, per_page = int(query['page']), int(query['per_page'])
+            return [{'id': str(i)} for i in range((page - 1) * per_page, min(page * per_page, total))]
+        return get
+
+    @pytest.mark.parametrize('prefetch', [False, True])
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_all(self, mock, prefetch):
+        class TestResource(List):
+            path = '/'
+
+        mock.side_effect = self.pages(7)
+        resources = list(TestResource.iter_all(page_size=3, prefetch=prefetch))
+
+        assert [resource.id for resource in resources] == [str(i) for i in range(7)]
+        assert all(isinstance(resource, Resource) for resource in resources)
+        assert mock.call_count == 3
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_all_lazy(self, mock):
+        class TestResource(List):
+            path = '/'
+
+        mock.side_effect = self.pages(100)
+        resources = TestResource.iter_all({'group_id': 1}, page_size=10)
+
+        assert next(resources).id == '0'
+        assert mock.call_count == 1
+        url = mock.call_args[0][1]
+        assert url.startswith('/?') and 'group_id=1' in url and 'per_page=10' in url and 'page=1' in url
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_all_exact_pages(self, mock):
+        class TestResource(List):
+            path = '/'
+
+        mock.side_effect = self.pages(6)
+        assert len(list(TestResource.iter_all({'page': 2}, page_size=3))) == 3
+        assert mock.call_count == 2
+
+    @pytest.mark.parametrize('prefetch', [False, True])
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_all_capped_page_size(self, mock, prefetch):
+        class TestResource(List):
+            path = '/'
+
+        pages = self.pages(25)
+        # The API answers at most 10 resources per page, whatever `per_page` asks for
+        mock.side_effect = lambda api, url: pages(api, url.replace('per_page=50', 'per_page=10'))
+        resources = list(TestResource.iter_all(page_size=50, prefetch=prefetch))
+
+        assert [resource.id for resource in resources] == [str(i) for i in range(25)]
+        assert mock.call_count == 3
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_all_single_object(self, mock):
+        class TestResource(List):
+            path = '/'
+
+        mock.return_value = {'id': '1'}
+        assert [resource.id for resource in TestResource.iter_all()] == ['1']
+        assert mock.call_count == 1
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_all_bad_request(self, mock):
+        class TestResource(List):
+            path = '/'
+
+        mock.return_value = {'error': {'error': 'bad page'}}
+        with pytest.raises(besepa.exceptions.BadRequest):
+            list(TestResource.iter_all())
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_pages(self, mock):
+        class TestResource(List):
+            path = '/'
+
+        mock.side_effect = self.pages(5)
+        pages = list(TestResource.iter_pages(page_size=2))
+
+        assert [page for page, _ in pages] == [1, 2, 3]
+        assert pages[2][1] == [{'id': '4'}]
+
+
+class TestFields(object):
+    page = [{'id': str(i), 'reference': 'R%d' % i, 'status': 'ACTIVE', 'name': 'Customer %d' % i,
+             'bank_accounts': [{'id': 'BA%d' % i, 'mandate': {'id': 'MA%d' % i}}]} for i in range(3)]
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_all(self, mock):
+        mock.return_value = self.page
+        customers = besepa.Customer.all({'group_id': 1}, fields=['id', 'reference', 'status'])
+
+        mock.assert_called_once_with(customers[0].api, 'api/1/customers?group_id=1')
+        assert [customer.to_dict() for customer in customers] == [
+            {'id': str(i), 'reference': 'R%d' % i, 'status': 'ACTIVE'} for i in range(3)]
+        assert self.page[0]['name'] == 'Customer 0'
+
+    def test_fields_param(self):
+        api = besepa.Api(api_key='dummy', fields_param='fields')
+        api.get = Mock(side_effect=[self.page, self.page[0]])
+
+        customers = besepa.Customer.all(fields=['id', 'status'], api=api)
+        besepa.Customer.find('1', fields=['id', 'status'], api=api)
+
+        assert [call[0][0] for call in api.get.call_args_list] == [
+            'api/1/customers?fields=id%2Cstatus', 'api/1/customers/1?fields=id%2Cstatus']
+        assert customers[2].to_dict() == {'id': '2', 'status': 'ACTIVE'}
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_iter_all(self, mock):
+        mock.side_effect = [self.page, []]
+        customers = list(besepa.Customer.iter_all(page_size=5, fields=['id', 'status']))
+
+        assert [customer.to_dict() for customer in customers] == [{'id': str(i), 'status': 'ACTIVE'} for i in range(3)]
+
+
 class TestFind(object):
     @patch('resource_test.besepa.Api.get', autospec=True)
     def test_find(self, mock):
@@ -216,6 +448,23 @@ class TestFind(object):
         mock.assert_called_once_with(test_resource.api, '/1')
         assert isinstance(test_resource, TestResource)
 
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_find_fields(self, mock):
+        mock.return_value = {'id': '1', 'status': 'ACTIVE', 'bank_account': {'id': 'BA1', 'iban': 'ES66'}}
+        customer = besepa.Customer.find('1', fields=['id', 'bank_account.iban'])
+
+        mock.assert_called_once_with(customer.api, 'api/1/customers/1')
+        assert customer.to_dict() == {'id': '1', 'bank_account': {'iban': 'ES66'}}
+        assert customer.status is None
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_find_fields_bad_request(self, mock):
+        mock.return_value = {'error': {'error': 'invalid id'}}
+        customer = besepa.Customer.find('1', fields=['id', 'status'])
+
+        assert not customer.success()
+        assert customer.error == {'error': 'invalid id'}
+
 
 class TestUpdate(object):
     @patch('resource_test.besepa.Api.patch', autospec=True)
@@ -233,6 +482,98 @@ class TestUpdate(object):
         assert True is response
         assert test_resource.to_dict() == updated_attributes
 
+    @patch('resource_test.besepa.Api.patch', autospec=True)
+    def test_update_changes(self, mock):
+        mock.return_value = {'id': '1', 'name': 'Andrew Wiggin'}
+        customer = besepa.Customer.from_response({'id': '1', 'name': 'Ender Wiggin',
+                                                  'bank_accounts': [{'iban': 'ES66'}]})
+
+        assert customer.update() is True
+        assert not mock.called
+
+        customer.name = 'Andrew Wiggin'
+        assert customer.update() is True
+        mock.assert_called_once_with(customer.api, 'api/1/customers/1', {'name': 'Andrew Wiggin'}, {})
+        assert not customer.is_dirty()
+
+    @patch('resource_test.besepa.Api.patch', autospec=True)
+    def test_update_not_loaded(self, mock):
+        mock.return_value = {'id': '1', 'name': 'Andrew'}
+        customer = besepa.Customer({'id': '1', 'name': 'Andrew'})
+
+        assert customer.update() is True
+        mock.assert_called_once_with(customer.api, 'api/1/customers/1', {'id': '1', 'name': 'Andrew'}, {})
+        # Merged with the response, it is loaded now
+        mock.reset_mock()
+        assert customer.update() is True
+        assert not mock.called
+
+    @patch('resource_test.besepa.Api.get', autospec=True)
+    def test_find_loaded(self, mock):
+        mock.return_value = {'id': '1', 'name': 'Ender', 'bank_accounts': [{'id': 'BA1', 'iban': 'ES66'}]}
+        customer = besepa.Customer.find('1')
+
+        with patch('resource_test.besepa.Api.patch', autospec=True) as patch_mock:
+            assert customer.update() is True
+            assert not patch_mock.called
+
+    @patch('resource_test.besepa.Api.patch', autospec=True)
+    def test_update_failed_stays_dirty(self, mock):
+        mock.return_value = {'error': {'name': 'invalid'}}
+        customer = besepa.Customer({'id': '1', 'name': 'Ender Wiggin'})
+        customer['name'] = ''
+
+        assert customer.update() is False
+        assert customer.changes() == {'name': ''}
+
+
+class TestDirty(object):
+
+    def test_changes(self):
+        resource = Resource({'id': '1', 'name': 'Ender', 'mandate': {'status': 'SIGNED'},
+                             'bank_accounts': [{'iban': 'ES66'}, {'iban': 'ES77'}]})
+        assert not resource.is_dirty()
+        assert resource.changes() == {}
+
+        resource.name = 'Andrew'
+        resource['reference'] = 'R1'
+        resource.error = 'not a field'
+        assert resource.is_dirty()
+        assert resource.changes() == {'name': 'Andrew', 'reference': 'R1'}
+
+    def test_nested_changes_sent_whole(self):
+        resource = Resource({'id': '1', 'mandate': {'id': 'M1', 'status': 'SIGNED'},
+                             'bank_accounts': [{'iban': 'ES66'}, {'iban': 'ES77'}]})
+        resource.mandate.status = 'REVOKED'
+        resource.bank_accounts[1].iban = 'ES88'
+
+        assert resource.changes() == {'mandate': {'id': 'M1', 'status': 'REVOKED'},
+                                      'bank_accounts': [{'iban': 'ES66'}, {'iban': 'ES88'}]}
+        resource.mark_clean(['mandate'])
+        assert not resource.mandate.is_dirty()
+        assert list(resource.changes()) == ['bank_accounts']
+        resource.mark_clean()
+        assert not resource.is_dirty()
+
+    def test_merge_cleans_merged_keys(self):
+        resource = Resource({'id': '1', 'name': 'Ender'})
+        resource.name = 'Andrew'
+        resource.status = 'ACTIVE'
+
+        resource.merge({'name': 'Andrew Wiggin', 'error': None})
+        assert resource.changes() == {'status': 'ACTIVE'}
+        assert resource.name == 'Andrew Wiggin'
+
+    def test_lazy(self):
+        api = besepa.Api(api_key='dummy', lazy=True)
+        resource = Resource({'id': '1', 'mandate': {'status': 'SIGNED'}, 'tags': ['a']}, api=api)
+        assert not resource.is_dirty()
+
+        resource.tags = ['b']
+        assert resource.changes() == {'tags': ['b']}
+        resource.mandate.status = 'REVOKED'
+        assert resource.changes() == {'tags': ['b'], 'mandate': {'status': 'REVOKED'}}
+
 
 class TestDelete(object):
     @patch('resource_test.besepa.Api.delete', autospec=True)
@@ -262,3 +603,13 @@ class TestPost(object):
 
         mock.assert_called_once_with(resource.api, '/1/test', attributes, {})
         assert True is response
+
+    @patch('resource_test.besepa.Api.post', autospec=True)
+    def test_post_idempotency_key(self, mock):
+        class TestResource(Post):
+            path = '/'
+
+        resource = TestResource({'id': '1'})
+        resource.post('test', {'name': 'Ender'}, idempotency_key='key')
+
+        mock.assert_called_once_with(resource.api, '/1/test', {'name': 'Ender'}, {'Idempotency-Key': 'key'})
@@ -0,0 +1,62 @@
+from collections import namedtuple
+
+import pytest
+import requests
+
+from besepa import exceptions
+from besepa.retry import RetryPolicy
+
+Response = namedtuple('Response', 'status_code reason headers')
+
+
+def server_error(status=503, headers=None):
+    return exceptions.ServerError(Response(status, 'Unavailable', headers or {}))
+
+
+class TestRetryPolicy(object):
+
+    @pytest.mark.parametrize('method, error, retryable', [
+        ('GET', requests.ConnectionError(), True),
+        ('get', requests.Timeout(), True),
+        ('DELETE', server_error(), True),
+        ('GET', exceptions.TooManyRequests(Response(429, '', {})), True),
+        ('GET', exceptions.ResourceNotFound(Response(404, '', {})), False),
+        ('GET', server_error(501), False),
+        ('POST', requests.ConnectionError(), False),
+        ('PATCH', server_error(), False),
+        ('GET', ValueError(), False),
+    ])
+    def test_is_retryable(self, method, error, retryable):
+        assert RetryPolicy().is_retryable(method, error) is retryable
+
+    def test_methods(self):
+        assert RetryPolicy(methods=['post']).is_retryable('POST', requests.ConnectionError())
+
+    def test_delay_exponential_capped(self):
+        policy = RetryPolicy(backoff=1, cap=5, jitter=False)
+
+        assert [policy.delay(attempt) for attempt in range(1, 6)] == [1, 2, 4, 5, 5]
+
+    def test_delay_jitter(self):
+        policy = RetryPolicy(backoff=1, cap=5)
+
+        assert all(0 <= policy.delay(3) <= 4 for _ in range(100))
+
+    def test_delay_retry_after(self):
+        policy = RetryPolicy(backoff=0.1, cap=10, jitter=False)
+
+        assert policy.delay(1, server_error(headers={'Retry-After': '3'})) == 3
+        assert policy.delay(1, server_error(headers={'Retry-After': '60'})) == 10
+
+    def test_next_delay(self):
+        calls = []
+        policy = RetryPolicy(max_attempts=3, backoff=1, jitter=False, on_retry=lambda *args: calls.append(args))
+        error = requests.ConnectionError()
+
+        assert policy.next_delay('GET', 'url', 1, error) == 1
+        assert policy.next_delay('GET', 'url', 2, error) == 2
+        assert policy.next_delay('GET', 'url', 3, error) is None
+        assert policy.next_delay('POST', 'url', 1, error) is None
+        assert policy.retries == 2
+        assert policy.slept == 3
+        assert calls == [('GET', 'url', 1, 1, error), ('GET', 'url', 2, 2, error)]
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from besepa.singleflight import SingleFlight
+
+
+class TestSingleFlight(object):
+
+    def test_coalesces_concurrent_calls(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait(5)
+            return {'id': '1'}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do('key', func))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while flights.stats()['coalesced'] < 7:
+            release.wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [1]
+        assert results == [{'id': '1'}] * 8
+        assert flights.stats() == {'requests': 1, 'coalesced': 7, 'in_flight': 0}
+
+    def test_sequential_calls_not_coalesced(self):
+        flights = SingleFlight()
+
+        assert flights.do('a', lambda: 1) == 1
+        assert flights.do('a', lambda: 2) == 2
+        assert flights.do('b', lambda: 3) == 3
+        assert flights.stats() == {'requests': 3, 'coalesced': 0, 'in_flight': 0}
+
+    def test_error_shared(self):
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError('boom')
+
+        def call():
+            try:
+                flights.do('key', fail)
+            except ValueError as error:
+                errors.append(error)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        while flights.stats()['coalesced'] < 1:
+            release.wait(0.001)
+        release.set()
+        leader.join()
+        follower.join()
+
+        assert len(errors) == 2 and errors[0] is errors[1]
+        assert len(flights) == 0
+        with pytest.raises(KeyError):
+            flights.do('key', lambda: {}['missing'])
@@ -27,6 +27,38 @@ class TestUtil(object):
         url = util.join_url(*parts)
         assert url == expected
 
+    @pytest.mark.parametrize('fields, expected', [
+        (['id', 'missing'], {'id': '1'}),
+        (['id', 'bank_account.mandate.status', 'missing.field'], {'id': '1', 'bank_account': {'mandate': {
+            'status': 'SIGNED'}}}),
+        (['tags.1', 'tags.5'], {'tags': ['b']}),
+        (['bank_account', 'bank_account.iban'], {'bank_account': {'iban': 'ES66', 'mandate': {'status': 'SIGNED'}}}),
+        ([], {}),
+    ])
+    def test_project(self, fields, expected):
+        data = {'id': '1', 'name': 'Ender', 'tags': ['a', 'b'],
+                'bank_account': {'iban': 'ES66', 'mandate': {'status': 'SIGNED'}}}
+        assert util.project(data, fields) == expected
+
+    @pytest.mark.parametrize('fields, expected', [
+        (['bank_accounts.iban'], {'bank_accounts': [{'iban': 'ES66'}, {'iban': 'ES77'}, {}]}),
+        (['bank_accounts.0.iban'], {'bank_accounts': [{'iban': 'ES66'}]}),
+        (['bank_accounts.1.iban', 'bank_accounts.1.id'], {'bank_accounts': [{'id': 'BA2', 'iban': 'ES77'}]}),
+        (['bank_accounts.mandate.status'], {'bank_accounts': [
+            {'mandate': {'status': 'SIGNED'}}, {}, {'mandate': {'status': 'REVOKED'}}]}),
+        (['bank_accounts.id', 'bank_accounts.0.iban'], {'bank_accounts': [
+            {'id': 'BA1', 'iban': 'ES66'}, {'id': 'BA2'}, {'id': 'BA3'}]}),
+        (['bank_accounts.2'], {'bank_accounts': [{'id': 'BA3', 'mandate': {'status': 'REVOKED'}}]}),
+        (['bank_accounts.missing', 'bank_accounts.7.iban'], {}),
+    ])
+    def test_project_lists(self, fields, expected):
+        data = {'id': '1', 'bank_accounts': [
+            {'id': 'BA1', 'iban': 'ES66', 'mandate': {'status': 'SIGNED'}},
+            {'id': 'BA2', 'iban': 'ES77'},
+            {'id': 'BA3', 'mandate': {'status': 'REVOKED'}},
+        ]}
+        assert util.project(data, fields) == expected
+
     def test_join_url_params(self):
         single_param_url = util.join_url_params('customers', {'per_page': 1})
         multiple_params_url = util.join_url_params('customers', {'per_page': 1, 'group_id': 4321})
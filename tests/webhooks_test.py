@@ -0,0 +1,24 @@
+try:  # pragma: no cover
+    from unittest.mock import patch
+except ImportError:  # pragma: no cover
+    from mock import patch
+import besepa
+
+besepa.configure(api_key='dummy')
+
+
+class TestWebhook(object):
+
+    @patch('webhooks_test.besepa.Api.post', autospec=True)
+    def test_create(self, mock):
+        mock.return_value = {'id': 'WH1', 'url': 'https://example.com/besepa'}
+        webhook = besepa.Webhook({'url': 'https://example.com/besepa'})
+
+        assert webhook.create()
+        mock.assert_called_once_with(webhook.api, 'api/1/webhooks', {'webhook': {'url': 'https://example.com/besepa'}},
+                                     {})
+
+    @patch('webhooks_test.besepa.Api.get', autospec=True)
+    def test_all(self, mock):
+        mock.return_value = [{'id': 'WH1'}, {'id': 'WH2'}]
+        assert [webhook.id for webhook in besepa.Webhook.all()] == ['WH1', 'WH2']